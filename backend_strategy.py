@@ -0,0 +1,166 @@
+# backend_strategy.py
+"""
+Выбор способа выполнения операции, у которой есть несколько равноценных путей
+(net user или PowerShell, schtasks или COM-скрипт планировщика).
+
+Strategy(операция, [(способ, функция), ...]).run(...) пробует способы по очереди до первого
+успешного. Для каждого способа запоминаются средняя длительность успешных вызовов и итог:
+  - первым пробуется самый быстрый из работающих способов, затем ещё не опробованные
+    (в порядке списка), последними - нерабочие;
+  - способ считается нерабочим, если он не сработал, а следующий в том же вызове сработал.
+    Если не сработал ни один, ошибка скорее во входных данных (нет такого пользователя),
+    и оценки не меняются;
+  - способ, который не пробовали дольше BACKEND_REPROBE_MINUTES минут (ещё не опробованный -
+    столько после первого вызова операции), один раз ставится первым - так выясняется, что
+    нерабочий способ починился или другой стал быстрее.
+Оценки хранятся в bot_state (раздел "backends") и переживают перезапуск бота.
+Функция способа возвращает (успех, значение); исключение считается неуспехом.
+"""
+import os
+import time
+import logging
+import threading
+
+import bot_state
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPROBE_MINUTES = 60
+SMOOTHING = 0.3          # вес нового замера в средней длительности
+STATE_SECTION = "backends"
+
+_stats = None            # "операция/способ" -> {"ok", "seconds", "tried", "successes", "failures"}
+_strategies = []         # созданные стратегии, для report()
+_lock = threading.Lock()
+
+
+def reprobe_interval():
+    try:
+        return float(os.getenv("BACKEND_REPROBE_MINUTES", DEFAULT_REPROBE_MINUTES)) * 60
+    except ValueError:
+        return DEFAULT_REPROBE_MINUTES * 60
+
+
+def _load():
+    global _stats
+    if _stats is None:
+        _stats = {key: dict(entry) for key, entry in (bot_state.get(STATE_SECTION) or {}).items()}
+    return _stats
+
+
+class Strategy:
+    """Операция operation с несколькими способами backends: [(имя, функция)]."""
+
+    def __init__(self, operation, backends):
+        self.operation = operation
+        self.backends = list(backends)
+        with _lock:
+            _strategies.append(self)
+
+    def _key(self, name):
+        return f"{self.operation}/{name}"
+
+    def order(self):
+        """Имена способов в порядке, в котором их попробует следующий run()."""
+        now = time.time()
+        with _lock:
+            stats = _load()
+            entries = [(stats.get(self._key(name)) or {}, index, name)
+                       for index, (name, _) in enumerate(self.backends)]
+
+            def rank(item):
+                entry, index, _ = item
+                seconds = entry.get("seconds")
+                return (entry.get("ok") is False, seconds if seconds is not None else float("inf"), index)
+
+            entries.sort(key=rank)
+            # Перепроверка - только когда у операции уже есть история (первый вызов идёт по порядку)
+            due = [item for item in entries[1:] if now - item[0].get("tried", 0) >= reprobe_interval()]
+            if "tried" not in entries[0][0]:
+                due = []
+            if due:
+                reprobe = min(due, key=lambda item: item[0].get("tried", 0))
+                entries.remove(reprobe)
+                entries.insert(0, reprobe)
+                # Отметка сразу: параллельный вызов не станет перепроверять тот же способ
+                stats.setdefault(self._key(reprobe[2]), {})["tried"] = now
+        return [name for _, _, name in entries]
+
+    def run(self, *args, **kwargs):
+        """
+        Выполняет операцию первым сработавшим способом.
+        Возвращает (успех, значение, способ); если не сработал ни один -
+        (False, значение первой попытки, None).
+        """
+        functions = dict(self.backends)
+        attempts = []  # [(способ, успех, секунд)]
+        failure = None
+        for name in self.order():
+            started = time.perf_counter()
+            try:
+                ok, value = functions[name](*args, **kwargs)
+            except Exception as e:
+                logger.warning("%s: способ %s завершился исключением: %s", self.operation, name, e)
+                ok, value = False, str(e)
+            attempts.append((name, ok, time.perf_counter() - started))
+            if ok:
+                self._record(attempts)
+                return True, value, name
+            if failure is None:
+                failure = value
+        self._record(attempts)
+        return False, failure, None
+
+    def _record(self, attempts):
+        now = time.time()
+        succeeded = any(ok for _, ok, _ in attempts)
+        with _lock:
+            stats = _load()
+            for name, ok, seconds in attempts:
+                entry = stats.setdefault(self._key(name), {})
+                entry["tried"] = now
+                metrics.observe("backend_seconds", seconds, "backend", self._key(name))
+                if ok:
+                    previous = entry.get("seconds")
+                    entry["seconds"] = seconds if previous is None else previous + SMOOTHING * (seconds - previous)
+                    entry["successes"] = entry.get("successes", 0) + 1
+                    entry["ok"] = True
+                else:
+                    metrics.inc("backend_errors", "backend", self._key(name))
+                    entry["failures"] = entry.get("failures", 0) + 1
+                    if succeeded and entry.get("ok") is not False:
+                        logger.info("%s: способ %s не работает, дальше он пробуется последним",
+                                    self.operation, name)
+                        entry["ok"] = False
+            # Ещё не опробованные способы впервые перепроверяются через BACKEND_REPROBE_MINUTES
+            # после первого вызова, а не сразу во втором
+            for name, _ in self.backends:
+                stats.setdefault(self._key(name), {}).setdefault("tried", now)
+            bot_state.put(STATE_SECTION, {key: dict(entry) for key, entry in stats.items()})
+
+    def describe(self):
+        """"user.block: net user ❌, PowerShell ✅ 310 мс" - способы в порядке предпочтения."""
+        with _lock:
+            stats = _load()
+            entries = {name: dict(stats.get(self._key(name)) or {}) for name, _ in self.backends}
+        parts = []
+        for name, entry in sorted(entries.items(), key=lambda item: (
+                item[1].get("ok") is False, item[1].get("seconds", float("inf")))):
+            if entry.get("ok") is None:
+                parts.append(f"{name} -")
+            elif entry["ok"]:
+                parts.append(f"{name} ✅ {entry['seconds'] * 1000:.0f} мс")
+            else:
+                parts.append(f"{name} ❌")
+        return f"{self.operation}: " + ", ".join(parts)
+
+
+def report():
+    """Способы выполнения операций для /stats (только операции загруженных модулей)."""
+    with _lock:
+        strategies = list(_strategies)
+    if not strategies:
+        return "⚙️ Способы выполнения: нет данных"
+    return "⚙️ Способы выполнения (по предпочтению):\n" + "\n".join(
+        f"• {strategy.describe()}" for strategy in strategies)
@@ -1,9 +1,63 @@
 # backup_monitoring.py
-import subprocess
 import re
-import chardet
 from datetime import datetime, timedelta
 import os
+import tracing
+import command_runner
+import disk_inventory
+import backend_strategy
+from command_runner import decode_output
+from output_grammar import Grammar, Field, choice, pattern, timestamp
+from service_watcher import get_service_status
+from progressive_report import ProgressiveReport, Section
+
+VERSIONS_SHOWN = 5  # копий в списке версий; весь каталог - на экране подробностей
+
+# wbadmin get versions [-summary]: блок на каждую версию, начинается со времени архивации
+BACKUP_VERSIONS_GRAMMAR = Grammar("wbadmin get versions", [
+    Field("time", {"ru-RU": ("Время архивации",), "en-US": ("Backup time",)}, convert=timestamp, start=True),
+    # "Несъемный диск с именем E:" / "Fixed Disk labeled E:" -> "E:"
+    Field("target", {"ru-RU": ("Конечный объект архивации",), "en-US": ("Backup target",)},
+          convert=pattern(r"\b([A-Za-z]:)")),
+    Field("version", {"ru-RU": ("Идентификатор версии",), "en-US": ("Version identifier",)}),
+    # Итог архивации, если wbadmin его выводит: ✅ / ❌
+    Field("result", {"ru-RU": ("Состояние", "Результат"), "en-US": ("Status", "Result")},
+          convert=choice({"ru-RU": {"успе": "✅", "ошибк": "❌", "неудач": "❌"},
+                          "en-US": {"success": "✅", "error": "❌", "fail": "❌"}})),
+])
+
+# schtasks /query /fo LIST: блок на каждую задачу
+TASK_SCHEDULE_GRAMMAR = Grammar("schtasks /fo LIST", [
+    Field("task", {"ru-RU": ("Имя задачи",), "en-US": ("TaskName",)}, start=True),
+    Field("type", {"ru-RU": ("Тип расписания",), "en-US": ("Schedule Type",)},
+          convert=choice({"ru-RU": {"ежедневно": "Ежедневно", "еженедельно": "Еженедельно"},
+                          "en-US": {"daily": "Ежедневно", "weekly": "Еженедельно"}})),
+    Field("time", {"ru-RU": ("Время запуска",), "en-US": ("Start Time",)}),
+])
+
+# Чтение расписания задач Windows Backup через COM-объект планировщика
+BACKUP_SCHEDULE_PS_SCRIPT = r'''
+try {
+    $scheduler = New-Object -ComObject Schedule.Service;
+    $scheduler.Connect();
+    $folder = $scheduler.GetFolder('\Microsoft\Windows\Backup');
+    $tasks = $folder.GetTasks(0);
+    foreach ($task in $tasks) {
+        $def = $task.Definition;
+        foreach ($tr in $def.Triggers) {
+            try {
+                $start = [datetime]::Parse($tr.StartBoundary);
+                $time = $start.ToString('HH:mm');
+                if ($tr.Type -eq 2) { Write-Output "Daily at $time"; }
+                elseif ($tr.Type -eq 3) { Write-Output "Weekly at $time"; }
+                else { Write-Output "Scheduled at $time"; }
+                break;
+            } catch {}
+        }
+        break;
+    }
+} catch { Write-Output 'Error accessing scheduler'; }
+'''
 
 def get_backup_status():
     """
@@ -14,45 +68,37 @@ def get_backup_status():
     Возвращает отформатированную строку с информацией.
     """
     try:
-        status_lines = []
-        
-        # 1. Получаем информацию о последних резервных копиях
-        last_backup_info = _get_last_backup_info()
-        status_lines.append("📁 Состояние резервных копий:")
-        status_lines.append(f"- Последняя копия: {last_backup_info}")
-        
-        # 2. Проверяем расписание
-        schedule_info = _get_backup_schedule()
-        status_lines.append(f"- Расписание: {schedule_info}")
-        
-        # 3. Проверяем место хранения (только если удается определить)
-        storage_info = _get_storage_info()
-        status_lines.extend(storage_info)
-        
-        return "\n".join(status_lines)
+        return backup_status_report().collect()
         
     except Exception as e:
         return f"❌ Ошибка получения данных о резервных копиях: {str(e)}"
 
-def get_backup_versions():
+def backup_status_report(max_age=None):
+    """
+    Отчёт о резервных копиях по секциям (последняя копия, расписание, место хранения).
+    Секции собираются параллельно; бот показывает их в одном сообщении по мере готовности.
+    Одновременные запросы нескольких администраторов выполняют wbadmin один раз (probe_cache);
+    max_age=0 - не брать недавний результат (кнопка "Обновить").
+    """
+    sections = [
+        Section("last_backup", "- Последняя копия", _get_last_backup_info, cache_key="backup.last_backup"),
+        Section("schedule", "- Расписание", _get_backup_schedule, cache_key="backup.schedule"),
+        # Место хранения показываем, только если удается определить
+        Section("storage", None, lambda: "\n".join(_get_storage_info()) or None,
+                placeholder="- Место хранения: ⏳", cache_key="backup.storage"),
+    ]
+    return ProgressiveReport("📁 Состояние резервных копий:", sections, max_age=max_age)
+
+def get_backup_versions(limit=VERSIONS_SHOWN):
     """
     Получает детальный список версий резервных копий.
+    limit - сколько последних копий показать (None - весь каталог).
     Возвращает отформатированную строку со списком копий.
     """
     try:
         cmd = "wbadmin get versions"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Применяем тот же подход декодирования что в user_management.py
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
+        proc = command_runner.run(cmd)
+        decoded_output = decode_output(proc.stdout)
         
         if proc.returncode != 0:
             return "❌ Не удалось получить список версий резервных копий. Возможно, Windows Server Backup не настроен."
@@ -60,13 +106,13 @@ def get_backup_versions():
         lines = []
         lines.append("📋 Список резервных копий:")
         
-        # Парсим вывод wbadmin get versions для русской локализации
-        backup_entries = _parse_backup_versions_ru(decoded_output)
+        # Парсим вывод wbadmin get versions (русская и английская локализация)
+        backup_entries = _parse_backup_versions(decoded_output)
         
         if not backup_entries:
             lines.append("🔍 Резервные копии не найдены")
         else:
-            for entry in backup_entries[-5:]:  # Показываем последние 5 копий
+            for entry in backup_entries[-limit if limit else None:]:  # Показываем последние limit копий
                 lines.append(f"• {entry}")
         
         return "\n".join(lines)
@@ -82,7 +128,7 @@ def start_manual_backup():
     try:
         # Сначала проверяем, настроено ли резервное копирование
         cmd = "wbadmin get schedule"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
+        proc = command_runner.run(cmd)
         
         if proc.returncode != 0:
             return False, "❌ Резервное копирование не настроено. Сначала необходимо настроить Windows Server Backup."
@@ -117,6 +163,7 @@ def check_backup_disk_space():
             return "\n".join(lines)
         
         # Проверяем свободное место на каждом диске
+        # (все диски опрашиваются один раз, дальше данные берутся из кэша)
         for drive in target_drives:
             space_info = _get_drive_space(drive)
             lines.append(f"- Диск {drive}: {space_info}")
@@ -132,71 +179,23 @@ def _get_last_backup_info():
     """Получает информацию о последней резервной копии"""
     try:
         cmd = "wbadmin get versions"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Применяем тот же подход декодирования что в VPN модуле
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
+        proc = command_runner.run(cmd)
+        decoded_output = decode_output(proc.stdout)
         
         if proc.returncode != 0:
             return "❌ Не настроено"
         
-        # Ищем последнюю копию - улучшенный парсинг для русской локализации
-        lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
+        # Последняя копия - самое позднее время архивации среди версий (русский и английский вывод)
+        versions = [version for version in BACKUP_VERSIONS_GRAMMAR.records(decoded_output) if "time" in version]
         
-        # Ищем строки с датой и временем в различных форматах
-        date_patterns = [
-            r'(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})',  # 09.09.2025 23:00
-            r'(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})',    # 09/09/2025 23:00
-            r'(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2})',    # 2025-09-09 23:00
-        ]
-        
-        latest_date = None
-        latest_time = None
-        latest_status = None
-        
-        for line in lines:
-            for pattern in date_patterns:
-                match = re.search(pattern, line)
-                if match:
-                    date_str = match.group(1)
-                    time_str = match.group(2)
-                    
-                    try:
-                        # Пытаемся разобрать дату в разных форматах
-                        if '.' in date_str:
-                            backup_datetime = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-                        elif '/' in date_str:
-                            backup_datetime = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M")
-                        else:
-                            backup_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-                        
-                        if latest_date is None or backup_datetime > latest_date:
-                            latest_date = backup_datetime
-                            latest_time = time_str
-                            
-                            # Ищем статус в той же строке или следующих
-                            if "успех" in line.lower():
-                                latest_status = "✅"
-                            elif "ошибка" in line.lower() or "неудач" in line.lower():
-                                latest_status = "❌"
-                            
-                    except ValueError:
-                        continue
-        
-        if latest_date:
-            now = datetime.now()
-            status_indicator = latest_status if latest_status else ""
+        if versions:
+            latest = max(versions, key=lambda version: version["time"])
+            latest_date = latest["time"]
+            latest_time = latest_date.strftime("%H:%M")
+            status_indicator = latest.get("result", "")
             
             # Сравниваем только даты (без времени)
-            today = now.date()
+            today = datetime.now().date()
             backup_date = latest_date.date()
             
             if backup_date == today:
@@ -215,77 +214,51 @@ def _get_last_backup_info():
     except Exception as e:
         return f"❌ Ошибка: {str(e)}"
 
+def _schedule_from_schtasks():
+    """Расписание задачи Windows Backup по выводу schtasks; (успех, текст)"""
+    # Используем schtasks для получения информации о задачах Windows Backup
+    cmd = 'schtasks /query /fo CSV /tn "\\Microsoft\\Windows\\Backup\\*"'
+    proc = command_runner.run(cmd)
+    
+    if proc.returncode == 0:
+        decoded_output = decode_output(proc.stdout)
+        
+        # Парсим CSV вывод
+        lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
+        
+        if len(lines) > 1:  # Есть заголовок + данные
+            # Ищем задачи, содержащие "Backup" или "WindowsBackup"
+            for line in lines[1:]:  # Пропускаем заголовок
+                if "backup" in line.lower() and "ready" in line.lower():
+                    # Получаем детальную информацию о найденной задаче
+                    task_name = line.split(',')[0].strip('"')
+                    schedule_info = _get_task_schedule_details(task_name)
+                    if schedule_info:
+                        return True, schedule_info
+    return False, None
+
+def _schedule_from_powershell():
+    """Расписание через COM планировщика (скрипт в постоянном процессе PowerShell); (успех, текст)"""
+    ps_ok, ps_output = command_runner.run_powershell(BACKUP_SCHEDULE_PS_SCRIPT)
+    if ps_ok and ps_output.strip() and "error" not in ps_output.lower():
+        return True, f"🟢 {ps_output.strip()}"
+    return False, None
+
+# schtasks или COM-скрипт: порядок выбирает backend_strategy по тому, что работает на этом сервере
+_schedule_strategy = backend_strategy.Strategy("backup.schedule", [
+    ("schtasks", _schedule_from_schtasks),
+    ("PowerShell COM", _schedule_from_powershell),
+])
+
 def _get_backup_schedule():
     """Получает информацию о расписании резервного копирования через Task Scheduler"""
     try:
-        # Используем schtasks для получения информации о задачах Windows Backup
-        cmd = 'schtasks /query /fo CSV /tn "\\Microsoft\\Windows\\Backup\\*"'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
+        found, schedule_info, _ = _schedule_strategy.run()
+        if found:
+            return schedule_info
         
-        if proc.returncode == 0:
-            raw_bytes = proc.stdout
-            detected = chardet.detect(raw_bytes)
-            detected_encoding = detected.get("encoding", None)
-            confidence = detected.get("confidence", 0)
-            
-            if detected_encoding and confidence > 0.5:
-                decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-            else:
-                decoded_output = raw_bytes.decode("cp866", errors="replace")
-            
-            # Парсим CSV вывод
-            lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
-            
-            if len(lines) > 1:  # Есть заголовок + данные
-                # Ищем задачи, содержащие "Backup" или "WindowsBackup"
-                for line in lines[1:]:  # Пропускаем заголовок
-                    if "backup" in line.lower() and "ready" in line.lower():
-                        # Получаем детальную информацию о найденной задаче
-                        task_name = line.split(',')[0].strip('"')
-                        schedule_info = _get_task_schedule_details(task_name)
-                        if schedule_info:
-                            return schedule_info
-        
-        # Альтернативный метод - PowerShell команда (упрощенная версия вашего скрипта)
-        ps_cmd = '''powershell -Command "& {
-            try {
-                $scheduler = New-Object -ComObject Schedule.Service;
-                $scheduler.Connect();
-                $folder = $scheduler.GetFolder('\\Microsoft\\Windows\\Backup');
-                $tasks = $folder.GetTasks(0);
-                foreach ($task in $tasks) {
-                    $def = $task.Definition;
-                    foreach ($tr in $def.Triggers) {
-                        try {
-                            $start = [datetime]::Parse($tr.StartBoundary);
-                            $time = $start.ToString('HH:mm');
-                            if ($tr.Type -eq 2) { Write-Host 'Daily at' $time; }
-                            elseif ($tr.Type -eq 3) { Write-Host 'Weekly at' $time; }
-                            else { Write-Host 'Scheduled at' $time; }
-                            break;
-                        } catch {}
-                    }
-                    break;
-                }
-            } catch { Write-Host 'Error accessing scheduler'; }
-        }"'''
-        
-        proc2 = subprocess.run(ps_cmd, capture_output=True, shell=True)
-        if proc2.returncode == 0:
-            raw_bytes2 = proc2.stdout
-            detected2 = chardet.detect(raw_bytes2)
-            detected_encoding2 = detected2.get("encoding", None)
-            confidence2 = detected2.get("confidence", 0)
-            
-            if detected_encoding2 and confidence2 > 0.5:
-                decoded_output2 = raw_bytes2.decode(detected_encoding2, errors="replace")
-            else:
-                decoded_output2 = raw_bytes2.decode("cp866", errors="replace")
-            
-            if decoded_output2.strip() and "error" not in decoded_output2.lower():
-                return f"🟢 {decoded_output2.strip()}"
-        
-        # Fallback: анализ частоты создания копий (как раньше)
+        # Fallback: анализ частоты создания копий (как раньше) - не равноценен
+        # планировщику, поэтому не входит в стратегию и остаётся последним
         recent_dates = _get_recent_backup_dates()
         if len(recent_dates) >= 3:
             intervals = []
@@ -322,80 +295,41 @@ def _get_task_schedule_details(task_name):
     """Получает детали расписания для конкретной задачи"""
     try:
         cmd = f'schtasks /query /fo LIST /tn "{task_name}"'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
+        proc = command_runner.run(cmd)
         
         if proc.returncode == 0:
-            raw_bytes = proc.stdout
-            detected = chardet.detect(raw_bytes)
-            detected_encoding = detected.get("encoding", None)
-            confidence = detected.get("confidence", 0)
-            
-            if detected_encoding and confidence > 0.5:
-                decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-            else:
-                decoded_output = raw_bytes.decode("cp866", errors="replace")
-            
-            # Ищем информацию о расписании в выводе
-            schedule_type = None
-            schedule_time = None
-            
-            for line in decoded_output.splitlines():
-                line = line.strip()
-                if ":" in line:
-                    key, value = line.split(":", 1)
-                    key = key.strip().lower()
-                    value = value.strip()
-                    
-                    if "schedule type" in key or "тип расписания" in key:
-                        if "daily" in value.lower() or "ежедневно" in value.lower():
-                            schedule_type = "Ежедневно"
-                        elif "weekly" in value.lower() or "еженедельно" in value.lower():
-                            schedule_type = "Еженедельно"
-                    
-                    elif "start time" in key or "время запуска" in key:
-                        schedule_time = value
-            
-            if schedule_type and schedule_time:
-                return f"🟢 {schedule_type} в {schedule_time}"
-            elif schedule_type:
-                return f"🟢 {schedule_type}"
-            elif schedule_time:
-                return f"🟢 В {schedule_time}"
+            return _parse_task_schedule(decode_output(proc.stdout))
         
         return None
         
     except Exception as e:
         return None
 
+@tracing.traced("parse schtasks")
+def _parse_task_schedule(output):
+    """Ищет тип и время запуска в выводе schtasks /fo LIST"""
+    # Расписание последней задачи в выводе, у которой оно указано
+    tasks = [task for task in TASK_SCHEDULE_GRAMMAR.records(output) if "type" in task or "time" in task]
+    schedule_type = tasks[-1].get("type") if tasks else None
+    schedule_time = tasks[-1].get("time") if tasks else None
+    
+    if schedule_type and schedule_time:
+        return f"🟢 {schedule_type} в {schedule_time}"
+    elif schedule_type:
+        return f"🟢 {schedule_type}"
+    elif schedule_time:
+        return f"🟢 В {schedule_time}"
+    return None
+
 def _get_recent_backup_dates():
     """Получает список дат последних резервных копий для анализа расписания"""
     try:
         cmd = "wbadmin get versions"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        dates = []
-        lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
+        proc = command_runner.run(cmd)
+        decoded_output = decode_output(proc.stdout)
         
-        # Ищем даты в формате DD.MM.YYYY HH:MM
-        for line in lines:
-            date_match = re.search(r'(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})', line)
-            if date_match:
-                date_str, time_str = date_match.groups()
-                try:
-                    backup_datetime = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-                    dates.append(backup_datetime)
-                except ValueError:
-                    continue
+        dates = [version["time"] for version in BACKUP_VERSIONS_GRAMMAR.records(decoded_output)
+                 if "time" in version]
         
         # Сортируем по убыванию (новые сначала)
         dates.sort(reverse=True)
@@ -408,18 +342,8 @@ def _get_current_backup_status():
     """Получает статус текущей операции резервного копирования"""
     try:
         cmd = "wbadmin get status"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Применяем тот же подход декодирования что в user_management.py
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
+        proc = command_runner.run(cmd)
+        decoded_output = decode_output(proc.stdout)
         
         not_running_phrases = ["не выполняется", "not running", "no operation", "нет операции"]
         running_phrases = ["выполняется", "running", "in progress", "в процессе"]
@@ -461,8 +385,8 @@ def _get_storage_info():
 def _check_backup_health():
     """Проверяет общее состояние системы резервного копирования"""
     try:
-        # Проверяем службу Windows Server Backup - используем подход из system_info.py
-        service_status = get_service_status("Block Level Backup Engine Service")
+        # Служба Windows Server Backup (Block Level Backup Engine Service) - из service_watcher
+        service_status = get_service_status("wbengine")
         
         if service_status.upper() == "RUNNING":
             return "🟢 Служба активна"
@@ -474,136 +398,35 @@ def _check_backup_health():
     except Exception as e:
         return f"❌ Ошибка проверки: {str(e)}"
 
-def get_service_status(service_name):
-    """
-    Проверяет статус службы по её имени (sc query "имя").
-    Использует тот же подход что в system_info.py
-    """
-    try:
-        cmd = f'sc query "{service_name}"'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-
-        # Применяем тот же подход декодирования что в system_info.py
-        detected = chardet.detect(raw_bytes)
-        enc = detected.get("encoding", "cp866")
-        decoded = raw_bytes.decode(enc, errors="replace")
-
-        # Пример англ. строки: "STATE              : 4  RUNNING"
-        # На русской Windows может быть "СОСТОЯНИЕ         : 4  RUNNING"
-        match = re.search(r"(?:STATE|СОСТОЯНИЕ)\s*:\s*\d+\s+(\w+)", decoded, re.IGNORECASE)
-        if match:
-            state = match.group(1).upper()
-            return state  # RUNNING / STOPPED / PAUSED и т.д.
-        else:
-            return "Не удалось определить статус"
-    except Exception as e:
-        return f"Ошибка при проверке службы {service_name}: {e}"
-
-def _parse_backup_versions_ru(output):
-    """Парсит вывод wbadmin get versions для русской локализации"""
-    entries = []
-    lines = [line.strip() for line in output.splitlines() if line.strip()]
-    
-    current_entry = {}
-    
-    for line in lines:
-        line_lower = line.lower()
-        
-        # Ищем начало новой записи по версии или времени
-        if any(phrase in line_lower for phrase in ["версия", "version", "backup time", "время архивации"]):
-            if current_entry and current_entry.get("time"):
-                entries.append(_format_backup_entry(current_entry))
-            current_entry = {}
-            
-            # Пытаемся извлечь время прямо из этой строки
-            time_match = re.search(r'(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})', line)
-            if time_match:
-                current_entry["time"] = f"{time_match.group(1)} {time_match.group(2)}"
-        
-        # Ищем дополнительную информацию в строках с двоеточием
-        elif ":" in line:
-            parts = line.split(":", 1)
-            if len(parts) == 2:
-                key = parts[0].strip().lower()
-                value = parts[1].strip()
-                
-                if any(word in key for word in ["время", "time", "дата", "date"]):
-                    current_entry["time"] = value
-                elif any(word in key for word in ["тип", "type", "режим"]):
-                    current_entry["type"] = value
-                elif any(word in key for word in ["состояние", "status", "result", "результат", "описание"]):
-                    current_entry["status"] = value
-    
-    # Добавляем последнюю запись
-    if current_entry and current_entry.get("time"):
-        entries.append(_format_backup_entry(current_entry))
-    
-    return entries
-
-def _format_backup_entry(entry):
-    """Форматирует запись о резервной копии"""
-    time_str = entry.get("time", "Время неизвестно")
-    type_str = entry.get("type", "")
-    status_str = entry.get("status", "")
-    
-    # Создаем красивое форматирование
-    parts = [time_str]
-    if type_str:
-        parts.append(f"({type_str})")
-    if status_str:
-        if "успех" in status_str.lower() or "success" in status_str.lower():
-            parts.append("✅")
-        elif "ошибка" in status_str.lower() or "error" in status_str.lower() or "неудач" in status_str.lower():
-            parts.append("❌")
-        else:
-            parts.append(f"[{status_str}]")
-    
-    return " ".join(parts)
+@tracing.traced("parse wbadmin")
+def _parse_backup_versions(output):
+    """Парсит вывод wbadmin get versions (русская и английская локализация)"""
+    return [f"{version['time']:%d.%m.%Y %H:%M} {version.get('result', '')}".rstrip()
+            for version in BACKUP_VERSIONS_GRAMMAR.records(output) if "time" in version]
 
 def _get_backup_target_drives():
     """Получает список целевых дисков для резервного копирования из данных о копиях"""
     try:
         # Получаем точную информацию из summary данных резервных копий
         cmd = "wbadmin get versions -summary"
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
+        proc = command_runner.run(cmd)
         
         if proc.returncode == 0:
-            raw_bytes = proc.stdout
-            detected = chardet.detect(raw_bytes)
-            detected_encoding = detected.get("encoding", None)
-            confidence = detected.get("confidence", 0)
+            decoded_output = decode_output(proc.stdout)
             
-            if detected_encoding and confidence > 0.5:
-                decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-            else:
-                decoded_output = raw_bytes.decode("cp866", errors="replace")
-            
-            # Извлекаем диски из строк "Конечный объект архивации: Несъемный диск с именем G:"
-            backup_drives = set()
-            for line in decoded_output.splitlines():
-                if "конечный объект архивации" in line.lower():
-                    match = re.search(r'с именем ([A-Za-z]:)', line)
-                    if match:
-                        backup_drives.add(match.group(1))
+            # Диски из строк "Конечный объект архивации: Несъемный диск с именем G:"
+            backup_drives = {version["target"] for version in BACKUP_VERSIONS_GRAMMAR.records(decoded_output)
+                             if "target" in version}
             
             if backup_drives:
                 return sorted(list(backup_drives))
         
         # Fallback: если точная информация недоступна, пробуем получить из wbadmin get versions  
         cmd2 = "wbadmin get versions"
-        proc2 = subprocess.run(cmd2, capture_output=True, shell=True)
+        proc2 = command_runner.run(cmd2)
         
         if proc2.returncode == 0:
-            raw_bytes2 = proc2.stdout
-            detected2 = chardet.detect(raw_bytes2)
-            detected_encoding2 = detected2.get("encoding", None)
-            confidence2 = detected2.get("confidence", 0)
-            
-            if detected_encoding2 and confidence2 > 0.5:
-                decoded_output2 = raw_bytes2.decode(detected_encoding2, errors="replace")
-            else:
-                decoded_output2 = raw_bytes2.decode("cp866", errors="replace")
+            decoded_output2 = decode_output(proc2.stdout)
             
             # Ищем диски в обычном выводе wbadmin get versions
             backup_drives2 = set()
@@ -615,75 +438,19 @@ def _get_backup_target_drives():
             if backup_drives2:
                 return sorted(list(backup_drives2))
         
-        # Последний fallback: возвращаем все диски с достаточным свободным местом
-        drives = []
-        cmd3 = 'wmic logicaldisk where "DriveType=3" get DeviceID,FreeSpace,Size'
-        proc3 = subprocess.run(cmd3, capture_output=True, shell=True)
-        
-        if proc3.returncode == 0:
-            raw_bytes3 = proc3.stdout
-            detected3 = chardet.detect(raw_bytes3)
-            detected_encoding3 = detected3.get("encoding", None)
-            confidence3 = detected3.get("confidence", 0)
-            
-            if detected_encoding3 and confidence3 > 0.5:
-                decoded_output3 = raw_bytes3.decode(detected_encoding3, errors="replace")
-            else:
-                decoded_output3 = raw_bytes3.decode("cp866", errors="replace")
-            
-            lines = [line.strip() for line in decoded_output3.splitlines() if line.strip()]
-            
-            for line in lines[1:]:  # Пропускаем заголовок
-                parts = line.split()
-                if len(parts) >= 3:
-                    drive = parts[0]
-                    try:
-                        free_space = int(parts[1])
-                        # Если диск имеет более 10 ГБ свободного места, считаем его потенциальной целью
-                        if free_space > 10 * 1024 * 1024 * 1024:  # 10 ГБ в байтах
-                            drives.append(drive)
-                    except:
-                        continue
-            
-            return drives[:3]  # Возвращаем не более 3 дисков
-        
-        return []
+        # Последний fallback: возвращаем диски с достаточным свободным местом (не более 3)
+        return disk_inventory.backup_candidates(limit=3)
         
     except Exception as e:
         return []
 
 def _get_drive_space(drive):
-    """Получает информацию о свободном месте на диске"""
+    """Получает информацию о свободном месте на диске из общего реестра дисков"""
     try:
-        cmd = f'wmic logicaldisk where "DeviceID=\'{drive}\'" get FreeSpace,Size'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Применяем тот же подход декодирования что в user_management.py
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
-        
-        if len(lines) > 1:
-            parts = lines[1].split()
-            if len(parts) >= 2:
-                free_space = int(parts[0]) / (1024**3)  # Конвертируем в ГБ
-                total_space = int(parts[1]) / (1024**3)
-                used_space = total_space - free_space
-                used_percent = (used_space / total_space) * 100 if total_space > 0 else 0
-                
-                emoji = "🔴" if used_percent > 90 else "🟡" if used_percent > 75 else "🟢"
-                
-                return f"{used_space:.1f}/{total_space:.1f} ГБ ({used_percent:.1f}%) {emoji}"
-        
-        return "❌ Недоступно"
+        volume = disk_inventory.get_volume(drive)
+        if volume is None:
+            return "❌ Недоступно"
+        return disk_inventory.format_usage(volume)
         
     except Exception as e:
-        return f"❌ Ошибка: {str(e)}"
\ No newline at end of file
+        return f"❌ Ошибка: {str(e)}"
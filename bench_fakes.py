@@ -0,0 +1,291 @@
+# bench_fakes.py
+"""
+Подставные окружения для замеров обработчиков бота без Telegram и без Windows:
+  FakeBotApi         - локальный HTTP-сервер, отвечающий как Bot API (Updater(base_url=...)),
+  FakeCommandBackend - способ выполнения команд для command_runner, который отдаёт
+                       синтетические выводы вместо запуска процессов,
+  fake_powershell_command - рабочий процесс на Python с протоколом powershell_host
+                       (PowerShellHost(command=...)).
+"""
+import re
+import csv
+import io
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import wmi_query
+import synthetic_outputs
+from backup_monitoring import BACKUP_SCHEDULE_PS_SCRIPT
+from command_runner import CommandResult, ReplayBackend
+
+BENCH_TOKEN = "123456:BENCH-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+# ============== ПОДСТАВНОЙ BOT API ==============
+
+class _BotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Иначе заголовки и тело ответа уходят двумя пакетами и каждый вызов ждёт ~40 мс delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._params(body)
+        result = self.server.api.handle(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    def _params(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            try:
+                return json.loads(body.decode("utf-8"))
+            except ValueError:
+                return {}
+        if "x-www-form-urlencoded" in content_type:
+            return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        return {}  # multipart (документы) - содержимое не разбираем
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi:
+    """
+    Локальный сервер Bot API. Все методы отвечают успехом; сообщения получают
+    последовательные message_id. latency - искусственная задержка каждого ответа
+    (имитация сетевого пути до api.telegram.org). Вызовы считаются по методам.
+    """
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 1000
+        self._server = ThreadingHTTPServer((host, port), _BotApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            message_id = self._message_id
+
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup"):
+            chat_id = params.get("chat_id") or 0
+            return {
+                "message_id": int(params.get("message_id") or message_id),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+
+# ============== ПОДСТАВНОЙ РАБОЧИЙ ПРОЦЕСС POWERSHELL ==============
+
+# Тот же протокол, что у WORKER_SCRIPT: JSON-строка запроса {"id", "script"} - JSON-строка ответа.
+# Вместо PowerShell понимает команды:
+#   sleep <секунд>  - ответить после паузы (таймаут запроса),
+#   crash           - завершиться, не ответив (аварийное завершение),
+#   fail <текст>    - ответить ошибкой,
+#   pid             - номер процесса (по нему виден перезапуск);
+# остальное возвращается как вывод.
+FAKE_POWERSHELL_WORKER = r'''
+import os, sys, json, time
+for line in iter(sys.stdin.readline, ""):
+    if not line.strip():
+        continue
+    request = json.loads(line)
+    command, _, argument = request["script"].partition(" ")
+    response = {"id": request["id"], "ok": True, "exit_code": 0, "output": "", "error": ""}
+    if command == "sleep":
+        time.sleep(float(argument))
+    elif command == "crash":
+        os._exit(1)
+    elif command == "fail":
+        response.update(ok=False, exit_code=1, error=argument)
+    elif command == "pid":
+        response["output"] = str(os.getpid())
+    else:
+        response["output"] = request["script"]
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+'''
+
+
+def fake_powershell_command():
+    """Командная строка подставного рабочего процесса для PowerShellHost(command=...)."""
+    return [sys.executable, "-c", FAKE_POWERSHELL_WORKER]
+
+
+# ============== ПОДСТАВНЫЕ КОМАНДЫ ==============
+
+BACKUP_TASK = "\\Microsoft\\Windows\\Backup\\Microsoft-Windows-WindowsBackup"
+
+
+class FakeCommandBackend(ReplayBackend):
+    """
+    Отдаёт синтетические выводы для всех команд, которые вызывают обработчики бота.
+    Пакетные запросы WMI отвечаются из таблиц wmi_tables (ключ запроса -> записи).
+    spawn_cost / powershell_cost - искусственная стоимость запуска процесса и запроса
+    к постоянному PowerShell (по умолчанию 0 - измеряется только сам бот).
+    """
+
+    name = "fake"
+
+    def __init__(self, users=20, sessions=10, vpn_clients=5, versions=30,
+                 spawn_cost=0.0, powershell_cost=0.0):
+        super().__init__()
+        self.spawn_cost = spawn_cost
+        self.powershell_cost = powershell_cost
+        self.user_names = [f"user{i:02}" for i in range(users)]
+        self.fixtures = {
+            "qwinsta": synthetic_outputs.qwinsta(sessions),
+            "netsh ras show client": synthetic_outputs.netsh_ras_clients(vpn_clients),
+            "wbadmin get versions": synthetic_outputs.wbadmin_versions(versions),
+            "wbadmin get versions -summary": synthetic_outputs.wbadmin_versions(versions),
+            "wbadmin get status": synthetic_outputs.wbadmin_status(),
+            "wbadmin get schedule": b"",
+            'schtasks /query /fo CSV /tn "\\Microsoft\\Windows\\Backup\\*"':
+                synthetic_outputs.schtasks_csv([BACKUP_TASK]),
+            f'schtasks /query /fo LIST /tn "{BACKUP_TASK}"':
+                synthetic_outputs.schtasks_list(1, task_name=BACKUP_TASK),
+        }
+        self.fixtures = {cmd: CommandResult(0, raw) for cmd, raw in self.fixtures.items()}
+        self.wmi_tables = self._wmi_tables()
+
+    def _wmi_tables(self):
+        return {
+            wmi_query.CPU.key: [{"LoadPercentage": "23"}],
+            wmi_query.OS.key: [{"FreePhysicalMemory": "4194304", "TotalVisibleMemorySize": "16777216",
+                                "LastBootUpTime": "20250301121530.500000+180"}],
+            wmi_query.DISKS.key: [
+                {"DeviceID": "C:", "FreeSpace": str(40 * 1024**3), "Size": str(120 * 1024**3)},
+                {"DeviceID": "E:", "FreeSpace": str(700 * 1024**3), "Size": str(2000 * 1024**3)},
+            ],
+            wmi_query.USERS.key: [{"Name": name, "Disabled": "True" if i % 7 == 3 else "False"}
+                                  for i, name in enumerate(["Администратор", "Гость"] + self.user_names)],
+            wmi_query.NIC.key: [{"Name": "Intel[R] PRO_1000", "BytesTotalPersec": str(int(time.time() * 125000))}],
+            wmi_query.SERVICES.key: [
+                {"Name": "1C:Enterprise 8.2 Server Agent", "DisplayName": "Агент сервера 1С:Предприятия 8.2",
+                 "State": "Running"},
+                {"Name": "1C:Enterprise 8.3 Server Agent", "DisplayName": "Агент сервера 1С:Предприятия 8.3",
+                 "State": "Running"},
+                {"Name": "RemoteAccess", "DisplayName": "Маршрутизация и удаленный доступ", "State": "Running"},
+                {"Name": "wbengine", "DisplayName": "Block Level Backup Engine Service", "State": "Stopped"},
+            ] + [{"Name": f"svc{i:03}", "DisplayName": f"Service {i}", "State": "Running"} for i in range(150)],
+        }
+
+    def run(self, cmd, timeout=None):
+        if self.spawn_cost:
+            time.sleep(self.spawn_cost)
+        result = self.fixtures.get(cmd) or self._dynamic(cmd)
+        if result is not None:
+            return result
+        return super().run(cmd, timeout=timeout)
+
+    def _dynamic(self, cmd):
+        """Команды с параметрами: имя службы, пользователя, узла."""
+        match = re.match(r'sc query "(.+)"$', cmd)
+        if match:
+            return CommandResult(0, synthetic_outputs.sc_query(match.group(1)))
+        match = re.match(r'sc (stop|start) "(.+)"$', cmd)
+        if match:
+            # Служба сразу переходит в нужное состояние (для перезапуска через server_control)
+            state = "Stopped" if match.group(1) == "stop" else "Running"
+            for row in self.wmi_tables[wmi_query.SERVICES.key]:
+                if match.group(2) in (row["Name"], row["DisplayName"]):
+                    row["State"] = state
+            return CommandResult(0, synthetic_outputs.sc_query(match.group(2)))
+        match = re.match(r"ping -n (\d+) (\S+)$", cmd)
+        if match:
+            return CommandResult(0, synthetic_outputs.ping(int(match.group(1)), host=match.group(2)))
+        match = re.match(r"tracert (\S+)$", cmd)
+        if match:
+            return CommandResult(0, synthetic_outputs.tracert(12, host=match.group(1)))
+        match = re.match(r"nslookup (\S+)$", cmd)
+        if match:
+            return CommandResult(0, synthetic_outputs.nslookup(match.group(1)))
+        match = re.match(r'net user "?([^"/]+?)"?$', cmd)
+        if match:
+            return CommandResult(0, synthetic_outputs.net_user(match.group(1), groups=4))
+        if cmd.startswith("net user ") or cmd.startswith("logoff ") or cmd.startswith("netsh ras set client"):
+            return CommandResult(0, "Команда выполнена успешно.".encode("cp866"))
+        return None
+
+    def run_powershell(self, script, timeout=None):
+        if self.powershell_cost:
+            time.sleep(self.powershell_cost)
+        if wmi_query._QUERY_MARKER in script:
+            return True, self._wmi_batch(script)
+        if script == BACKUP_SCHEDULE_PS_SCRIPT:
+            return True, "Daily at 23:00\n"
+        return super().run_powershell(script, timeout=timeout)
+
+    def _wmi_batch(self, script):
+        """Вывод пакетного скрипта wmi_query: секции "@@QUERY key" с CSV внутри."""
+        queries = {q.key: q for q in (wmi_query.CPU, wmi_query.OS, wmi_query.DISKS,
+                                      wmi_query.USERS, wmi_query.NIC, wmi_query.SERVICES)}
+        self.wmi_tables[wmi_query.NIC.key][0]["BytesTotalPersec"] = str(int(time.time() * 125000))
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        for key in re.findall(re.escape(wmi_query._QUERY_MARKER) + r"(\w+)", script):
+            out.write(f"{wmi_query._QUERY_MARKER}{key}\r\n")
+            query, rows = queries.get(key), self.wmi_tables.get(key)
+            if query is None or rows is None:
+                out.write(f"{wmi_query._ERROR_MARKER}Invalid class\r\n")
+                continue
+            writer.writerow(list(query.properties))
+            for row in rows:
+                writer.writerow([row.get(name, "") for name in query.properties])
+        return out.getvalue()
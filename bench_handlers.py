@@ -0,0 +1,352 @@
+# bench_handlers.py
+"""
+Сквозные замеры обработчиков бота.
+
+Обработчики регистрируются так же, как в main() (bot_main.register_handlers), но:
+  - запросы к Telegram уходят на локальный подставной Bot API (bench_fakes.FakeBotApi),
+  - консольные команды и PowerShell отдают синтетические выводы (bench_fakes.FakeCommandBackend).
+Каждое нажатие (сообщение или callback) прогоняется через dispatcher.process_update;
+долгие операции, которые бот выполняет как задания (jobs.py) в пуле диспетчера,
+входят в замер нажатия целиком.
+
+Для каждого сценария в отчёте:
+  - p50 / p95 / max времени обработки,
+  - число запусков процессов (command_runner.run) и запросов PowerShell на одно нажатие,
+  - число вызовов Bot API на одно нажатие (и по методам),
+  - ошибки обработчиков.
+
+Бюджеты (bench_handler_budgets.json) ограничивают число процессов, запросов PowerShell
+и вызовов API по сценариям; --check завершается с кодом 1 при превышении.
+
+Примеры:
+  python bench_handlers.py
+  python bench_handlers.py --iterations 50 --json handlers.json
+  python bench_handlers.py --spawn-cost 0.05 --api-latency 0.08   # приблизить к реальному серверу
+  python bench_handlers.py --check
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import itertools
+import threading
+import tempfile
+import contextlib
+from time import perf_counter
+
+BENCH_CHAT_ID = 1001
+
+# bot_main проверяет конфигурацию при импорте - подставляем токен и разрешённого пользователя
+os.environ["TELEGRAM_TOKEN"] = "123456:BENCH-TOKEN"
+os.environ["ALLOWED_USERS"] = str(BENCH_CHAT_ID)
+# Журнал замеров не нужен: без файла bot.log и без вывода в консоль поверх отчёта
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LOG_CONSOLE", "0")
+# Состояние бота (в т.ч. выученный выбор способов backend_strategy) - только в памяти:
+# замеры не должны зависеть от предыдущих запусков
+os.environ["STATE_FILE"] = ""
+
+import telegram
+from telegram.ext import Updater
+from telegram.utils.request import Request
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import bot_main
+
+import wmi_query
+import disk_inventory
+import probe_cache
+import command_runner
+import jobs
+from outbox import OutboxBot
+from bench_fakes import BENCH_TOKEN, BOT_USER, FakeBotApi, FakeCommandBackend
+from platform_provider import WindowsProvider, set_provider
+from vpn_connections import _parse_ras_clients
+from command_runner import decode_output
+
+DEFAULT_BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_handler_budgets.json")
+
+
+class Scenario:
+    """
+    Одно нажатие пользователя: текст сообщения (kind="text"), команда (kind="command")
+    или callback_data инлайн-кнопки (kind="callback"). setup - сообщения, которые
+    отправляются перед замером (например, вход в диалог ConversationHandler).
+    slow - сценарий с намеренными паузами, запускается только с --all.
+    """
+
+    def __init__(self, name, kind, payload, setup=(), slow=False):
+        self.name = name
+        self.kind = kind
+        self.payload = payload
+        self.setup = list(setup)
+        self.slow = slow
+
+
+def build_scenarios(user_name, vpn_name):
+    return [
+        Scenario("/start", "command", "/start"),
+        Scenario("Состояние сервера", "text", "Состояние сервера"),
+        Scenario("Резервные копии", "text", "Резервные копии"),
+        Scenario("Статус резервных копий", "text", "Статус резервных копий"),
+        Scenario("Список версий копий", "text", "Список версий копий"),
+        Scenario("Место на дисках", "text", "Место на дисках"),
+        Scenario("Управление пользователями", "text", "Управление пользователями"),
+        Scenario("Список пользователей", "text", "Список пользователей"),
+        Scenario("VPN соединения", "text", "VPN соединения"),
+        Scenario("Проверить связь до узла", "text", "ya.ru", setup=["Проверить связь до узла"]),
+        Scenario("Состояние сети", "text", "Состояние сети", slow=True),
+        Scenario("user_menu_", "callback", f"user_menu_{user_name}"),
+        Scenario("sessions_", "callback", f"sessions_{user_name}"),
+        Scenario("info_", "callback", f"info_{user_name}"),
+        Scenario("back_to_users", "callback", "back_to_users"),
+        Scenario("refresh_users", "callback", "refresh_users"),
+        Scenario("vpn_menu_", "callback", f"vpn_menu_{vpn_name}"),
+        Scenario("refresh_vpn", "callback", "refresh_vpn"),
+        Scenario("refresh_backup_status", "callback", "refresh_backup_status"),
+        Scenario("backup_details", "callback", "backup_details"),
+        Scenario("refresh_backup_versions", "callback", "refresh_backup_versions"),
+        Scenario("refresh_disk_space", "callback", "refresh_disk_space"),
+    ]
+
+
+# ============== ПОСТРОЕНИЕ UPDATE ==============
+
+class UpdateFactory:
+    """Создаёт объекты telegram.Update так, как их прислал бы Telegram."""
+
+    def __init__(self, bot, chat_id=BENCH_CHAT_ID, ids=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        # общий счётчик update_id, если обновления создаются для нескольких чатов
+        self._ids = ids if ids is not None else itertools.count(1)
+
+    def _next(self):
+        return next(self._ids)
+
+    def _user(self):
+        return {"id": self.chat_id, "is_bot": False, "first_name": "Bench"}
+
+    def _chat(self):
+        return {"id": self.chat_id, "type": "private"}
+
+    def message(self, text):
+        update_id = self._next()
+        message = {"message_id": update_id, "date": int(time.time()), "chat": self._chat(),
+                   "from": self._user(), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return telegram.Update.de_json({"update_id": update_id, "message": message}, self.bot)
+
+    def callback(self, data):
+        update_id = self._next()
+        query = {
+            "id": str(update_id),
+            "from": self._user(),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": self._chat(),
+                        "from": BOT_USER, "text": "..."},
+        }
+        return telegram.Update.de_json({"update_id": update_id, "callback_query": query}, self.bot)
+
+    def for_scenario(self, scenario):
+        if scenario.kind == "callback":
+            return self.callback(scenario.payload)
+        return self.message(scenario.payload)
+
+
+# ============== ЗАМЕРЫ ==============
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class HandlerBench:
+    def __init__(self, api, backend, warm=False):
+        self.api = api
+        self.backend = backend
+        self.warm = warm
+        self.errors = []
+        # Бот как в main() (очередь outbox), но без лимитов частоты: меряется работа самого бота
+        bot = OutboxBot(BENCH_TOKEN, base_url=api.url, request=Request(con_pool_size=8),
+                        global_rate=0, chat_rate=0)
+        updater = Updater(bot=bot, use_context=True)
+        self.dispatcher = updater.dispatcher
+        bot_main.register_handlers(self.dispatcher)
+        self.dispatcher.add_error_handler(self._on_error)
+        self.updates = UpdateFactory(updater.bot)
+        # Пул потоков диспетчера нужен заданиям (run_async); сами обновления подаются через process_update
+        ready = threading.Event()
+        threading.Thread(target=self.dispatcher.start, kwargs={"ready": ready},
+                         name="dispatcher", daemon=True).start()
+        ready.wait()
+
+    def close(self):
+        self.dispatcher.stop()
+
+    def _on_error(self, update, context):
+        self.errors.append(repr(context.error))
+
+    def _reset_caches(self):
+        if not self.warm:
+            wmi_query.invalidate()
+            disk_inventory.invalidate()
+            probe_cache.invalidate()
+
+    def run(self, scenario, iterations):
+        latencies, commands, powershell, api_calls = [], [], [], []
+        methods = {}
+        errors_before = len(self.errors)
+        for i in range(iterations + 1):  # первый прогон - разогрев, в отчёт не идёт
+            for text in scenario.setup:
+                self.dispatcher.process_update(self.updates.message(text))
+            self._reset_caches()
+            update = self.updates.for_scenario(scenario)
+            command_runner.reset_counters()
+            self.api.reset()
+
+            started = perf_counter()
+            self.dispatcher.process_update(update)
+            jobs.wait_idle()
+            elapsed = perf_counter() - started
+
+            if i == 0:
+                continue
+            latencies.append(elapsed * 1000)
+            commands.append(command_runner.counters["commands"])
+            powershell.append(command_runner.counters["powershell"])
+            calls = self.api.snapshot()
+            api_calls.append(sum(calls.values()))
+            for method, count in calls.items():
+                methods[method] = max(methods.get(method, 0), count)
+
+        return {
+            "scenario": scenario.name,
+            "iterations": iterations,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "max_ms": max(latencies),
+            # на одно нажатие берём худший случай - бюджет не должен зависеть от усреднения
+            "commands": max(commands),
+            "powershell": max(powershell),
+            "api_calls": max(api_calls),
+            "api_methods": methods,
+            "errors": len(self.errors) - errors_before,
+        }
+
+
+# ============== БЮДЖЕТЫ ==============
+
+def check_budgets(rows, budgets):
+    """{сценарий: {"commands": N, "powershell": N, "api_calls": N, "p95_ms": N}}; превышение - регрессия."""
+    failures = []
+    for row in rows:
+        if row["errors"]:
+            failures.append(f"{row['scenario']}: ошибок в обработчике - {row['errors']}")
+        for metric, limit in budgets.get(row["scenario"], {}).items():
+            value = row.get(metric)
+            if value is not None and value > limit:
+                failures.append(f"{row['scenario']}: {metric} = {value:g} > {limit}")
+    return failures
+
+
+def print_table(rows):
+    header = ["Сценарий", "p50 мс", "p95 мс", "max мс", "Процессы", "PowerShell", "API", "Ошибки"]
+    table = [header]
+    for row in rows:
+        table.append([row["scenario"], f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}", f"{row['max_ms']:.1f}",
+                      str(row["commands"]), str(row["powershell"]), str(row["api_calls"]), str(row["errors"])])
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозные замеры обработчиков бота")
+    parser.add_argument("--iterations", type=int, default=20, help="число замеров на сценарий")
+    parser.add_argument("--only", help="сценарии через запятую (имена из отчёта)")
+    parser.add_argument("--all", action="store_true", help="включить медленные сценарии (Состояние сети)")
+    parser.add_argument("--warm", action="store_true", help="не сбрасывать кэши WMI, дисков и проверок между нажатиями")
+    parser.add_argument("--spawn-cost", type=float, default=0.0,
+                        help="искусственная стоимость запуска процесса, сек")
+    parser.add_argument("--powershell-cost", type=float, default=0.0,
+                        help="искусственная стоимость запроса PowerShell, сек")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="искусственная задержка ответа Bot API, сек")
+    parser.add_argument("--users", type=int, default=20, help="число локальных пользователей")
+    parser.add_argument("--sessions", type=int, default=10, help="число RDP-сеансов")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS, help="файл бюджетов")
+    parser.add_argument("--check", action="store_true", help="завершиться с кодом 1 при превышении бюджетов")
+    parser.add_argument("--json", metavar="FILE", help="сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    backend = FakeCommandBackend(users=args.users, sessions=args.sessions,
+                                 spawn_cost=args.spawn_cost, powershell_cost=args.powershell_cost)
+    vpn_text = decode_output(backend.fixtures["netsh ras show client"].stdout)
+    scenarios = build_scenarios(backend.user_names[1], _parse_ras_clients(vpn_text)[0]["name"])
+    only = set(args.only.split(",")) if args.only else None
+    scenarios = [s for s in scenarios
+                 if (only and s.name in only) or (not only and (args.all or not s.slow))]
+
+    api = FakeBotApi(latency=args.api_latency).start()
+    command_runner.set_backend(backend)
+    set_provider(WindowsProvider())
+    workdir = os.getcwd()
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # get_vpn_sessions сохраняет vpn_sessions.txt в текущий каталог
+            os.chdir(tmp)
+            try:
+                bench = HandlerBench(api, backend, warm=args.warm)
+                try:
+                    for scenario in scenarios:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            rows.append(bench.run(scenario, args.iterations))
+                finally:
+                    bench.close()
+            finally:
+                os.chdir(workdir)
+    finally:
+        api.stop()
+        command_runner.set_backend(None)
+        set_provider(None)
+
+    print_table(rows)
+    if backend.missing:
+        print("\nКоманды без синтетического вывода:")
+        for cmd in sorted(set(backend.missing)):
+            print(f"  {cmd[:100]}")
+
+    if args.json:
+        report = {
+            "settings": {k: getattr(args, k) for k in ("iterations", "warm", "spawn_cost", "powershell_cost",
+                                                        "api_latency", "users", "sessions")},
+            "scenarios": rows,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+    if args.check:
+        with open(args.budgets, encoding="utf-8") as f:
+            budgets = json.load(f)
+        failures = check_budgets(rows, budgets)
+        if failures:
+            print("\nПревышены бюджеты:")
+            for message in failures:
+                print(f"  {message}")
+            return 1
+        print("\nБюджеты соблюдены")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
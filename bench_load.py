@@ -0,0 +1,360 @@
+# bench_load.py
+"""
+Нагрузочный генератор: несколько администраторов одновременно нажимают кнопки бота.
+
+Каждый чат - отдельный поток, который по очереди выбирает сценарий из смеси
+(просмотр состояния, меню пользователей, обновление VPN, проверки сети),
+кладёт обновление в очередь диспетчера (update_queue, как это делает polling)
+и ждёт окончания обработки, затем "думает" случайное время и повторяет.
+Обработчики регистрируются так же, как в main(); Telegram и консольные команды
+заменены подставными (bench_fakes) с настраиваемой стоимостью вызовов.
+
+Отчёт:
+  - пропускная способность (обработанных обновлений в секунду),
+  - ожидание в очереди (от постановки в очередь до начала работы обработчика),
+  - полное время ответа p50 / p95 / p99 / max, общее и по сценариям,
+  - загрузка рабочих потоков (доля времени, занятая обработчиками) и пиковая параллельность,
+  - максимальная глубина очереди диспетчера.
+
+Примеры:
+  python bench_load.py --chats 5 --duration 30
+  python bench_load.py --run-async --workers 8 --mix incident
+  python bench_load.py --sweep 1,2,4,8 --json load.json   # сравнить последовательный режим и пулы разного размера
+"""
+import os
+import io
+import sys
+import json
+import random
+import argparse
+import tempfile
+import itertools
+import threading
+import contextlib
+from time import perf_counter, sleep
+
+from bench_handlers import (BENCH_CHAT_ID, UpdateFactory, build_scenarios, percentile,
+                            bot_main)
+from outbox import OutboxBot
+from bench_fakes import BENCH_TOKEN, FakeBotApi, FakeCommandBackend
+
+import telegram
+import jobs
+import probe_cache
+import command_runner
+from telegram.ext import Updater, Defaults, TypeHandler, ConversationHandler
+from telegram.utils.request import Request
+from platform_provider import WindowsProvider, set_provider
+from vpn_connections import _parse_ras_clients
+from command_runner import decode_output
+
+# Смеси сценариев: {имя сценария из bench_handlers: вес}
+MIXES = {
+    "incident": {
+        "Состояние сервера": 3,
+        "refresh_backup_status": 1,
+        "user_menu_": 2,
+        "back_to_users": 1,
+        "VPN соединения": 1,
+        "refresh_vpn": 3,
+        "Состояние сети": 1,
+        "Проверить связь до узла": 1,
+    },
+    "status": {
+        "Состояние сервера": 2,
+        "Статус резервных копий": 1,
+        "refresh_backup_status": 1,
+        "Место на дисках": 1,
+    },
+    "users": {
+        "user_menu_": 3,
+        "sessions_": 1,
+        "info_": 1,
+        "back_to_users": 2,
+        "refresh_users": 1,
+    },
+}
+
+
+class LoadRecorder:
+    """
+    Отметки времени по каждому обновлению: постановка в очередь, выборка диспетчером,
+    начало и конец работы обработчика. Обработчики оборачиваются через wrap().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = {}   # update_id -> {"scenario", "enqueued", "dequeued", "started", "finished"}
+        self._events = {}
+        self.busy = 0.0
+        self.active = 0
+        self.peak_active = 0
+        self.errors = 0
+
+    def expect(self, update_id, scenario):
+        event = threading.Event()
+        with self._lock:
+            self.records[update_id] = {"scenario": scenario, "enqueued": perf_counter()}
+            self._events[update_id] = event
+        return event
+
+    def on_dequeue(self, update, context):
+        with self._lock:
+            record = self.records.get(update.update_id)
+            if record is not None:
+                record.setdefault("dequeued", perf_counter())
+
+    def on_error(self, update, context):
+        with self._lock:
+            self.errors += 1
+
+    def wrap(self, callback):
+        def timed(update, context):
+            started = perf_counter()
+            with self._lock:
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                record = self.records.get(update.update_id)
+                if record is not None:
+                    record.setdefault("started", started)
+            try:
+                result = callback(update, context)
+                # Задание, запущенное обработчиком в пуле (jobs.py), - часть обработки нажатия
+                if update.effective_chat is not None:
+                    jobs.wait_idle(chat_id=update.effective_chat.id)
+                return result
+            finally:
+                finished = perf_counter()
+                with self._lock:
+                    self.active -= 1
+                    self.busy += finished - started
+                    if record is not None:
+                        record["finished"] = finished
+                    event = self._events.pop(update.update_id, None)
+                if event is not None:
+                    event.set()
+        return timed
+
+
+def instrument(dispatcher, recorder):
+    """
+    Оборачивает все зарегистрированные обработчики (включая вложенные в ConversationHandler).
+    Служебные обработчики отрицательных групп (отметка активности) не оборачиваются -
+    они срабатывают на каждое обновление раньше основного.
+    """
+    for group, handlers in dispatcher.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            inner = [handler]
+            if isinstance(handler, ConversationHandler):
+                inner = (list(handler.entry_points) + list(handler.fallbacks) +
+                         [h for state in handler.states.values() for h in state])
+            for h in inner:
+                h.callback = recorder.wrap(h.callback)
+    # Отметка выборки из очереди - до всех обработчиков и всегда в потоке диспетчера
+    # своя группа, раньше всех групп бота (в группе срабатывает только первый подходящий обработчик)
+    dispatcher.add_handler(TypeHandler(telegram.Update, recorder.on_dequeue, run_async=False), group=-100)
+    dispatcher.add_error_handler(recorder.on_error, run_async=False)
+
+
+def run_load(args, workers, run_async, scenarios, weights):
+    """Один прогон нагрузки. Возвращает словарь с отчётом."""
+    api = FakeBotApi(latency=args.api_latency).start()
+    recorder = LoadRecorder()
+    # Бот как в main(): исходящие сообщения идут через outbox с лимитами из OUTBOX_*
+    bot = OutboxBot(BENCH_TOKEN, base_url=api.url, request=Request(con_pool_size=workers + 4),
+                    defaults=Defaults(run_async=run_async))
+    updater = Updater(bot=bot, use_context=True, workers=workers)
+    dispatcher = updater.dispatcher
+    bot_main.register_handlers(dispatcher)
+    instrument(dispatcher, recorder)
+
+    ready = threading.Event()
+    dispatcher_thread = threading.Thread(target=dispatcher.start, kwargs={"ready": ready},
+                                         name="dispatcher", daemon=True)
+    dispatcher_thread.start()
+    ready.wait()
+    probe_cache.invalidate()
+    probe_cache.reset_counters()
+
+    ids = itertools.count(1)
+    deadline = perf_counter() + args.duration
+    timeouts = []
+    depth_samples = []
+    stop_sampling = threading.Event()
+
+    def send(update, scenario_name):
+        event = recorder.expect(update.update_id, scenario_name)
+        dispatcher.update_queue.put(update)
+        if not event.wait(args.timeout):
+            timeouts.append(scenario_name)
+
+    def chat_loop(chat_id):
+        rnd = random.Random(args.seed * 1000 + chat_id)
+        factory = UpdateFactory(updater.bot, chat_id=chat_id, ids=ids)
+        while perf_counter() < deadline:
+            scenario = rnd.choices(scenarios, weights)[0]
+            for text in scenario.setup:
+                send(factory.message(text), None)
+            send(factory.for_scenario(scenario), scenario.name)
+            if args.think:
+                sleep(rnd.expovariate(1 / args.think))
+
+    def sample_depth():
+        while not stop_sampling.wait(0.05):
+            depth_samples.append(dispatcher.update_queue.qsize())
+
+    chat_ids = [BENCH_CHAT_ID + i for i in range(args.chats)]
+    bot_main.ALLOWED_USERS.extend(c for c in chat_ids if c not in bot_main.ALLOWED_USERS)
+    sampler = threading.Thread(target=sample_depth, daemon=True)
+    sampler.start()
+    started = perf_counter()
+    chats = [threading.Thread(target=chat_loop, args=(c,), daemon=True) for c in chat_ids]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in chats:
+            thread.start()
+        for thread in chats:
+            thread.join()
+    elapsed = perf_counter() - started
+    stop_sampling.set()
+    dispatcher.stop()
+    api.stop()
+
+    records = [r for r in recorder.records.values() if r["scenario"] and "finished" in r]
+    slots = workers if run_async else 1
+    report = {
+        "mode": f"async, {workers} потоков" if run_async else "последовательно",
+        "run_async": run_async,
+        "workers": workers,
+        "chats": args.chats,
+        "elapsed_s": elapsed,
+        "completed": len(records),
+        "timeouts": len(timeouts),
+        "errors": recorder.errors,
+        "throughput_per_s": len(records) / elapsed if elapsed else 0.0,
+        "utilization": recorder.busy / (elapsed * slots) if elapsed else 0.0,
+        "peak_concurrency": recorder.peak_active,
+        "max_queue_depth": max(depth_samples, default=0),
+        "probe_cache": dict(probe_cache.counters),
+        "overall": _summary(records),
+        "scenarios": {},
+    }
+    for name in sorted({r["scenario"] for r in records}):
+        report["scenarios"][name] = _summary([r for r in records if r["scenario"] == name])
+    return report
+
+
+def _summary(records):
+    latency = [(r["finished"] - r["enqueued"]) * 1000 for r in records]
+    wait = [(r["started"] - r["enqueued"]) * 1000 for r in records]
+    # часть ожидания до выборки диспетчером (остальное - ожидание свободного рабочего потока)
+    dequeue = [(r.get("dequeued", r["started"]) - r["enqueued"]) * 1000 for r in records]
+    service = [(r["finished"] - r["started"]) * 1000 for r in records]
+    return {
+        "count": len(records),
+        "wait_p50_ms": percentile(wait, 0.50),
+        "wait_p95_ms": percentile(wait, 0.95),
+        "dequeue_p95_ms": percentile(dequeue, 0.95),
+        "latency_p50_ms": percentile(latency, 0.50),
+        "latency_p95_ms": percentile(latency, 0.95),
+        "latency_p99_ms": percentile(latency, 0.99),
+        "latency_max_ms": max(latency, default=0.0),
+        "service_p50_ms": percentile(service, 0.50),
+    }
+
+
+def _print_table(header, rows):
+    table = [header] + rows
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def print_report(report):
+    print(f"\n=== {report['mode']}, чатов: {report['chats']} ===")
+    print(f"Обработано: {report['completed']} за {report['elapsed_s']:.1f} с "
+          f"({report['throughput_per_s']:.2f}/с), таймаутов: {report['timeouts']}, ошибок: {report['errors']}")
+    print(f"Загрузка потоков: {report['utilization'] * 100:.0f}%, пиковая параллельность: "
+          f"{report['peak_concurrency']}, макс. глубина очереди: {report['max_queue_depth']}")
+    cache = report["probe_cache"]
+    print(f"Кэш проверок: из кэша {cache['hits']}, присоединились {cache['joins']}, выполнено {cache['misses']}")
+    rows = []
+    for name, s in list(report["scenarios"].items()) + [("ВСЕГО", report["overall"])]:
+        rows.append([name, str(s["count"]), f"{s['wait_p50_ms']:.0f}", f"{s['wait_p95_ms']:.0f}",
+                     f"{s['service_p50_ms']:.0f}", f"{s['latency_p50_ms']:.0f}", f"{s['latency_p95_ms']:.0f}",
+                     f"{s['latency_p99_ms']:.0f}", f"{s['latency_max_ms']:.0f}"])
+    _print_table(["Сценарий", "Кол-во", "Очередь p50", "Очередь p95", "Работа p50",
+                  "Ответ p50", "Ответ p95", "Ответ p99", "Ответ max"], rows)
+
+
+def print_sweep(reports):
+    print("\n=== Сводка ===")
+    rows = [[r["mode"], f"{r['throughput_per_s']:.2f}", f"{r['overall']['wait_p95_ms']:.0f}",
+             f"{r['overall']['latency_p95_ms']:.0f}", f"{r['overall']['latency_p99_ms']:.0f}",
+             f"{r['utilization'] * 100:.0f}%", str(r["max_queue_depth"])] for r in reports]
+    _print_table(["Режим", "Обн./с", "Очередь p95", "Ответ p95", "Ответ p99", "Загрузка", "Очередь max"], rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный генератор для диспетчера бота")
+    parser.add_argument("--chats", type=int, default=5, help="число одновременно работающих администраторов")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность прогона, сек")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="среднее время между нажатиями одного администратора, сек (0 - без пауз)")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="incident", help="смесь сценариев")
+    parser.add_argument("--workers", type=int, default=4, help="рабочих потоков диспетчера")
+    parser.add_argument("--run-async", action="store_true", help="выполнять обработчики в рабочих потоках")
+    parser.add_argument("--sweep", help="сравнить последовательный режим и async с указанными размерами пула")
+    parser.add_argument("--spawn-cost", type=float, default=0.05, help="стоимость запуска процесса, сек")
+    parser.add_argument("--powershell-cost", type=float, default=0.01, help="стоимость запроса PowerShell, сек")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, сек")
+    parser.add_argument("--timeout", type=float, default=60.0, help="максимальное ожидание ответа, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="FILE", help="сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    backend = FakeCommandBackend(spawn_cost=args.spawn_cost, powershell_cost=args.powershell_cost)
+    vpn_text = decode_output(backend.fixtures["netsh ras show client"].stdout)
+    by_name = {s.name: s for s in build_scenarios(backend.user_names[1], _parse_ras_clients(vpn_text)[0]["name"])}
+    mix = MIXES[args.mix]
+    scenarios = [by_name[name] for name in mix]
+    weights = [mix[name] for name in mix]
+
+    if args.sweep:
+        configs = [(1, False)] + [(int(w), True) for w in args.sweep.split(",") if w.strip()]
+    else:
+        configs = [(args.workers, args.run_async)]
+
+    command_runner.set_backend(backend)
+    set_provider(WindowsProvider())
+    workdir = os.getcwd()
+    reports = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # get_vpn_sessions сохраняет vpn_sessions.txt в текущий каталог
+            os.chdir(tmp)
+            try:
+                for workers, run_async in configs:
+                    report = run_load(args, workers, run_async, scenarios, weights)
+                    print_report(report)
+                    reports.append(report)
+            finally:
+                os.chdir(workdir)
+    finally:
+        command_runner.set_backend(None)
+        set_provider(None)
+
+    if len(reports) > 1:
+        print_sweep(reports)
+
+    if args.json:
+        settings = {k: getattr(args, k) for k in ("chats", "duration", "think", "mix", "spawn_cost",
+                                                   "powershell_cost", "api_latency", "seed")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "runs": reports}, f, ensure_ascii=False, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# bench_parsers.py
+"""
+Замеры парсеров вывода консольных команд.
+
+Для каждого парсера измеряются:
+  - стоимость декодирования сырых байтов (decode_output с автоопределением и с явной cp866),
+  - скорость разбора (мкс на КБ вывода, МБ/с),
+  - пиковый объём выделенной памяти при разборе (tracemalloc),
+  - полный путь через слой выполнения команд (ReplayBackend вместо реальных процессов).
+
+Источники выводов:
+  - синтетические выводы synthetic_outputs (по умолчанию, размеры задаются --sizes),
+  - записанные на сервере фикстуры (--replay <каталог>, см. COMMAND_RECORD_DIR в .env.example).
+
+Примеры:
+  python bench_parsers.py                      # таблица по синтетическим выводам
+  python bench_parsers.py --check              # сравнить с порогами bench_thresholds.json
+  python bench_parsers.py --replay fixtures    # разобрать записанные выводы
+  python bench_parsers.py --write-fixtures fx  # сохранить синтетику как фикстуры для COMMAND_REPLAY_DIR
+"""
+import os
+import io
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import contextlib
+from time import perf_counter
+
+import command_runner
+import synthetic_outputs
+from command_runner import CommandResult, FixtureStore, ReplayBackend, decode_output
+from platform_provider import WindowsProvider, parse_qwinsta, set_provider
+
+import rdp_sessions
+import network_check
+import vpn_connections
+import user_management
+import backup_monitoring
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_thresholds.json")
+
+BACKUP_TASK = "\\Microsoft\\Windows\\Backup\\Microsoft-Windows-WindowsBackup"
+PING_HOST = "ya.ru"
+USER_NAME = "ivanov"
+
+
+class ParserCase:
+    """
+    Описание одного парсера: какой командой получен вывод, как его сгенерировать,
+    как разобрать и какой публичной функцией бот проходит весь путь целиком.
+    """
+
+    def __init__(self, name, command, generate, parse, end_to_end, encoding=None):
+        self.name = name
+        self.command = command        # функция размер -> текст команды
+        self.generate = generate      # функция размер -> сырые байты
+        self.parse = parse            # функция текст -> результат разбора (None - только декодирование)
+        self.end_to_end = end_to_end  # функция размер -> вызов через command_runner
+        self.encoding = encoding      # кодировка, которую задаёт сам бот (None - автоопределение)
+
+    def matches(self, command):
+        """Записанная команда относится к парсеру, если совпадают первые два слова."""
+        return command.lower().split()[:2] == self.command(1).lower().split()[:2]
+
+
+CASES = [
+    ParserCase(
+        "qwinsta",
+        lambda size: "qwinsta",
+        synthetic_outputs.qwinsta,
+        parse_qwinsta,
+        lambda size: rdp_sessions.get_sessions(),
+        encoding="cp866",
+    ),
+    ParserCase(
+        "netsh_ras_clients",
+        lambda size: "netsh ras show client",
+        synthetic_outputs.netsh_ras_clients,
+        vpn_connections._parse_ras_clients,
+        lambda size: vpn_connections.get_vpn_sessions(),
+    ),
+    ParserCase(
+        "ping",
+        lambda size: f"ping -n {size} {PING_HOST}",
+        synthetic_outputs.ping,
+        network_check._parse_ping_stats,
+        lambda size: network_check._ping_host(PING_HOST, count=size),
+    ),
+    ParserCase(
+        "tracert",
+        lambda size: f"tracert {PING_HOST}",
+        synthetic_outputs.tracert,
+        None,
+        lambda size: network_check._traceroute(PING_HOST),
+    ),
+    ParserCase(
+        "wbadmin_versions",
+        lambda size: "wbadmin get versions",
+        synthetic_outputs.wbadmin_versions,
+        backup_monitoring._parse_backup_versions,
+        lambda size: backup_monitoring.get_backup_versions(),
+    ),
+    ParserCase(
+        "schtasks_list",
+        lambda size: f'schtasks /query /fo LIST /tn "{BACKUP_TASK}"',
+        lambda size: synthetic_outputs.schtasks_list(size, task_name=BACKUP_TASK),
+        backup_monitoring._parse_task_schedule,
+        lambda size: backup_monitoring._get_task_schedule_details(BACKUP_TASK),
+    ),
+    ParserCase(
+        "net_user",
+        lambda size: f'net user "{USER_NAME}"',
+        lambda size: synthetic_outputs.net_user(USER_NAME, groups=size),
+        lambda text: user_management._parse_user_info(USER_NAME, text),
+        lambda size: user_management.get_user_info(USER_NAME),
+    ),
+]
+
+
+# ============== ЗАМЕРЫ ==============
+
+def _median_time(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        samples.append(perf_counter() - start)
+    return statistics.median(samples)
+
+
+def _warm_median_time(func, repeat):
+    """_median_time после одного вызова без замера: разовые затраты (загрузка моделей chardet,
+    компиляция выражений) не попадают в выборку, и итог не зависит от --repeat."""
+    func()
+    return _median_time(func, repeat)
+
+
+def _peak_allocation(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def _records(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+def measure(case, raw, repeat):
+    """Замеры декодирования и разбора одного вывода. Возвращает словарь метрик."""
+    kb = max(len(raw) / 1024, 1e-9)
+    row = {
+        "parser": case.name,
+        "bytes": len(raw),
+        "decode_auto_us_per_kb": _warm_median_time(lambda: decode_output(raw), repeat) * 1e6 / kb,
+        "decode_cp866_us_per_kb": _warm_median_time(lambda: decode_output(raw, "cp866"), repeat) * 1e6 / kb,
+    }
+    text = decode_output(raw, case.encoding)
+    if case.parse is not None:
+        parse_time = _warm_median_time(lambda: case.parse(text), repeat)
+        peak = _peak_allocation(lambda: case.parse(text))
+        row.update({
+            "records": _records(case.parse(text)),
+            "parse_us_per_kb": parse_time * 1e6 / kb,
+            "parse_mb_s": (len(raw) / 1024**2) / parse_time if parse_time else float("inf"),
+            "peak_alloc_kb": peak / 1024,
+            "alloc_ratio": peak / max(len(raw), 1),
+        })
+    return row
+
+
+def measure_end_to_end(case, size, raw, repeat):
+    """
+    Полный путь через слой выполнения: публичная функция бота вызывается как обычно,
+    но команда отдаёт синтетический вывод из ReplayBackend. Возвращает (мс, число запусков команд).
+    """
+    backend = ReplayBackend(fixtures={case.command(size): CommandResult(0, raw)})
+    command_runner.set_backend(backend)
+    set_provider(WindowsProvider())
+    workdir = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            # get_vpn_sessions сохраняет vpn_sessions.txt в текущий каталог
+            os.chdir(tmp)
+            try:
+                command_runner.reset_counters()
+                elapsed = _median_time(lambda: case.end_to_end(size), repeat)
+                commands = command_runner.counters["commands"] / repeat
+            finally:
+                os.chdir(workdir)
+    finally:
+        command_runner.set_backend(None)
+        set_provider(None)
+    if backend.missing:
+        raise RuntimeError(f"{case.name}: нет фикстуры для {backend.missing[0]!r}")
+    return elapsed * 1000, commands
+
+
+# ============== ИСТОЧНИКИ ВЫВОДОВ ==============
+
+def synthetic_inputs(sizes):
+    for case in CASES:
+        for size in sizes:
+            yield case, size, case.generate(size)
+
+
+def replay_inputs(directory):
+    """Записанные фикстуры из каталога: каждая сопоставляется с парсером по команде."""
+    store = FixtureStore(directory)
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.startswith("cmd-") or not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+            command = json.load(f)["command"]
+        case = next((c for c in CASES if c.matches(command)), None)
+        if case is None:
+            continue
+        result = store.load("cmd", command)
+        if result is not None:
+            yield case, file_name[:-5], result.stdout
+
+
+def write_fixtures(directory, sizes):
+    """Сохраняет синтетические выводы как фикстуры (для COMMAND_REPLAY_DIR)."""
+    store = FixtureStore(directory)
+    for case in CASES:
+        # Для одной команды хранится один вывод - берём самый большой размер
+        size = max(sizes)
+        store.save("cmd", case.command(size), CommandResult(0, case.generate(size)))
+    print(f"Фикстуры сохранены в {directory} (размер {max(sizes)})")
+
+
+# ============== ПОРОГИ ==============
+
+def check_thresholds(rows, thresholds):
+    """
+    Пороги задаются по имени парсера: {"qwinsta": {"parse_us_per_kb": 400, ...}}.
+    Значение метрики выше порога считается регрессией. Возвращает список сообщений.
+    """
+    failures = []
+    for row in rows:
+        limits = thresholds.get(row["parser"], {})
+        for metric, limit in limits.items():
+            value = row.get(metric)
+            if value is not None and value > limit:
+                failures.append(f"{row['parser']} [{row['source']}]: {metric} = {value:.1f} > {limit}")
+    return failures
+
+
+# ============== ОТЧЁТ ==============
+
+_COLUMNS = [
+    ("parser", "Парсер", "{}"),
+    ("source", "Вход", "{}"),
+    ("bytes", "Байт", "{}"),
+    ("records", "Записей", "{}"),
+    ("decode_auto_us_per_kb", "Декод. авто мкс/КБ", "{:.1f}"),
+    ("decode_cp866_us_per_kb", "Декод. cp866 мкс/КБ", "{:.1f}"),
+    ("parse_us_per_kb", "Разбор мкс/КБ", "{:.1f}"),
+    ("parse_mb_s", "Разбор МБ/с", "{:.1f}"),
+    ("peak_alloc_kb", "Пик памяти КБ", "{:.1f}"),
+    ("end_to_end_ms", "Полный путь мс", "{:.2f}"),
+]
+
+
+def print_table(rows):
+    table = [[title for _, title, _ in _COLUMNS]]
+    for row in rows:
+        table.append([fmt.format(row[key]) if row.get(key) is not None else "-" for key, _, fmt in _COLUMNS])
+    widths = [max(len(line[i]) for line in table) for i in range(len(_COLUMNS))]
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры парсеров вывода консольных команд")
+    parser.add_argument("--sizes", default="10,2000",
+                        help="размеры синтетических выводов через запятую (сеансы, версии, хопы...)")
+    parser.add_argument("--repeat", type=int, default=5, help="число повторов каждого замера")
+    parser.add_argument("--only", help="замерить только указанные парсеры (через запятую)")
+    parser.add_argument("--replay", metavar="DIR", help="разбирать записанные фикстуры вместо синтетики")
+    parser.add_argument("--write-fixtures", metavar="DIR", help="сохранить синтетические выводы как фикстуры")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="файл порогов регрессии")
+    parser.add_argument("--check", action="store_true", help="завершиться с кодом 1 при превышении порогов")
+    parser.add_argument("--json", metavar="FILE", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if args.write_fixtures:
+        write_fixtures(args.write_fixtures, sizes)
+        return 0
+
+    only = set(args.only.split(",")) if args.only else None
+    inputs = replay_inputs(args.replay) if args.replay else synthetic_inputs(sizes)
+
+    rows = []
+    for case, source, raw in inputs:
+        if only and case.name not in only:
+            continue
+        row = measure(case, raw, args.repeat)
+        row["source"] = str(source)
+        if not args.replay:
+            row["end_to_end_ms"], row["commands"] = measure_end_to_end(case, source, raw, args.repeat)
+        rows.append(row)
+
+    print_table(rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=1)
+
+    if args.check:
+        with open(args.thresholds, encoding="utf-8") as f:
+            thresholds = json.load(f)
+        failures = check_thresholds(rows, thresholds)
+        if failures:
+            print("\nРегрессия производительности:")
+            for message in failures:
+                print(f"  {message}")
+            return 1
+        print("\nПороги не превышены")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
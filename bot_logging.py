@@ -0,0 +1,146 @@
+# bot_logging.py
+"""
+Журналирование бота.
+Модули пишут в logging.getLogger(__name__); setup() (вызывается из bot_main) направляет
+все записи в очередь, а отдельный поток выводит их в консоль и в файл с ротацией по размеру.
+Обработчики Telegram не ждут записи на диск или в консоль службы; при переполнении
+очереди записи отбрасываются (счётчик dropped).
+
+Настройки (.env):
+  LOG_LEVEL          - общий уровень (по умолчанию INFO),
+  LOG_LEVELS         - уровни отдельных модулей: "network_check=DEBUG,outbox=WARNING",
+  LOG_FILE           - файл журнала (по умолчанию bot.log; пусто - без файла),
+  LOG_MAX_BYTES, LOG_BACKUP_COUNT - размер файла и число старых копий,
+  LOG_CONSOLE        - выводить журнал в консоль (по умолчанию 1),
+  LOG_PAYLOAD_SAMPLE - сырые выводы команд (payload) пишутся для каждого N-го вызова,
+  LOG_PAYLOAD_LIMIT  - сколько символов сырого вывода попадает в журнал.
+"""
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_FILE = "bot.log"
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_PAYLOAD_SAMPLE = 1
+DEFAULT_PAYLOAD_LIMIT = 2000
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(threadName)s] %(name)s: %(message)s"
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+_payload_calls = {}  # место вызова -> число вызовов (для выборки)
+_payload_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Кладёт записи в очередь без ожидания; форматирование выполняется в потоке записи."""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь внутри процесса: запись не нужно сериализовать, аргументы подставит форматтер
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(text):
+    """"network_check=DEBUG, outbox=WARNING" -> {"network_check": 10, "outbox": 30}."""
+    levels = {}
+    for item in (text or "").split(","):
+        name, _, level = item.partition("=")
+        level = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+
+def setup():
+    """Настраивает журналирование по переменным окружения (повторный вызов ничего не делает)."""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter(LOG_FORMAT)
+        outputs = []
+        if os.getenv("LOG_CONSOLE", "1").strip().lower() in ("1", "true", "yes"):
+            outputs.append(logging.StreamHandler(sys.stderr))
+        log_file = os.getenv("LOG_FILE", DEFAULT_FILE)
+        if log_file:
+            outputs.append(RotatingFileHandler(log_file, maxBytes=_env_int("LOG_MAX_BYTES", DEFAULT_MAX_BYTES),
+                                               backupCount=_env_int("LOG_BACKUP_COUNT", DEFAULT_BACKUP_COUNT),
+                                               encoding="utf-8"))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        _handler = _DroppingQueueHandler(queue.Queue(_env_int("LOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)))
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+        root.setLevel(level if isinstance(level, int) else logging.INFO)
+        for name, module_level in parse_levels(os.getenv("LOG_LEVELS")).items():
+            logging.getLogger(name).setLevel(module_level)
+        # Запросы python-telegram-bot на уровне DEBUG слишком многословны
+        if "telegram" not in parse_levels(os.getenv("LOG_LEVELS")):
+            logging.getLogger("telegram").setLevel(max(logging.INFO, root.level))
+
+        _listener = QueueListener(_handler.queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Дописывает оставшиеся в очереди записи и останавливает поток записи."""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        logging.getLogger().removeHandler(_handler)
+
+
+def dropped():
+    """Сколько записей отброшено из-за переполнения очереди."""
+    return _handler.dropped if _handler is not None else 0
+
+
+def payload(logger, title, data, key=None):
+    """
+    Сырой вывод команды на уровне DEBUG. Если DEBUG для модуля выключен, вызов ничего
+    не стоит (данные не форматируются); иначе пишется каждый LOG_PAYLOAD_SAMPLE-й вызов
+    с этого места (key, по умолчанию - заголовок) и не больше LOG_PAYLOAD_LIMIT символов.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sample = max(1, _env_int("LOG_PAYLOAD_SAMPLE", DEFAULT_PAYLOAD_SAMPLE))
+    site = (logger.name, key or title)
+    with _payload_lock:
+        calls = _payload_calls.get(site, 0)
+        _payload_calls[site] = calls + 1
+    if calls % sample:
+        return
+    text = data if isinstance(data, str) else repr(data)
+    limit = _env_int("LOG_PAYLOAD_LIMIT", DEFAULT_PAYLOAD_LIMIT)
+    if len(text) > limit:
+        text = f"{text[:limit]}… (ещё {len(text) - limit} симв.)"
+    logger.debug("%s:\n%s", title, text)
@@ -1,22 +1,21 @@
-﻿import sys
+﻿import startup  # первым: от его загрузки отсчитывается время запуска
+import sys
 import ctypes
 import os
-import telegram
-from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters,
-                          CallbackQueryHandler, CallbackContext, ConversationHandler)
+import logging
 import re
+import time
+import threading
+from datetime import datetime
 from dotenv import load_dotenv
 
-from system_info import get_server_load
-from rdp_sessions import get_sessions, logoff_session
-from vpn_connections import get_vpn_sessions, reset_vpn_session
-from server_control import reboot_server, restart_vpn_service
-from network_check import check_speedtest, check_network_status, check_custom_connection
-from user_management import get_users, block_user, unblock_user, get_user_info, change_user_password
-from backup_monitoring import get_backup_status, get_backup_versions, start_manual_backup, check_backup_disk_space
+import bot_logging
 
 # Загружаем переменные из .env файла
 load_dotenv()
+# Журнал: консоль и bot.log через очередь (настройки LOG_* в .env)
+bot_logging.setup()
+logger = logging.getLogger("bot_main")
 
 # Получаем конфигурацию из переменных окружения
 TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -30,23 +29,86 @@ else:
 
 # Проверяем, что необходимые переменные загружены
 if not TOKEN:
-    print("❌ Ошибка: TELEGRAM_TOKEN не найден в .env файле!")
-    print("Создайте файл .env и добавьте в него:")
-    print("TELEGRAM_TOKEN=your_bot_token_here")
+    logger.error("❌ TELEGRAM_TOKEN не найден в .env файле! Создайте файл .env и добавьте в него: "
+                 "TELEGRAM_TOKEN=your_bot_token_here")
     sys.exit(1)
 
 if not ALLOWED_USERS:
-    print("❌ Предупреждение: ALLOWED_USERS не настроен в .env файле!")
-    print("Добавьте в .env файл:")
-    print("ALLOWED_USERS=123456,654321")
+    logger.error("❌ ALLOWED_USERS не настроен в .env файле! Добавьте в .env файл: ALLOWED_USERS=123456,654321")
     sys.exit(1)
 
-print(f"✅ Конфигурация загружена:")
-print(f"   - Токен бота: {'*' * (len(TOKEN)-8) + TOKEN[-8:] if TOKEN else 'не задан'}")
-print(f"   - Разрешенных пользователей: {len(ALLOWED_USERS)}")
+startup.mark("настройка")
+
+# Библиотека Telegram загружается после проверки настроек: при ошибке в .env бот сообщает о ней сразу
+import telegram
+from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters,
+                          CallbackQueryHandler, CallbackContext, ConversationHandler, Defaults,
+                          TypeHandler, DispatcherHandlerStop)
+from telegram.utils.request import Request
+
+from outbox import OutboxBot
+from paged_output import send_text, get_page, parse_callback
+import service_watcher
+import jobs
+import metrics
+import tracing
+import profiler
+import stall_watchdog
+import bot_state
+import prefetch
+import backend_strategy
+
+# Модули разделов загружаются при первом обращении (и в фоне после подключения, см. main):
+# вместе с зависимостями (speedtest, chardet, ...) они не задерживают запуск
+server_load_report = startup.lazy("system_info", "server_load_report")
+get_sessions = startup.lazy("rdp_sessions", "get_sessions")
+logoff_session = startup.lazy("rdp_sessions", "logoff_session")
+reset_vpn_session = startup.lazy("vpn_connections", "reset_vpn_session")
+reboot_server = startup.lazy("server_control", "reboot_server")
+restart_service = startup.lazy("server_control", "restart_service")
+check_speedtest = startup.lazy("network_check", "check_speedtest")
+network_status_report = startup.lazy("network_check", "network_status_report")
+custom_connection_report = startup.lazy("network_check", "custom_connection_report")
+block_user = startup.lazy("user_management", "block_user")
+unblock_user = startup.lazy("user_management", "unblock_user")
+get_user_info = startup.lazy("user_management", "get_user_info")
+change_user_password = startup.lazy("user_management", "change_user_password")
+start_manual_backup = startup.lazy("backup_monitoring", "start_manual_backup")
+backup_status_report = startup.lazy("backup_monitoring", "backup_status_report")
+get_backup_versions = startup.lazy("backup_monitoring", "get_backup_versions")
+FEATURE_MODULES = ("system_info", "rdp_sessions", "vpn_connections", "server_control", "network_check",
+                   "user_management", "backup_monitoring", "dashboard")
+
+startup.mark("импорт модулей")
+
+logger.info("✅ Конфигурация загружена: токен бота %s, разрешенных пользователей: %d",
+            '*' * (len(TOKEN) - 8) + TOKEN[-8:], len(ALLOWED_USERS))
+
+# Параметры диспетчера: число рабочих потоков и выполнение обработчиков в них.
+# По умолчанию обработчики выполняются по очереди в потоке диспетчера.
+try:
+    BOT_WORKERS = int(os.getenv("BOT_WORKERS", "4"))
+except ValueError:
+    BOT_WORKERS = 4
+BOT_RUN_ASYNC = os.getenv("BOT_RUN_ASYNC", "").strip().lower() in ("1", "true", "yes")
+# Уведомлять администраторов об изменении состояния наблюдаемых служб (service_watcher)
+SERVICE_ALERTS = os.getenv("SERVICE_ALERTS", "1").strip().lower() in ("1", "true", "yes")
+# Присылать ли после каждого действия водопад его трассы (tracing.py); в чате переключается командой /trace
+TRACE_REPLY = os.getenv("TRACE_REPLY", "").strip().lower() in ("1", "true", "yes")
+TRACE_CALLBACK_PREFIX = "trace_"
+trace_reply_chats = {}  # chat_id -> включены ли водопады в этом чате (если не задано - TRACE_REPLY)
+# Длительность /profile без аргумента, секунд
+PROFILE_DEFAULT_SECONDS = 30
+# Сообщения, отправленные боту больше чем за STALE_UPDATE_AGE секунд до его запуска (например,
+# пока сервер перезагружался), не выполняются; 0 - выполнять все накопившиеся
+try:
+    STALE_UPDATE_AGE = float(os.getenv("STALE_UPDATE_AGE", "120"))
+except ValueError:
+    STALE_UPDATE_AGE = 120
 
 # Константа для состояния ввода адреса для проверки связи до узла
-CHECK_HOST = range(1)
+# (состояние диалога сохраняется в bot_state.json, поэтому это число)
+CHECK_HOST = 0
 
 def is_authorized(update: telegram.Update) -> bool:
     user_id = update.effective_user.id
@@ -56,7 +118,7 @@ def check_admin():
     try:
         return ctypes.windll.shell32.IsUserAnAdmin()
     except Exception as e:
-        print(f"Ошибка проверки прав администратора: {e}")
+        logger.error("Ошибка проверки прав администратора: %s", e)
         return False
 
 def start(update: telegram.Update, context: CallbackContext):
@@ -80,6 +142,8 @@ def handle_message(update: telegram.Update, context: CallbackContext):
     text = update.message.text
     if text == "Состояние сервера":
         show_server_load(update, context)
+    elif text == "Живая панель":
+        show_dashboard(update, context)
     elif text == "VPN соединения":
         show_vpn_sessions(update, context)
     elif text == "Управление пользователями":
@@ -96,6 +160,8 @@ def handle_message(update: telegram.Update, context: CallbackContext):
         do_reboot_server(update, context)
     elif text == "Перезапуск VPN":
         do_restart_vpn(update, context)
+    elif text == "Перезапуск службы":
+        show_service_restart_menu(update, context)
     elif text == "Проверить скорость":
         do_check_speedtest(update, context)
     elif text == "Состояние сети":
@@ -130,9 +196,6 @@ def show_backup_menu(update: telegram.Update, context: CallbackContext):
 
 def do_show_backup_status(update: telegram.Update, context: CallbackContext):
     """Показывает статус резервных копий с дополнительными действиями"""
-    update.message.reply_text("⏳ Проверяю статус резервных копий...")
-    status_info = get_backup_status()
-    
     # Создаем inline кнопки для дополнительных действий
     keyboard = [
         [telegram.InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_backup_status")],
@@ -140,24 +203,34 @@ def do_show_backup_status(update: telegram.Update, context: CallbackContext):
     ]
     reply_markup = telegram.InlineKeyboardMarkup(keyboard)
     
-    update.message.reply_text(status_info, reply_markup=reply_markup)
+    # Одно сообщение, которое заполняется по мере готовности секций; кнопки - в последней правке
+    start_report_job(update, context, "Статус резервных копий", backup_status_report(),
+                     update.message.reply_text, reply_markup=reply_markup)
 
 def do_show_backup_versions(update: telegram.Update, context: CallbackContext):
     """Показывает список версий резервных копий"""
-    update.message.reply_text("⏳ Получаю список версий копий...")
-    versions_info = get_backup_versions()
-    
-    keyboard = [
-        [telegram.InlineKeyboardButton("🔄 Обновить список", callback_data="refresh_backup_versions")]
-    ]
-    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
-    
-    update.message.reply_text(versions_info, reply_markup=reply_markup)
+    message = None
+
+    def started(job):
+        nonlocal message
+        message = update.message.reply_text("⏳ Получаю список версий копий...", reply_markup=jobs.cancel_markup(job))
+
+    def finished(versions_info):
+        keyboard = [
+            [telegram.InlineKeyboardButton("🔄 Обновить список", callback_data="refresh_backup_versions")]
+        ]
+        reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+
+        send_text(versions_info, message.edit_text, update.message.reply_document,
+                  reply_markup=reply_markup, filename="backup_versions.txt", edit=True)
+
+    start_job(update, context, "Список версий копий", lambda: prefetch.get("backup_versions"), on_start=started,
+              on_result=finished, on_cancel=lambda reason: message.edit_text(f"⛔ Получение списка отменено: {reason}"))
 
 def do_check_backup_disk_space(update: telegram.Update, context: CallbackContext):
     """Проверяет место на дисках для резервных копий"""
     update.message.reply_text("⏳ Проверяю место на дисках...")
-    disk_info = check_backup_disk_space()
+    disk_info = prefetch.get("disks")
     
     keyboard = [
         [telegram.InlineKeyboardButton("🔄 Обновить информацию", callback_data="refresh_disk_space")]
@@ -177,8 +250,6 @@ def handle_refresh_backup_status(update: telegram.Update, context: CallbackConte
     query = update.callback_query
     query.answer("🔄 Обновляю статус...")
     
-    status_info = get_backup_status()
-    
     # Убрали кнопку "Ручной запуск"
     keyboard = [
         [telegram.InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_backup_status")],
@@ -186,7 +257,9 @@ def handle_refresh_backup_status(update: telegram.Update, context: CallbackConte
     ]
     reply_markup = telegram.InlineKeyboardMarkup(keyboard)
     
-    query.edit_message_text(status_info, reply_markup=reply_markup)
+    # Обновление по кнопке - всегда свежие данные (к уже идущей проверке присоединяемся)
+    start_report_job(update, context, "Статус резервных копий", backup_status_report(max_age=0),
+                     query.edit_message_text, reply_markup=reply_markup)
 
 def handle_manual_backup(update: telegram.Update, context: CallbackContext):
     """Обрабатывает запрос ручного запуска резервного копирования"""
@@ -251,9 +324,9 @@ def handle_backup_details(update: telegram.Update, context: CallbackContext):
     query = update.callback_query
     query.answer("📋 Получаю детальную информацию...")
     
-    # Получаем подробную информацию
-    versions_info = get_backup_versions()
-    disk_info = check_backup_disk_space()
+    # Получаем подробную информацию: весь каталог версий (длинный выводится страницами или файлом)
+    versions_info = get_backup_versions(limit=None)
+    disk_info = prefetch.get("disks")
     
     detailed_info = f"📋 Детальная информация о резервных копиях:\n\n{versions_info}\n\n{disk_info}"
     
@@ -263,7 +336,8 @@ def handle_backup_details(update: telegram.Update, context: CallbackContext):
     ]
     reply_markup = telegram.InlineKeyboardMarkup(keyboard)
     
-    query.edit_message_text(detailed_info, reply_markup=reply_markup)
+    send_text(detailed_info, query.edit_message_text, query.message.reply_document,
+              reply_markup=reply_markup, filename="backup_details.txt", edit=True)
 
 def handle_refresh_backup_versions(update: telegram.Update, context: CallbackContext):
     """Обновляет список версий резервных копий"""
@@ -273,15 +347,22 @@ def handle_refresh_backup_versions(update: telegram.Update, context: CallbackCon
         
     query = update.callback_query
     query.answer("🔄 Обновляю список...")
-    
-    versions_info = get_backup_versions()
-    
-    keyboard = [
-        [telegram.InlineKeyboardButton("🔄 Обновить список", callback_data="refresh_backup_versions")]
-    ]
-    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
-    
-    query.edit_message_text(versions_info, reply_markup=reply_markup)
+
+    def started(job):
+        query.edit_message_text("⏳ Получаю список версий копий...", reply_markup=jobs.cancel_markup(job))
+
+    def finished(versions_info):
+        keyboard = [
+            [telegram.InlineKeyboardButton("🔄 Обновить список", callback_data="refresh_backup_versions")]
+        ]
+        reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+
+        send_text(versions_info, query.edit_message_text, query.message.reply_document,
+                  reply_markup=reply_markup, filename="backup_versions.txt", edit=True)
+
+    start_job(update, context, "Список версий копий", lambda: prefetch.get("backup_versions", max_age=0),
+              on_start=started, on_result=finished,
+              on_cancel=lambda reason: query.edit_message_text(f"⛔ Получение списка отменено: {reason}"))
 
 def handle_refresh_disk_space(update: telegram.Update, context: CallbackContext):
     """Обновляет информацию о месте на дисках"""
@@ -292,7 +373,7 @@ def handle_refresh_disk_space(update: telegram.Update, context: CallbackContext)
     query = update.callback_query
     query.answer("🔄 Обновляю информацию...")
     
-    disk_info = check_backup_disk_space()
+    disk_info = prefetch.get("disks", max_age=0)
     
     keyboard = [
         [telegram.InlineKeyboardButton("🔄 Обновить информацию", callback_data="refresh_disk_space")]
@@ -301,6 +382,23 @@ def handle_refresh_disk_space(update: telegram.Update, context: CallbackContext)
     
     query.edit_message_text(disk_info, reply_markup=reply_markup)
 
+def handle_page(update: telegram.Update, context: CallbackContext):
+    """Листание длинного вывода: страницы берутся из paged_output без повторного выполнения команд"""
+    if not is_authorized(update):
+        update.callback_query.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    query = update.callback_query
+    page_id, index = parse_callback(query.data)
+    page = get_page(page_id, index)
+    if page is None:
+        query.answer("Вывод устарел, запросите его заново.", show_alert=True)
+        return
+
+    query.answer()
+    text, reply_markup = page
+    query.edit_message_text(text, reply_markup=reply_markup)
+
 # ============== ОСТАЛЬНЫЕ ФУНКЦИИ (ОРИГИНАЛЬНЫЕ) ==============
 
 def show_user_management_menu(update: telegram.Update, context: CallbackContext):
@@ -315,7 +413,7 @@ def show_user_management_menu(update: telegram.Update, context: CallbackContext)
 def show_users_list(update: telegram.Update, context: CallbackContext):
     """Показывает список пользователей в виде кнопок"""
     update.message.reply_text("Получаю список пользователей...")
-    users = get_users()
+    users = prefetch.get("users")
     
     if not users:
         update.message.reply_text("Пользователи не найдены или произошла ошибка.")
@@ -349,7 +447,7 @@ def handle_user_menu(update: telegram.Update, context: CallbackContext):
     username = query.data.replace("user_menu_", "")
     
     # Получаем актуальную информацию о пользователе
-    users = get_users()
+    users = prefetch.get("users")
     user_info = next((u for u in users if u['name'] == username), None)
     
     if not user_info:
@@ -390,7 +488,7 @@ def handle_user_sessions(update: telegram.Update, context: CallbackContext):
     
     username = query.data.replace("sessions_", "")
     
-    sessions = get_sessions()
+    sessions = prefetch.get("sessions")
     user_sessions = [s for s in sessions if s['user'].lower() == username.lower()]
     
     if not user_sessions:
@@ -424,7 +522,7 @@ def handle_back_to_users(update: telegram.Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     
-    users = get_users()
+    users = prefetch.get("users")
     
     if not users:
         query.edit_message_text("Пользователи не найдены или произошла ошибка.")
@@ -455,6 +553,7 @@ def handle_refresh_users(update: telegram.Update, context: CallbackContext):
     query = update.callback_query
     query.answer("🔄 Обновляю список...")
     
+    prefetch.invalidate("users")
     handle_back_to_users(update, context)
 
 def handle_change_password(update: telegram.Update, context: CallbackContext):
@@ -498,7 +597,7 @@ def handle_change_password(update: telegram.Update, context: CallbackContext):
 def show_vpn_sessions(update: telegram.Update, context: CallbackContext):
     """Показывает список VPN-соединений в виде кнопок (единый стиль с пользователями)"""
     update.message.reply_text("Получаю список VPN-соединений...")
-    vpn_sessions = get_vpn_sessions()
+    vpn_sessions = prefetch.get("vpn")
     
     if not vpn_sessions:
         update.message.reply_text("Нет активных VPN-соединений.")
@@ -528,7 +627,7 @@ def handle_vpn_menu(update: telegram.Update, context: CallbackContext):
     vpn_name = query.data.replace("vpn_menu_", "")
     
     # Получаем актуальную информацию о VPN сессии
-    vpn_sessions = get_vpn_sessions()
+    vpn_sessions = prefetch.get("vpn")
     vpn_info = next((s for s in vpn_sessions if s['name'] == vpn_name), None)
     
     if not vpn_info:
@@ -556,7 +655,7 @@ def handle_back_to_vpn(update: telegram.Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     
-    vpn_sessions = get_vpn_sessions()
+    vpn_sessions = prefetch.get("vpn")
     
     if not vpn_sessions:
         query.edit_message_text("Нет активных VPN-соединений.")
@@ -583,6 +682,7 @@ def handle_refresh_vpn(update: telegram.Update, context: CallbackContext):
     query = update.callback_query
     query.answer("🔄 Обновляю список...")
     
+    prefetch.invalidate("vpn")
     handle_back_to_vpn(update, context)
 
 def handle_reset_vpn(update: telegram.Update, context: CallbackContext):
@@ -596,6 +696,7 @@ def handle_reset_vpn(update: telegram.Update, context: CallbackContext):
         user_name = callback_data.replace("reset_vpn_", "")
         query.edit_message_text(f"⏳ Сбрасываю VPN-соединение {user_name}...")
         success, message = reset_vpn_session(user_name)
+        prefetch.refresh("vpn")
         
         # Добавляем навигацию в едином стиле
         keyboard = [[telegram.InlineKeyboardButton("◀️ Назад к VPN соединениям", callback_data="back_to_vpn")]]
@@ -613,25 +714,150 @@ def handle_reset_vpn(update: telegram.Update, context: CallbackContext):
 def show_server_control_menu(update: telegram.Update, context: CallbackContext):
     keyboard = [
         [telegram.KeyboardButton("Состояние сервера")],
+        [telegram.KeyboardButton("Живая панель")],
         [telegram.KeyboardButton("Проверка связи")],
         [telegram.KeyboardButton("Резервные копии")],
         [telegram.KeyboardButton("Перезагрузка сервера")],
         [telegram.KeyboardButton("Перезапуск VPN")],
+        [telegram.KeyboardButton("Перезапуск службы")],
         [telegram.KeyboardButton("Назад")]
     ]
     reply_markup = telegram.ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
     update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
 
 def do_reboot_server(update: telegram.Update, context: CallbackContext):
+    # Заявка и снимок служб и сеансов - на диск до перезагрузки: после запуска бот пришлёт отчёт
+    bot_state.put("reboot", reboot_snapshot(update.effective_chat.id))
+    bot_state.flush()
     success, message = reboot_server()
+    if not success:
+        bot_state.pop("reboot")
     update.message.reply_text(message)
 
+def reboot_snapshot(chat_id):
+    """Кто и когда запросил перезагрузку, состояния служб и сеансы RDP на этот момент"""
+    try:
+        sessions = sorted({session["user"] for session in get_sessions() if session.get("user")})
+    except Exception as e:
+        logger.warning("Не удалось получить сеансы перед перезагрузкой: %s", e)
+        sessions = None
+    return {"chat_id": chat_id, "requested": time.time(), "services": service_watcher.states(),
+            "sessions": sessions}
+
+def send_reboot_report(bot, request, ready_at):
+    """Отчёт "сервер снова в работе" администратору, запросившему перезагрузку"""
+    requested = request.get("requested", ready_at)
+    lines = ["✅ Сервер снова в работе",
+             f"Перезагрузка запрошена: {datetime.fromtimestamp(requested):%d.%m.%Y %H:%M:%S}"]
+    try:
+        from platform_provider import get_provider
+        boot_time = get_provider().boot_time()
+    except Exception as e:
+        logger.warning("Не удалось получить время загрузки: %s", e)
+        boot_time = None
+    if boot_time is not None:
+        lines.append(f"Система загрузилась: {boot_time:%d.%m.%Y %H:%M:%S}")
+        if boot_time.timestamp() < requested:
+            lines[0] = "⚠️ Бот перезапущен, но сервер с момента запроса не перезагружался"
+    lines.append(f"Бот принимает команды через {format_duration(ready_at - requested)} после запроса")
+    lines.append(startup.report())
+
+    try:
+        states = service_watcher.refresh()
+        before = request.get("services") or {}
+        lines.append("\nСлужбы:")
+        for name in service_watcher.watch_list():
+            line = f"• {service_watcher.label(name)}: {states.get(name) or 'не найдена'}"
+            if before.get(name) and before[name] != states.get(name):
+                line += f" (до перезагрузки {before[name]})"
+            lines.append(line)
+    except Exception as e:
+        lines.append(f"\nСлужбы: ошибка опроса ({e})")
+
+    if request.get("sessions") is not None:
+        try:
+            now = {session["user"] for session in get_sessions() if session.get("user")}
+            missing = [user for user in request["sessions"] if user not in now]
+            lines.append(f"\nСеансы RDP: {len(now)} (до перезагрузки {len(request['sessions'])})")
+            if missing:
+                lines.append("Ещё не подключились: " + ", ".join(missing))
+        except Exception as e:
+            lines.append(f"\nСеансы RDP: ошибка ({e})")
+
+    chat_id = request.get("chat_id")
+    for user_id in [chat_id] if chat_id else ALLOWED_USERS:
+        try:
+            send_text("\n".join(lines), *chat_senders(bot, user_id), filename="reboot.txt")
+        except telegram.error.TelegramError as e:
+            logger.warning("Не удалось отправить отчёт о перезагрузке %s: %s", user_id, e)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(max(0, int(seconds)), 60)
+    return f"{minutes} мин {seconds} с" if minutes else f"{seconds} с"
+
+def drop_stale_update(update: telegram.Update, context: CallbackContext):
+    # Накопившиеся за время простоя сообщения (например, повторное "Перезагрузка сервера")
+    # не выполняются. У нажатий inline-кнопок нет времени нажатия - они обрабатываются как обычно
+    message = update.message
+    if STALE_UPDATE_AGE and message is not None and message.date is not None \
+            and message.date.timestamp() < startup.STARTED_AT - STALE_UPDATE_AGE:
+        logger.info("Пропущено устаревшее сообщение от %s: %r", message.chat_id, message.text)
+        raise DispatcherHandlerStop()
+
 def do_restart_vpn(update: telegram.Update, context: CallbackContext):
-    success, message = restart_vpn_service()
-    update.message.reply_text(message)
+    start_service_restart(context, update.message.reply_text("⏳ Перезапускаю VPN..."), "RemoteAccess")
+
+def start_service_restart(context: CallbackContext, message: telegram.Message, service_name):
+    """
+    Перезапуск службы выполняется отдельно от обработчика (run_async), ход перезапуска
+    показывается правками сообщения message.
+    """
+    def progress(text):
+        message.edit_text(text)
+
+    def run():
+        success, result = restart_service(service_name, on_progress=progress)
+        message.edit_text(result)
+
+    context.dispatcher.run_async(tracing.bind(run))
+
+def show_service_restart_menu(update: telegram.Update, context: CallbackContext):
+    """Список наблюдаемых служб с кнопками перезапуска"""
+    states = service_watcher.refresh()
+    keyboard = []
+    for index, name in enumerate(service_watcher.watch_list()):
+        state = states.get(name) or "не найдена"
+        keyboard.append([telegram.InlineKeyboardButton(f"{service_watcher.label(name)} ({state})",
+                                                       callback_data=f"restart_svc_{index}")])
+    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+    update.message.reply_text("Выберите службу для перезапуска:", reply_markup=reply_markup)
+
+def handle_restart_service(update: telegram.Update, context: CallbackContext):
+    """Подтверждение перезапуска (restart_svc_<номер>) и сам перезапуск (restart_yes_<номер>)"""
+    if not is_authorized(update):
+        update.callback_query.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    query = update.callback_query
+    action, index = query.data.rsplit("_", 1)
+    names = service_watcher.watch_list()
+    if not index.isdigit() or int(index) >= len(names):
+        query.answer("Служба не найдена", show_alert=True)
+        return
+    name = names[int(index)]
+    query.answer()
+
+    if action == "restart_svc":
+        keyboard = [[telegram.InlineKeyboardButton("✅ Перезапустить", callback_data=f"restart_yes_{index}")]]
+        reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+        query.edit_message_text(f"Перезапустить службу «{service_watcher.label(name)}»?", reply_markup=reply_markup)
+        return
+
+    query.edit_message_text(f"⏳ Перезапускаю службу «{service_watcher.label(name)}»...")
+    start_service_restart(context, query.message, name)
 
 def show_sessions(update: telegram.Update, context: CallbackContext):
-    sessions = get_sessions()
+    sessions = prefetch.get("sessions")
     if not sessions:
         update.message.reply_text("Нет активных или отключённых сеансов пользователей.")
         return
@@ -648,9 +874,38 @@ def show_sessions(update: telegram.Update, context: CallbackContext):
     update.message.reply_text(response, reply_markup=reply_markup)
 
 def show_server_load(update: telegram.Update, context: CallbackContext):
-    update.message.reply_text("Собираю данные...")
-    load_info = get_server_load()
-    update.message.reply_text(load_info)
+    # Одно сообщение с заглушками по всем секциям, быстрые данные появляются сразу
+    try:
+        server_load_report().run(update.message.reply_text)
+    except Exception as e:
+        update.message.reply_text(f"Ошибка получения данных о сервере: {str(e)}")
+
+def show_dashboard(update: telegram.Update, context: CallbackContext):
+    # Закреплённое сообщение, которое обновляется задачей JobQueue из кэшированных данных
+    import dashboard
+    try:
+        dashboard.start(context.bot, context.job_queue, update.effective_chat.id)
+    except Exception as e:
+        update.message.reply_text(f"Ошибка запуска панели: {str(e)}")
+
+def handle_dashboard_stop(update: telegram.Update, context: CallbackContext):
+    if not is_authorized(update):
+        update.callback_query.answer("У вас нет доступа.", show_alert=True)
+        return
+    update.callback_query.answer("Панель остановлена")
+    import dashboard
+    dashboard.stop(context.bot, update.effective_chat.id)
+
+def track_activity(update: telegram.Update, context: CallbackContext):
+    # Любое действие администратора продлевает работу живой панели в его чате.
+    # Пока модуль панели не загружен, панелей нет - загружать его ради отметки не нужно
+    # Действия администраторов также поддерживают фоновую загрузку частых экранов
+    if not (update.effective_chat and update.effective_user and is_authorized(update)):
+        return
+    prefetch.touch()
+    dashboard = sys.modules.get("dashboard")
+    if dashboard:
+        dashboard.touch(update.effective_chat.id)
 
 def show_network_menu(update: telegram.Update, context: CallbackContext):
     keyboard = [
@@ -663,26 +918,220 @@ def show_network_menu(update: telegram.Update, context: CallbackContext):
     update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
 
 def do_check_speedtest(update: telegram.Update, context: CallbackContext):
-    update.message.reply_text("Выполняю speedtest, подождите...")
-    success, msg = check_speedtest()
-    update.message.reply_text(msg)
+    message = None
+    cancel_markup = None
+
+    def started(job):
+        nonlocal message, cancel_markup
+        cancel_markup = jobs.cancel_markup(job)
+        message = update.message.reply_text("Выполняю speedtest, подождите...", reply_markup=cancel_markup)
+
+    def progress(text):
+        message.edit_text(f"Выполняю speedtest: {text}", reply_markup=cancel_markup)
+
+    def finished(result):
+        success, msg = result
+        message.edit_text(msg)
+
+    start_job(update, context, "Speedtest", lambda: check_speedtest(on_progress=progress), on_start=started,
+              on_result=finished, on_cancel=lambda reason: message.edit_text(f"⛔ Speedtest отменён: {reason}"))
 
 def do_check_network_status(update: telegram.Update, context: CallbackContext):
-    update.message.reply_text("Выполняю проверку сети, подождите...")
-    success, msg = check_network_status()
-    update.message.reply_text(msg)
+    start_report_job(update, context, "Состояние сети", network_status_report(), update.message.reply_text)
 
 def check_host_input(update: telegram.Update, context: CallbackContext):
     target = update.message.text.strip()
-    update.message.reply_text(f"Выполняю проверку связи до {target}...")
-    success, result_msg = check_custom_connection(target)
-    update.message.reply_text(result_msg)
+    start_report_job(update, context, f"Проверка связи до {target}", custom_connection_report(target),
+                     update.message.reply_text, send_document=update.message.reply_document)
     return ConversationHandler.END
 
 def cancel_check_host(update: telegram.Update, context: CallbackContext):
     update.message.reply_text("Отмена ввода адреса.")
     return ConversationHandler.END
 
+# ============== ДОЛГИЕ ОПЕРАЦИИ (ЗАДАНИЯ) ==============
+
+def start_job(update: telegram.Update, context: CallbackContext, title, func, deadline=None,
+              on_start=None, on_result=None, on_cancel=None):
+    """
+    Выполняет func как задание (jobs.py) вне потока диспетчера: пока оно идёт,
+    бот принимает кнопку "Отмена" и /jobs и при последовательной обработке обновлений.
+      on_start(job)     - до запуска (сообщение с кнопкой jobs.cancel_markup(job)),
+      on_result(result) - после успешного завершения,
+      on_cancel(reason) - после отмены или истечения срока (JOB_DEADLINE).
+    """
+    job = jobs.create(title, chat_id=update.effective_chat.id, deadline=deadline)
+
+    def run():
+        jobs.execute(job, func, on_start=on_start, on_result=on_result,
+                     on_cancel=on_cancel or (lambda reason: None))
+
+    # При BOT_RUN_ASYNC обработчик уже выполняется в пуле потоков - отдельный поток не нужен
+    defaults = context.bot.defaults
+    if defaults is not None and defaults.run_async:
+        run()
+    else:
+        context.dispatcher.run_async(tracing.bind(run), update=update)
+
+def start_report_job(update: telegram.Update, context: CallbackContext, title, report, send,
+                     reply_markup=None, send_document=None, deadline=None):
+    """Отчёт ProgressiveReport как задание: пока он собирается, под сообщением кнопка "Отмена"."""
+    def collect():
+        return report.run(send, reply_markup=reply_markup, send_document=send_document,
+                          progress_markup=jobs.cancel_markup(jobs.current()))
+
+    def cancelled(reason):
+        if not report.show_cancelled(reason):
+            send(f"⛔ {title}: отменено ({reason})")
+
+    start_job(update, context, title, collect, deadline=deadline, on_cancel=cancelled)
+
+def show_jobs(update: telegram.Update, context: CallbackContext):
+    """/jobs - выполняющиеся задания с кнопками отмены"""
+    if not is_authorized(update):
+        update.message.reply_text("У вас нет доступа к управлению ботом.")
+        return
+
+    running = jobs.running()
+    if not running:
+        update.message.reply_text("Нет выполняющихся заданий.")
+        return
+
+    keyboard = [[telegram.InlineKeyboardButton(f"✖️ Отменить #{job.id} {job.title}",
+                                               callback_data=f"{jobs.CANCEL_CALLBACK_PREFIX}{job.id}")]
+                for job in running]
+    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+    text = "⚙️ Выполняющиеся задания:\n" + "\n".join(jobs.describe(job) for job in running)
+    update.message.reply_text(text, reply_markup=reply_markup)
+
+def show_stats(update: telegram.Update, context: CallbackContext):
+    """/stats - длительности команд, проверок, обработчиков и запросов к Bot API (metrics.py)"""
+    if not is_authorized(update):
+        update.message.reply_text("У вас нет доступа к управлению ботом.")
+        return
+    text = f"{metrics.render_text()}\n\n{backend_strategy.report()}\n\n{startup.report()}"
+    send_text(text, update.message.reply_text, update.message.reply_document, filename="stats.txt")
+
+def show_traces(update: telegram.Update, context: CallbackContext):
+    """/traces - самые медленные действия с кнопками просмотра водопада"""
+    if not is_authorized(update):
+        update.message.reply_text("У вас нет доступа к управлению ботом.")
+        return
+
+    traces = tracing.slowest()
+    if not traces:
+        update.message.reply_text("Трасс пока нет.")
+        return
+
+    keyboard = [[telegram.InlineKeyboardButton(f"🔎 #{trace.id} {trace.name}"[:60],
+                                               callback_data=f"{TRACE_CALLBACK_PREFIX}{trace.id}")]
+                for trace in traces]
+    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
+    text = "🐢 Самые медленные действия:\n" + "\n".join(tracing.describe(trace) for trace in traces)
+    send_text(text, update.message.reply_text, update.message.reply_document,
+              filename="traces.txt", reply_markup=reply_markup)
+
+def handle_trace(update: telegram.Update, context: CallbackContext):
+    """Кнопка trace_<номер>: водопад трассы"""
+    if not is_authorized(update):
+        update.callback_query.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    query = update.callback_query
+    trace_id = query.data[len(TRACE_CALLBACK_PREFIX):]
+    trace = tracing.get(int(trace_id)) if trace_id.isdigit() else None
+    if trace is None:
+        query.answer("Трасса уже вытеснена более медленными.", show_alert=True)
+        return
+    query.answer()
+    send_text(tracing.render_waterfall(trace), query.message.reply_text, query.message.reply_document,
+              filename=f"trace_{trace.id}.txt")
+
+def toggle_trace_reply(update: telegram.Update, context: CallbackContext):
+    """/trace - включает или выключает водопад после каждого действия в этом чате"""
+    if not is_authorized(update):
+        update.message.reply_text("У вас нет доступа к управлению ботом.")
+        return
+
+    chat_id = update.effective_chat.id
+    enabled = not trace_reply_chats.get(chat_id, TRACE_REPLY)
+    trace_reply_chats[chat_id] = enabled
+    update.message.reply_text("🔎 Водопад после каждого действия включён." if enabled
+                              else "Водопад после каждого действия выключен.")
+
+def chat_senders(bot, chat_id):
+    """(send, send_document) для send_text, когда ответить не на что - сообщение в чат chat_id"""
+    return (lambda text, **kwargs: bot.send_message(chat_id, text, **kwargs),
+            lambda document, **kwargs: bot.send_document(chat_id, document, **kwargs))
+
+def send_trace_reply(bot, trace):
+    """Подписчик tracing.on_finish: водопад завершённого действия в чат, где включён /trace"""
+    if trace.chat_id is None or not trace_reply_chats.get(trace.chat_id, TRACE_REPLY):
+        return
+    if trace.name.startswith(("toggle_trace_reply", "handle_trace", "show_traces")):
+        return
+    try:
+        send_text(tracing.render_waterfall(trace), *chat_senders(bot, trace.chat_id),
+                  filename=f"trace_{trace.id}.txt")
+    except telegram.error.TelegramError as e:
+        logger.warning("Не удалось отправить трассу #%s: %s", trace.id, e)
+
+def run_profile(update: telegram.Update, context: CallbackContext):
+    """/profile [секунд] - выборочный профиль всех потоков (profiler.py): сводка и свёрнутые стеки файлом"""
+    if not is_authorized(update):
+        update.message.reply_text("У вас нет доступа к управлению ботом.")
+        return
+
+    try:
+        duration = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        update.message.reply_text("Использование: /profile [секунд], например /profile 30")
+        return
+    duration = max(1, min(duration, profiler.MAX_DURATION))
+    message = None
+    cancel_markup = None
+
+    def started(job):
+        nonlocal message, cancel_markup
+        cancel_markup = jobs.cancel_markup(job)
+        message = update.message.reply_text(f"🔥 Профилирование {duration} с...", reply_markup=cancel_markup)
+
+    def progress(elapsed, total):
+        message.edit_text(f"🔥 Профилирование: {elapsed:.0f} из {total} с...", reply_markup=cancel_markup)
+
+    def collect():
+        try:
+            return profiler.sample(duration, on_progress=progress)
+        except profiler.ProfilerBusy as e:
+            return str(e)
+
+    def finished(profile):
+        if isinstance(profile, str):
+            message.edit_text(f"⚠️ {profile}")
+            return
+        send_text(profile.summary(), message.edit_text)
+        if profile.stacks:
+            update.message.reply_document(document=profile.collapsed().encode("utf-8"),
+                                          filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed.txt",
+                                          caption="Свёрнутые стеки (flamegraph.pl, speedscope)")
+
+    start_job(update, context, f"Профилирование {duration} с", collect, deadline=duration + 30,
+              on_start=started, on_result=finished,
+              on_cancel=lambda reason: message.edit_text(f"⛔ Профилирование отменено: {reason}"))
+
+def handle_job_cancel(update: telegram.Update, context: CallbackContext):
+    """Кнопка "Отмена" (job_cancel_<номер>): завершает задание вместе с его процессами"""
+    if not is_authorized(update):
+        update.callback_query.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    query = update.callback_query
+    job_id = query.data[len(jobs.CANCEL_CALLBACK_PREFIX):]
+    if job_id.isdigit() and jobs.cancel(int(job_id)):
+        query.answer("Задание отменяется...")
+    else:
+        query.answer("Задание уже завершено.", show_alert=True)
+
 def handle_logoff(update: telegram.Update, context: CallbackContext):
     if not is_authorized(update):
         update.callback_query.answer("У вас нет доступа.", show_alert=True)
@@ -693,6 +1142,7 @@ def handle_logoff(update: telegram.Update, context: CallbackContext):
     if callback_data.startswith("logoff_"):
         session_id = callback_data.replace("logoff_", "")
         success, message = logoff_session(session_id)
+        prefetch.refresh("sessions")
         query.edit_message_text(message)
 
 def handle_block_user(update: telegram.Update, context: CallbackContext):
@@ -708,6 +1158,7 @@ def handle_block_user(update: telegram.Update, context: CallbackContext):
         username = callback_data.replace("block_", "")
         query.edit_message_text(f"⏳ Блокирую пользователя {username}...")
         success, message = block_user(username)
+        prefetch.refresh("users")
         
         keyboard = [[telegram.InlineKeyboardButton("◀️ Назад к пользователю", callback_data=f"user_menu_{username}")],
                    [telegram.InlineKeyboardButton("📋 К списку пользователей", callback_data="back_to_users")]]
@@ -733,6 +1184,7 @@ def handle_unblock_user(update: telegram.Update, context: CallbackContext):
         username = callback_data.replace("unblock_", "")
         query.edit_message_text(f"⏳ Разблокирую пользователя {username}...")
         success, message = unblock_user(username)
+        prefetch.refresh("users")
         
         keyboard = [[telegram.InlineKeyboardButton("◀️ Назад к пользователю", callback_data=f"user_menu_{username}")],
                    [telegram.InlineKeyboardButton("📋 К списку пользователей", callback_data="back_to_users")]]
@@ -773,25 +1225,91 @@ def handle_user_info(update: telegram.Update, context: CallbackContext):
 
 def main():
     if not check_admin():
-        print("Скрипт НЕ запущен с правами администратора!")
+        logger.error("Скрипт НЕ запущен с правами администратора!")
         sys.exit(1)
     else:
-        print("Скрипт запущен с правами администратора.")
-
-    updater = Updater(TOKEN, use_context=True)
-    dp = updater.dispatcher
+        logger.info("Скрипт запущен с правами администратора.")
+    startup.mark("проверка прав")
+
+    # При BOT_RUN_ASYNC обработчики выполняются в пуле из BOT_WORKERS потоков,
+    # и медленная проверка не задерживает остальные обновления.
+    # Все отправки и правки сообщений проходят через очередь с лимитами Telegram (outbox.py)
+    bot = OutboxBot(TOKEN, request=Request(con_pool_size=BOT_WORKERS + 4),
+                    defaults=Defaults(run_async=BOT_RUN_ASYNC))
+    # Состояния диалогов и данные для отчёта после перезагрузки - в bot_state.json
+    updater = Updater(bot=bot, use_context=True, workers=BOT_WORKERS, persistence=bot_state.BotPersistence())
+    register_handlers(updater.dispatcher)
+
+    # Фоновый опрос наблюдаемых служб; об изменении состояния сообщаем администраторам
+    if SERVICE_ALERTS:
+        service_watcher.subscribe(lambda name, old, new: notify_service_change(updater.bot, name, old, new))
+    service_watcher.start_polling(updater.job_queue)
+    tracing.on_finish(lambda trace: send_trace_reply(updater.bot, trace))
+    # Обработчики, выполняющиеся дольше WATCHDOG_THRESHOLD, - со стеком потока администраторам
+    stall_watchdog.on_stall(lambda stall: notify_stall(updater.bot, stall))
+    stall_watchdog.start()
+
+    # Страница OpenMetrics для внешнего сборщика (только если задан METRICS_PORT)
+    try:
+        if metrics.start_server():
+            logger.info("Метрики доступны на http://%s:%s/metrics",
+                        os.getenv("METRICS_HOST", metrics.DEFAULT_METRICS_HOST), os.getenv("METRICS_PORT"))
+    except OSError as e:
+        logger.error("Не удалось запустить страницу метрик: %s", e)
+
+    # getMe до опроса: неверный токен или нет связи с Telegram видны сразу, а время подключения - в отчёте
+    bot.get_me()
+    updater.start_polling()
+    startup.mark("подключение к Telegram")
+    ready_at = time.time()
+    logger.info("%s", startup.report())
+    startup.preload(FEATURE_MODULES)
+    # Частые экраны (пользователи, сеансы, VPN, диски, версии копий) - заранее и затем по расписанию
+    prefetch.start()
+    reboot_request = bot_state.pop("reboot")
+    if reboot_request:
+        threading.Thread(target=send_reboot_report, args=(updater.bot, reboot_request, ready_at),
+                         name="reboot-report", daemon=True).start()
+    updater.idle()
 
+def notify_service_change(bot, name, old_state, new_state):
+    emoji = "🟢" if new_state == "RUNNING" else "🔴"
+    text = (f"{emoji} Служба «{service_watcher.label(name)}» изменила состояние: "
+            f"{old_state or 'не найдена'} → {new_state or 'не найдена'}")
+    for user_id in ALLOWED_USERS:
+        try:
+            bot.send_message(user_id, text)
+        except telegram.error.TelegramError as e:
+            logger.warning("Не удалось отправить уведомление %s: %s", user_id, e)
+
+def notify_stall(bot, stall):
+    """Подписчик stall_watchdog.on_stall: зависший обработчик и стек его потока - администраторам"""
+    for user_id in ALLOWED_USERS:
+        try:
+            send_text(stall.report(), *chat_senders(bot, user_id), filename="stall.txt")
+        except telegram.error.TelegramError as e:
+            logger.warning("Не удалось отправить уведомление %s: %s", user_id, e)
+
+def register_handlers(dp):
+    """Регистрирует все обработчики бота в диспетчере (используется и в замерах bench_handlers.py)."""
     # ConversationHandler для ввода адреса в разделе "Проверить связь до узла"
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(Filters.text("Проверить связь до узла"), handle_message)],
         states={
             CHECK_HOST: [MessageHandler(Filters.text & ~Filters.command, check_host_input)]
         },
-        fallbacks=[MessageHandler(Filters.text("Отмена"), cancel_check_host)]
+        fallbacks=[MessageHandler(Filters.text("Отмена"), cancel_check_host)],
+        # Ввод адреса продолжается и после перезапуска бота (если диспетчер с хранилищем, см. main)
+        name="check_host", persistent=dp.persistence is not None
     )
     dp.add_handler(conv_handler)
 
     dp.add_handler(CommandHandler("start", start))
+    dp.add_handler(CommandHandler("jobs", show_jobs))
+    dp.add_handler(CommandHandler("stats", show_stats))
+    dp.add_handler(CommandHandler("traces", show_traces))
+    dp.add_handler(CommandHandler("trace", toggle_trace_reply))
+    dp.add_handler(CommandHandler("profile", run_profile))
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
     dp.add_handler(CallbackQueryHandler(handle_logoff, pattern=r'^logoff_'))
     dp.add_handler(CallbackQueryHandler(handle_reset_vpn, pattern=r'^reset_vpn_'))
@@ -812,9 +1330,21 @@ def main():
     dp.add_handler(CallbackQueryHandler(handle_backup_details, pattern=r'^backup_details'))
     dp.add_handler(CallbackQueryHandler(handle_refresh_backup_versions, pattern=r'^refresh_backup_versions'))
     dp.add_handler(CallbackQueryHandler(handle_refresh_disk_space, pattern=r'^refresh_disk_space'))
-
-    updater.start_polling()
-    updater.idle()
+    dp.add_handler(CallbackQueryHandler(handle_page, pattern=r'^page_'))
+    dp.add_handler(CallbackQueryHandler(handle_dashboard_stop, pattern=r'^dashboard_stop'))
+    dp.add_handler(CallbackQueryHandler(handle_restart_service, pattern=r'^restart_(svc|yes)_'))
+    dp.add_handler(CallbackQueryHandler(handle_job_cancel, pattern=r'^job_cancel_'))
+    dp.add_handler(CallbackQueryHandler(handle_trace, pattern=r'^trace_'))
+    # Отметка активности для живой панели - до всех остальных обработчиков, не мешая им
+    dp.add_handler(TypeHandler(telegram.Update, track_activity, run_async=False), group=-1)
+    # Сообщения, накопившиеся пока бот не работал, - раньше всех остальных обработчиков
+    dp.add_handler(TypeHandler(telegram.Update, drop_stale_update, run_async=False), group=-2)
+    # Длительность каждого обработчика - в metrics (/stats)
+    metrics.instrument_handlers(dp)
+    # Трасса на каждое действие: обработчик -> проверки -> команды -> разбор -> Bot API (/traces, /trace)
+    tracing.instrument_handlers(dp)
+    # Учёт идущих вызовов для поиска зависших (stall_watchdog)
+    stall_watchdog.instrument_handlers(dp)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,194 @@
+# bot_state.py
+"""
+Состояние бота, которое переживает перезапуск и перезагрузку сервера.
+Хранится в одном JSON-файле STATE_FILE (по умолчанию bot_state.json; пустое значение -
+только в памяти, без файла):
+  - разделы get(name) / put(name, value) / pop(name): заявка на перезагрузку,
+    снимки состояния служб и сеансов перед ней и т.п.;
+  - состояния диалогов ConversationHandler (persistent=True) - через BotPersistence,
+    хранилище python-telegram-bot (user_data / chat_data / bot_data бот не использует).
+Изменения копятся в памяти и записываются пачкой: фоновый поток раз в STATE_FLUSH_INTERVAL
+секунд пишет файл, только если что-то изменилось; flush() пишет сразу (перед перезагрузкой
+и при остановке бота). Запись атомарная - через временный файл и os.replace.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+from telegram.ext.utils.promise import Promise
+from telegram.utils.helpers import decode_conversations_from_json, encode_conversations_to_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILE = "bot_state.json"
+DEFAULT_FLUSH_INTERVAL = 5  # секунд
+
+_data = None   # {"sections": {...}, "conversations": {имя: {(chat_id, user_id): состояние}}}
+_dirty = False
+_lock = threading.RLock()
+_write_lock = threading.Lock()  # запись файла (фоновый поток и flush() при остановке)
+_flusher = None
+
+
+def state_file():
+    return os.getenv("STATE_FILE", DEFAULT_FILE).strip()
+
+
+def flush_interval():
+    try:
+        return float(os.getenv("STATE_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL))
+    except ValueError:
+        return DEFAULT_FLUSH_INTERVAL
+
+
+def _load():
+    """Читает файл при первом обращении; повреждённый или отсутствующий файл - пустое состояние."""
+    global _data
+    if _data is not None:
+        return _data
+    _data = {"sections": {}, "conversations": {}}
+    if not state_file():
+        return _data
+    try:
+        with open(state_file(), encoding="utf-8") as f:
+            stored = json.load(f)
+        _data["sections"] = dict(stored.get("sections") or {})
+        if stored.get("conversations"):
+            _data["conversations"] = decode_conversations_from_json(json.dumps(stored["conversations"]))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning("Не удалось прочитать %s, состояние начнётся заново: %s", state_file(), e)
+    return _data
+
+
+def _changed():
+    global _dirty
+    _dirty = True
+    _start_flusher()
+
+
+def get(name, default=None):
+    with _lock:
+        return _load()["sections"].get(name, default)
+
+
+def put(name, value):
+    """Сохраняет раздел name (значение должно сериализоваться в JSON)."""
+    with _lock:
+        _load()["sections"][name] = value
+        _changed()
+
+
+def pop(name, default=None):
+    with _lock:
+        sections = _load()["sections"]
+        if name not in sections:
+            return default
+        value = sections.pop(name)
+        _changed()
+        return value
+
+
+def conversations(name):
+    with _lock:
+        return dict(_load()["conversations"].get(name, {}))
+
+
+def update_conversation(name, key, new_state):
+    # При BOT_RUN_ASYNC обработчик ещё выполняется, и ConversationHandler передаёт
+    # (старое состояние, Promise); сохраняется старое - новое придёт, когда обработчик завершится
+    if isinstance(new_state, tuple) and len(new_state) == 2 and isinstance(new_state[1], Promise):
+        new_state = new_state[0]
+    with _lock:
+        states = _load()["conversations"].setdefault(name, {})
+        if states.get(key) == new_state:
+            return
+        if new_state is None:
+            states.pop(key, None)
+        else:
+            states[key] = new_state
+        _changed()
+
+
+def flush():
+    """Записывает состояние на диск, если оно изменилось с прошлой записи."""
+    global _dirty
+    with _write_lock:
+        path = state_file()
+        try:
+            with _lock:
+                if not _dirty or _data is None or not path:
+                    return
+                text = json.dumps({"sections": _data["sections"],
+                                   "conversations": json.loads(encode_conversations_to_json(_data["conversations"]))},
+                                  ensure_ascii=False, separators=(",", ":"))
+                _dirty = False
+            temp = f"{path}.tmp"
+            with open(temp, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except Exception as e:
+            logger.error("Не удалось записать %s: %s", path, e)
+            with _lock:
+                _dirty = True
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    interval = flush_interval()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                flush()
+            except Exception as e:
+                logger.error("Ошибка фоновой записи состояния: %s", e)
+
+    _flusher = threading.Thread(target=loop, name="state-flush", daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+
+class BotPersistence(BasePersistence):
+    """Хранилище python-telegram-bot поверх bot_state: только состояния диалогов."""
+
+    def __init__(self):
+        super().__init__(store_user_data=False, store_chat_data=False, store_bot_data=False)
+
+    def get_user_data(self):
+        return defaultdict(dict)
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        return conversations(name)
+
+    def update_conversation(self, name, key, new_state):
+        update_conversation(name, key, new_state)
+
+    def update_user_data(self, user_id, data):
+        pass
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def flush(self):
+        flush()
@@ -0,0 +1,304 @@
+# command_runner.py
+import os
+import sys
+import json
+import signal
+import hashlib
+import threading
+import subprocess
+
+import jobs
+import metrics
+import tracing
+
+
+class CommandResult:
+    """Результат выполнения команды: код возврата и сырые байты stdout/stderr."""
+
+    def __init__(self, returncode, stdout=b"", stderr=b""):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def decode_output(raw_bytes, encoding=None):
+    """
+    Декодирует вывод консольной команды.
+    Если кодировка не задана явно, определяет её через chardet; при низкой уверенности
+    используется cp866 как самая распространённая для старых русских Windows.
+    """
+    if not raw_bytes:
+        return ""
+    # определение кодировки через chardet заметно дороже явной кодировки - считаем отдельно
+    method = "explicit" if encoding else "chardet"
+    with tracing.span(f"decode ({method})"), metrics.timer("decode_seconds", "method", method):
+        return _decode(raw_bytes, encoding)
+
+
+def _decode(raw_bytes, encoding):
+    # wmic и некоторые другие утилиты при перенаправлении вывода пишут в UTF-16
+    if raw_bytes.startswith(b"\xff\xfe"):
+        return raw_bytes.decode("utf-16", errors="replace")
+    if encoding:
+        return raw_bytes.decode(encoding, errors="replace")
+    import chardet  # не при запуске бота; заранее загружается фоном (warm_up_decoder)
+    detected = chardet.detect(raw_bytes)
+    detected_encoding = detected.get("encoding", None)
+    confidence = detected.get("confidence", 0)
+    if detected_encoding and confidence > 0.5:
+        try:
+            return raw_bytes.decode(detected_encoding, errors="replace")
+        except LookupError:
+            pass
+    return raw_bytes.decode("cp866", errors="replace")
+
+
+def warm_up_decoder():
+    """
+    Загружает chardet и его языковые модели (первое определение кодировки - ~0.1 с).
+    Вызывается фоном после запуска, чтобы эту цену не платил первый запрос администратора.
+    """
+    _decode("Проверка кодировки вывода".encode("cp866"), None)
+
+
+# ============== СПОСОБЫ ВЫПОЛНЕНИЯ ==============
+
+class LiveBackend:
+    """Реальное выполнение: команды через shell, скрипты PowerShell - в постоянном процессе."""
+
+    name = "live"
+
+    def run(self, cmd, timeout=None):
+        # Отдельная группа процессов (на Windows - taskkill /T), чтобы по таймауту
+        # или отмене задания завершалась не только оболочка, но и запущенная в ней утилита
+        options = {} if sys.platform == "win32" else {"start_new_session": True}
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, **options)
+        job = jobs.current()
+        if job is not None:
+            job.attach(proc)
+        thread_id = threading.get_ident()
+        with _active_lock:
+            _active[thread_id] = (cmd, proc)
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(proc)
+            raise
+        finally:
+            with _active_lock:
+                _active.pop(thread_id, None)
+            if job is not None:
+                job.detach(proc)
+        if job is not None:
+            job.check()
+        return CommandResult(proc.returncode, stdout or b"", stderr or b"")
+
+    def run_powershell(self, script, timeout=None):
+        from powershell_host import run_powershell
+        return run_powershell(script, timeout=timeout)
+
+
+class FixtureStore:
+    """
+    Каталог с записанными выводами команд. Для каждой команды хранятся:
+      <ключ>.json   - сама команда и код возврата,
+      <ключ>.stdout - сырые байты stdout (без перекодирования),
+      <ключ>.stderr - сырые байты stderr.
+    Ключ - вид запуска ("cmd" / "powershell") и хэш текста команды.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(kind, command):
+        return f"{kind}-{hashlib.sha1(command.encode('utf-8')).hexdigest()[:16]}"
+
+    def save(self, kind, command, result):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.key(kind, command))
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump({"kind": kind, "command": command, "returncode": result.returncode},
+                      f, ensure_ascii=False, indent=1)
+        with open(base + ".stdout", "wb") as f:
+            f.write(result.stdout)
+        with open(base + ".stderr", "wb") as f:
+            f.write(result.stderr)
+
+    def load(self, kind, command):
+        base = os.path.join(self.directory, self.key(kind, command))
+        try:
+            with open(base + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(base + ".stdout", "rb") as f:
+                stdout = f.read()
+            with open(base + ".stderr", "rb") as f:
+                stderr = f.read()
+        except OSError:
+            return None
+        return CommandResult(meta["returncode"], stdout, stderr)
+
+
+class RecordingBackend(LiveBackend):
+    """Выполняет команды по-настоящему и сохраняет их вывод как фикстуры."""
+
+    name = "record"
+
+    def __init__(self, directory):
+        self.store = FixtureStore(directory)
+
+    def run(self, cmd, timeout=None):
+        result = super().run(cmd, timeout=timeout)
+        self.store.save("cmd", cmd, result)
+        return result
+
+    def run_powershell(self, script, timeout=None):
+        ok, output = super().run_powershell(script, timeout=timeout)
+        self.store.save("powershell", script, CommandResult(0 if ok else 1, output.encode("utf-8")))
+        return ok, output
+
+
+class ReplayBackend:
+    """
+    Воспроизводит записанные выводы вместо запуска процессов.
+    Фикстуры берутся из каталога и/или из словаря {команда: CommandResult},
+    заданного программно (например, синтетические выводы для замеров).
+    Неизвестная команда возвращает код 1 и пустой вывод.
+    """
+
+    name = "replay"
+
+    def __init__(self, directory=None, fixtures=None, powershell_fixtures=None):
+        self.store = FixtureStore(directory) if directory else None
+        self.fixtures = dict(fixtures or {})
+        self.powershell_fixtures = dict(powershell_fixtures or {})
+        self.missing = []
+
+    def run(self, cmd, timeout=None):
+        result = self.fixtures.get(cmd)
+        if result is None and self.store:
+            result = self.store.load("cmd", cmd)
+        if result is None:
+            self.missing.append(cmd)
+            return CommandResult(1, b"", b"fixture not found")
+        return result
+
+    def run_powershell(self, script, timeout=None):
+        result = self.powershell_fixtures.get(script)
+        if result is None and self.store:
+            result = self.store.load("powershell", script)
+        if result is None:
+            self.missing.append(script)
+            return False, "fixture not found"
+        return result.returncode == 0, result.stdout.decode("utf-8", errors="replace")
+
+
+# ============== ОБЩАЯ ТОЧКА ВХОДА ==============
+
+_backend = None
+_backend_lock = threading.Lock()
+
+# Процессы, завершения которых сейчас ждут потоки: id потока -> (команда, Popen)
+_active = {}
+_active_lock = threading.Lock()
+
+# Сколько внешних команд и запросов PowerShell было выполнено (для замеров)
+counters = {"commands": 0, "powershell": 0}
+_counters_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Возвращает текущий способ выполнения. По умолчанию определяется переменными окружения:
+      COMMAND_REPLAY_DIR - воспроизводить выводы из каталога фикстур,
+      COMMAND_RECORD_DIR - выполнять команды и записывать их вывод в каталог.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            replay_dir = os.getenv("COMMAND_REPLAY_DIR")
+            record_dir = os.getenv("COMMAND_RECORD_DIR")
+            if replay_dir:
+                _backend = ReplayBackend(replay_dir)
+            elif record_dir:
+                _backend = RecordingBackend(record_dir)
+            else:
+                _backend = LiveBackend()
+        return _backend
+
+
+def set_backend(backend):
+    """Подменяет способ выполнения (None - вернуть выбор по переменным окружения)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def run(cmd, timeout=None):
+    """
+    Выполняет консольную команду через shell. Возвращает CommandResult с сырыми байтами.
+    Внутри задания (jobs.run) таймаут ограничен остатком его срока, а отмена задания
+    завершает процесс и бросает jobs.JobCancelled.
+    """
+    job = jobs.current()
+    if job is not None:
+        job.check()
+        timeout = job.timeout(timeout)
+    with _counters_lock:
+        counters["commands"] += 1
+    family = metrics.command_family(cmd)
+    with tracing.span(f"cmd {family}"), metrics.timer("command_seconds", "family", family):
+        return get_backend().run(cmd, timeout=timeout)
+
+
+def run_decoded(cmd, timeout=None, encoding=None):
+    """Выполняет команду и возвращает (CommandResult, декодированный stdout)."""
+    result = run(cmd, timeout=timeout)
+    return result, decode_output(result.stdout, encoding)
+
+
+def run_powershell(script, timeout=None):
+    """Выполняет скрипт PowerShell. Возвращает кортеж (успех: bool, вывод: str)."""
+    job = jobs.current()
+    if job is not None:
+        job.check()
+        timeout = job.timeout(timeout)
+    with _counters_lock:
+        counters["powershell"] += 1
+    with tracing.span("powershell"), metrics.timer("command_seconds", "family", "powershell"):
+        return get_backend().run_powershell(script, timeout=timeout)
+
+
+def active_process(thread_id):
+    """(команда, Popen), завершения которой ждёт поток thread_id, или None."""
+    with _active_lock:
+        return _active.get(thread_id)
+
+
+def reset_counters():
+    with _counters_lock:
+        for key in counters:
+            counters[key] = 0
+
+
+def kill_process_tree(proc):
+    """Убивает процесс вместе с дочерними (на Windows - через taskkill /T, иначе - всю группу процессов)."""
+    if proc.poll() is not None:
+        return
+    if sys.platform == "win32":
+        subprocess.run(f"taskkill /F /T /PID {proc.pid}", capture_output=True, shell=True)
+    else:
+        try:
+            # Группу убиваем, только если процесс её возглавляет (запущен с start_new_session)
+            if os.getpgid(proc.pid) == proc.pid:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        proc.kill()
+    except OSError:
+        pass
+    try:
+        proc.wait(timeout=3)
+    except subprocess.TimeoutExpired:
+        pass
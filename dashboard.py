@@ -0,0 +1,209 @@
+# dashboard.py
+"""
+Живая панель: одно закреплённое сообщение с основными показателями сервера,
+которое задача JobQueue перерисовывает каждые DASHBOARD_INTERVAL секунд.
+Данные берутся из тех же записей probe_cache и prefetch, что и у экранов бота (CPU и память -
+как у "Состояния сервера", сеансы и VPN - фоновые экраны prefetch, службы - service_watcher,
+диски - disk_inventory), и принимаются не старше нескольких обновлений панели: обновление -
+это несколько вызовов Bot API, а не полный цикл проверок. Сообщение правится только при
+изменении содержимого, а после DASHBOARD_IDLE_MINUTES
+без действий администратора в чате обновление останавливается.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+import telegram
+from telegram.error import TelegramError
+
+import disk_inventory
+import prefetch
+import probe_cache
+from system_info import (ONEC_SERVICES, CPU_CACHE_KEY, MEMORY_CACHE_KEY, _get_cpu_usage, _get_memory_usage,
+                         _render_service_status)
+from service_watcher import get_service_status
+from backup_monitoring import _get_last_backup_info
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30      # секунд между обновлениями
+DEFAULT_IDLE_MINUTES = 15  # минут без действий, после которых панель останавливается
+STOP_CALLBACK = "dashboard_stop"
+# Допустимый возраст данных (не меньше интервала панели): проверки не запускаются на каждое обновление.
+# Сеансы и VPN-клиенты - те же списки, что у экранов RDP и VPN (prefetch обновляет их в фоне)
+LOAD_MAX_AGE = 60          # CPU и память, секунд
+SESSIONS_MAX_AGE = 120     # секунд
+VPN_MAX_AGE = 120          # секунд
+LAST_BACKUP_MAX_AGE = 600  # секунд
+
+_dashboards = {}     # chat_id -> _Dashboard
+_last_activity = {}  # chat_id -> monotonic-время последнего действия администратора
+_lock = threading.Lock()
+
+
+def _env_number(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def interval():
+    return max(5.0, _env_number("DASHBOARD_INTERVAL", DEFAULT_INTERVAL))
+
+
+def idle_timeout():
+    return _env_number("DASHBOARD_IDLE_MINUTES", DEFAULT_IDLE_MINUTES) * 60
+
+
+class _Dashboard:
+    def __init__(self, chat_id, message_id, job):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.job = job
+        self.digest = None
+        self.body = None  # последний показанный текст (для сообщения об остановке)
+        self.edits = 0
+
+
+# ---------- данные ----------
+
+def _max_age(seconds):
+    return max(seconds, interval())
+
+
+def _sample(key, probe, max_age):
+    """Результат проверки из общего probe_cache не старше max_age (но не меньше интервала панели)."""
+    value, age = probe_cache.get(key, probe, max_age=_max_age(max_age))
+    return value
+
+
+def _line(label, probe):
+    try:
+        return f"{label}: {probe()}"
+    except Exception as e:
+        return f"{label}: ❌ {e}"
+
+
+def render_body():
+    """Текст панели без времени обновления (по нему определяется, изменилось ли содержимое)."""
+    lines = [
+        _line("CPU", lambda: "{}% {}".format(*_sample(CPU_CACHE_KEY, _get_cpu_usage, LOAD_MAX_AGE))),
+        _line("Память", lambda: "{} {}".format(*_sample(MEMORY_CACHE_KEY, _get_memory_usage, LOAD_MAX_AGE))),
+    ]
+    for volume in disk_inventory.get_volumes():
+        lines.append(_line(f"Диск ({volume['drive']})", lambda volume=volume: disk_inventory.format_usage(volume)))
+    for service_name, label in ONEC_SERVICES:
+        lines.append(_line(label.lstrip("- "), lambda service_name=service_name: _render_service_status(
+            get_service_status(service_name))))
+    lines.append(_line("RDP-сеансы", _sessions_summary))
+    lines.append(_line("VPN-соединения", lambda: len(prefetch.get("vpn", max_age=_max_age(VPN_MAX_AGE)))))
+    lines.append(_line("Последняя копия", lambda: _sample("backup.last_backup", _get_last_backup_info,
+                                                          LAST_BACKUP_MAX_AGE)))
+    return "\n".join(lines)
+
+
+def _sessions_summary():
+    sessions = prefetch.get("sessions", max_age=_max_age(SESSIONS_MAX_AGE))
+    active = sum(1 for s in sessions if s["state"] == "Активен")
+    return f"{len(sessions)} (активных {active})"
+
+
+def _render(body, stopped_reason=None):
+    header = "📊 Панель сервера"
+    if stopped_reason:
+        footer = f"⏹ Обновление остановлено: {stopped_reason}"
+    else:
+        footer = (f"🕒 Данные на {datetime.now().strftime('%H:%M:%S')}, "
+                  f"обновление каждые {interval():.0f} с")
+    return f"{header}\n\n{body}\n\n{footer}"
+
+
+def _stop_markup():
+    return telegram.InlineKeyboardMarkup([[telegram.InlineKeyboardButton("⏹ Остановить", callback_data=STOP_CALLBACK)]])
+
+
+# ---------- управление ----------
+
+def touch(chat_id):
+    """Отмечает действие администратора в чате (продлевает работу панели)."""
+    with _lock:
+        _last_activity[chat_id] = time.monotonic()
+
+
+def start(bot, job_queue, chat_id):
+    """Отправляет и закрепляет сообщение панели и запускает его обновление. Старая панель чата останавливается."""
+    stop(bot, chat_id, "открыта новая панель")
+    touch(chat_id)
+
+    body = render_body()
+    message = bot.send_message(chat_id, _render(body), reply_markup=_stop_markup())
+    try:
+        bot.pin_chat_message(chat_id, message.message_id, disable_notification=True)
+    except TelegramError as e:
+        logger.warning("Не удалось закрепить панель: %s", e)
+
+    job = job_queue.run_repeating(_refresh, interval=interval(), first=interval(),
+                                  context=chat_id, name=f"dashboard_{chat_id}")
+    dashboard = _Dashboard(chat_id, message.message_id, job)
+    dashboard.digest = _digest(body)
+    dashboard.body = body
+    with _lock:
+        _dashboards[chat_id] = dashboard
+    return dashboard
+
+
+def stop(bot, chat_id, reason="остановлено администратором"):
+    """Останавливает панель чата: снимает задачу, показывает причину и открепляет сообщение."""
+    with _lock:
+        dashboard = _dashboards.pop(chat_id, None)
+    if dashboard is None:
+        return False
+    dashboard.job.schedule_removal()
+    try:
+        # Показанные данные не перезапрашиваются - к ним только дописывается причина остановки
+        bot.edit_message_text(_render(dashboard.body, stopped_reason=reason),
+                              chat_id=chat_id, message_id=dashboard.message_id)
+        bot.unpin_chat_message(chat_id, message_id=dashboard.message_id)
+    except TelegramError as e:
+        logger.warning("Ошибка при остановке панели: %s", e)
+    return True
+
+
+def is_running(chat_id):
+    with _lock:
+        return chat_id in _dashboards
+
+
+def _refresh(context):
+    """Задача JobQueue: перерисовывает панель, если изменились данные."""
+    chat_id = context.job.context
+    with _lock:
+        dashboard = _dashboards.get(chat_id)
+        idle = time.monotonic() - _last_activity.get(chat_id, 0)
+    if dashboard is None or dashboard.job is not context.job:
+        context.job.schedule_removal()
+        return
+    if idle > idle_timeout():
+        stop(context.bot, chat_id, f"нет действий {idle_timeout() / 60:.0f} мин")
+        return
+
+    body = render_body()
+    digest = _digest(body)
+    if digest == dashboard.digest:
+        return  # ничего не изменилось - правка не нужна
+    try:
+        context.bot.edit_message_text(_render(body), chat_id=chat_id, message_id=dashboard.message_id,
+                                      reply_markup=_stop_markup())
+        dashboard.digest = digest
+        dashboard.body = body
+        dashboard.edits += 1
+    except TelegramError as e:
+        logger.warning("Ошибка обновления панели: %s", e)
+
+
+def _digest(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
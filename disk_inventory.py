@@ -0,0 +1,112 @@
+# disk_inventory.py
+import os
+import time
+import threading
+
+from platform_provider import get_provider
+
+DEFAULT_CACHE_TTL = 10  # секунд
+
+# Единые пороги заполненности дисков для всех экранов бота
+DISK_WARN_PERCENT = 75   # 🟡 выше этого значения
+DISK_CRIT_PERCENT = 90   # 🔴 выше этого значения
+# Диск с таким объёмом свободного места считается возможной целью резервного копирования
+BACKUP_TARGET_MIN_FREE = 10 * 1024**3
+
+_cache = None  # (monotonic-время получения, [тома])
+_cache_lock = threading.Lock()
+
+
+def cache_ttl():
+    try:
+        return float(os.getenv("DISK_CACHE_TTL", DEFAULT_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_CACHE_TTL
+
+
+def get_volumes(max_age=None):
+    """
+    Возвращает список локальных томов (DriveType=3), отсортированный по букве
+    (на Linux вместо буквы - точка монтирования):
+      [{"drive": "C:", "free": байты, "size": байты, "used": байты, "used_percent": float}, ...]
+    Все тома собираются одним опросом и кэшируются на DISK_CACHE_TTL секунд.
+    """
+    global _cache
+    if max_age is None:
+        max_age = cache_ttl()
+    with _cache_lock:
+        if _cache and max_age > 0 and time.monotonic() - _cache[0] <= max_age:
+            return _cache[1]
+
+        volumes = _collect_volumes()
+        if volumes:
+            _cache = (time.monotonic(), volumes)
+        return volumes
+
+
+def get_volume(drive, max_age=None):
+    """
+    Возвращает том по букве диска ("E:" или "e") или None.
+    Диска нет среди локальных томов (цель резервного копирования на USB или съёмном
+    диске) - он опрашивается отдельно.
+    """
+    drive = drive.strip().upper().rstrip("\\")
+    if not drive.endswith(":"):
+        drive += ":"
+    volume = next((v for v in get_volumes(max_age) if v["drive"] == drive), None)
+    if volume is None:
+        found = get_provider().disk(drive)
+        if found:
+            volume = _make_volume(found["drive"], found["free"], found["size"])
+    return volume
+
+
+def backup_candidates(limit=3):
+    """Диски, на которых больше BACKUP_TARGET_MIN_FREE свободного места (не более limit штук)."""
+    drives = [v["drive"] for v in get_volumes() if v["free"] > BACKUP_TARGET_MIN_FREE]
+    return drives[:limit]
+
+
+def usage_emoji(used_percent):
+    """🔴 выше DISK_CRIT_PERCENT, 🟡 выше DISK_WARN_PERCENT, иначе 🟢."""
+    if used_percent > DISK_CRIT_PERCENT:
+        return "🔴"
+    if used_percent > DISK_WARN_PERCENT:
+        return "🟡"
+    return "🟢"
+
+
+def format_usage(volume, unit="ГБ", emoji=usage_emoji):
+    """Строка вида "12.3/100.0 ГБ (12.3%) 🟢"; emoji - значок по проценту заполненности."""
+    used_gb = volume["used"] / (1024**3)
+    total_gb = volume["size"] / (1024**3)
+    return (f"{used_gb:.1f}/{total_gb:.1f} {unit} "
+            f"({volume['used_percent']:.1f}%) {emoji(volume['used_percent'])}")
+
+
+def invalidate():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+# ============== СБОР ДАННЫХ ==============
+
+def _collect_volumes():
+    """
+    Все тома собираются одним опросом у провайдера платформы
+    (на Windows - прямо в процессе через WinAPI, запасной путь - один запрос WMI).
+    """
+    volumes = [_make_volume(d["drive"], d["free"], d["size"]) for d in get_provider().disks()]
+    return sorted(volumes, key=lambda v: v["drive"])
+
+
+def _make_volume(drive, free, size):
+    used = size - free
+    return {
+        "drive": drive.upper() if drive.endswith(":") else drive,
+        "free": free,
+        "size": size,
+        "used": used,
+        "used_percent": (used / size) * 100 if size > 0 else 0,
+    }
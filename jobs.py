@@ -0,0 +1,248 @@
+# jobs.py
+"""
+Долгие операции (speedtest, трассировка, проверки сети, запросы wbadmin) как задания:
+у каждого есть номер, срок выполнения и возможность отмены.
+
+jobs.run(title, func, ...) выполняет func в отдельном потоке и ждёт её не дольше срока.
+Процессы, запущенные через command_runner внутри задания, привязываются к нему:
+их таймаут не превышает остаток срока, а при отмене (кнопка "Отмена", /jobs или
+истечение срока) всё дерево процессов завершается. Поток обработчика при этом
+освобождается сразу, даже если func зависла вне внешних процессов.
+"""
+import os
+import time
+import itertools
+import threading
+
+import telegram
+
+import tracing
+
+DEFAULT_DEADLINE = 300  # секунд по умолчанию на одно задание
+CANCEL_CALLBACK_PREFIX = "job_cancel_"
+
+_jobs = {}  # id -> Job
+_jobs_changed = threading.Condition()
+_ids = itertools.count(1)
+_current = threading.local()
+
+
+class JobCancelled(Exception):
+    """Задание отменено (пользователем или по истечении срока)."""
+
+
+def default_deadline():
+    try:
+        return float(os.getenv("JOB_DEADLINE", DEFAULT_DEADLINE))
+    except ValueError:
+        return DEFAULT_DEADLINE
+
+
+class Job:
+    def __init__(self, title, chat_id=None, deadline=None):
+        self.id = next(_ids)
+        self.title = title
+        self.chat_id = chat_id
+        self.started = time.monotonic()
+        self.deadline = self.started + (deadline or default_deadline())
+        self.progress = None
+        self.cancel_reason = None
+        self.result = None
+        self.error = None
+        self.waiter = None  # поток, ожидающий задание в execute (для stall_watchdog)
+        self._threads = {}  # потоки, выполняющие задание: ident -> имя (для stall_watchdog)
+        self._finished = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def cancelled(self):
+        return self.cancel_reason is not None
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Бросает JobCancelled, если задание отменено или срок истёк."""
+        if self.cancelled:
+            raise JobCancelled(self.cancel_reason)
+        if self.remaining() <= 0:
+            self.cancel("превышен срок выполнения")
+            raise JobCancelled(self.cancel_reason)
+
+    def timeout(self, timeout=None):
+        """Таймаут для очередной операции: не больше остатка срока задания."""
+        remaining = self.remaining()
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def attach(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+        if self.cancelled:
+            self._kill(proc)
+
+    def detach(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+    def threads(self):
+        """Потоки, которые сейчас выполняют задание: [(ident, имя)]."""
+        with self._lock:
+            return list(self._threads.items())
+
+    def _enter(self):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+
+    def _leave(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def set_progress(self, text):
+        self.progress = text
+
+    def cancel(self, reason="отменено пользователем"):
+        """Отменяет задание и завершает деревья всех его процессов."""
+        with self._lock:
+            if self.cancel_reason is None:
+                self.cancel_reason = reason
+            processes = list(self._processes)
+        for proc in processes:
+            self._kill(proc)
+        self._finished.set()
+
+    @staticmethod
+    def _kill(proc):
+        from command_runner import kill_process_tree
+        kill_process_tree(proc)
+
+
+def current():
+    """Задание, в рамках которого выполняется текущий поток (или None)."""
+    return getattr(_current, "job", None)
+
+
+def bind(func):
+    """Оборачивает func так, чтобы в другом потоке она выполнялась в рамках текущего задания и трассы."""
+    func = tracing.bind(func)
+    job = current()
+    if job is None:
+        return func
+
+    def bound(*args, **kwargs):
+        previous = current()
+        _current.job = job
+        if previous is not job:
+            job._enter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if previous is not job:
+                job._leave()
+            _current.job = previous
+    return bound
+
+
+def create(title, chat_id=None, deadline=None):
+    """Регистрирует задание (в /jobs оно видно сразу, срок отсчитывается с этого момента)."""
+    job = Job(title, chat_id=chat_id, deadline=deadline)
+    with _jobs_changed:
+        _jobs[job.id] = job
+    return job
+
+
+def execute(job, func, on_start=None, on_result=None, on_cancel=None):
+    """
+    Выполняет func() в рамках задания job и возвращает её результат.
+      on_start(job)     - до запуска (например, сообщение с кнопкой отмены),
+      on_result(result) - после успешного завершения,
+      on_cancel(reason) - после отмены или истечения срока; без него бросается JobCancelled.
+    Отмена не ждёт завершения func. Задание видно в running() до конца on_result / on_cancel.
+    """
+    job.waiter = threading.get_ident()
+    try:
+        if on_start:
+            on_start(job)
+
+        def work():
+            _current.job = job
+            job._enter()
+            try:
+                job.result = func()
+            except Exception as e:
+                job.error = e
+            finally:
+                job._leave()
+                _current.job = None
+                job._finished.set()
+
+        threading.Thread(target=tracing.bind(work), name=f"job-{job.id}", daemon=True).start()
+        if not job._finished.wait(job.remaining()):
+            job.cancel("превышен срок выполнения")
+        if job.cancelled:
+            if on_cancel is None:
+                raise JobCancelled(job.cancel_reason)
+            on_cancel(job.cancel_reason)
+            return None
+        if job.error is not None:
+            raise job.error
+        if on_result:
+            on_result(job.result)
+        return job.result
+    finally:
+        with _jobs_changed:
+            _jobs.pop(job.id, None)
+            _jobs_changed.notify_all()
+
+
+def run(title, func, chat_id=None, deadline=None, **callbacks):
+    """create() и execute() в одном вызове."""
+    return execute(create(title, chat_id=chat_id, deadline=deadline), func, **callbacks)
+
+
+def wait_idle(chat_id=None, timeout=None):
+    """Ждёт завершения всех заданий (или заданий чата chat_id) - для замеров. Возвращает False по таймауту."""
+    def idle():
+        return not any(chat_id is None or job.chat_id == chat_id for job in _jobs.values())
+
+    with _jobs_changed:
+        return _jobs_changed.wait_for(idle, timeout)
+
+
+def get(job_id):
+    with _jobs_changed:
+        return _jobs.get(job_id)
+
+
+def running():
+    """Выполняющиеся задания в порядке запуска."""
+    with _jobs_changed:
+        return sorted(_jobs.values(), key=lambda job: job.id)
+
+
+def cancel(job_id, reason="отменено пользователем"):
+    job = get(job_id)
+    if job is None:
+        return False
+    job.cancel(reason)
+    return True
+
+
+def describe(job):
+    """Строка для /jobs: номер, название, сколько идёт и сколько осталось до срока."""
+    text = f"#{job.id} {job.title} - {job.elapsed:.0f} с (осталось {job.remaining():.0f} с)"
+    if job.cancelled:
+        text += f", отменяется: {job.cancel_reason}"
+    elif job.progress:
+        text += f"\n    {job.progress}"
+    return text
+
+
+def cancel_markup(job):
+    return telegram.InlineKeyboardMarkup([[telegram.InlineKeyboardButton(
+        "✖️ Отмена", callback_data=f"{CANCEL_CALLBACK_PREFIX}{job.id}")]])
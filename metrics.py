@@ -0,0 +1,313 @@
+# metrics.py
+"""
+Встроенные метрики бота: счётчики и гистограммы длительностей.
+  command_seconds{family}    - внешние команды по семейству (wmic, wbadmin, netsh, qwinsta, sc, ping, ...)
+                               и запросы PowerShell (family="powershell"),
+  decode_seconds{method}     - перекодирование вывода команд (decode_output): chardet / explicit,
+  probe_seconds{key}         - проверки probe_cache, выполненные заново,
+  handler_seconds{handler}   - обработчики бота (ошибки - handler_errors_total),
+  telegram_api_seconds{method} - запросы к Bot API (ошибки - telegram_api_errors_total).
+Просмотр: команда /stats (render_text) и, если задан METRICS_PORT, локальная страница
+в формате OpenMetrics (render_openmetrics) для внешнего сборщика.
+"""
+import os
+import re
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_SERIES = 100  # меток на одну метрику; остальные значения попадают в "other"
+PREFIX = "bot_"
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+COMMAND_FAMILIES = ("wmic", "wbadmin", "netsh", "qwinsta", "sc", "ping", "tracert", "nslookup",
+                    "net", "schtasks", "logoff", "shutdown", "taskkill", "typeperf")
+
+HELP = {
+    "command_seconds": "Длительность внешних команд по семейству",
+    "decode_seconds": "Перекодирование вывода команд",
+    "probe_seconds": "Проверки probe_cache, выполненные заново",
+    "handler_seconds": "Длительность обработчиков бота",
+    "handler_errors": "Исключения в обработчиках бота",
+    "telegram_api_seconds": "Длительность запросов к Bot API",
+    "telegram_api_errors": "Ошибки запросов к Bot API",
+    "backend_seconds": "Длительность способов выполнения операций (backend_strategy)",
+    "backend_errors": "Неудачные попытки способов выполнения операций",
+}
+
+_histograms = {}  # (имя, метка, значение) -> _Histogram
+_counters = {}    # (имя, метка, значение) -> число
+_series = {}      # имя -> множество значений метки
+_lock = threading.Lock()
+_server = None
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # последняя - больше всех границ (+Inf)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Оценка квантиля по корзинам: линейно внутри корзины, верхняя граница - не больше максимума."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+def _series_key(name, label, value):
+    values = _series.setdefault(name, set())
+    if value not in values:
+        if len(values) >= MAX_SERIES:
+            value = "other"
+        values.add(value)
+    return name, label, value
+
+
+def observe(name, seconds, label=None, value=None):
+    """Добавляет длительность в гистограмму name (с меткой label=value, если задана)."""
+    with _lock:
+        key = _series_key(name, label, value)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(seconds)
+
+
+def inc(name, label=None, value=None, amount=1):
+    with _lock:
+        key = _series_key(name, label, value)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def timer(name, label=None, value=None):
+    """with metrics.timer("decode_seconds"): ... - замер длительности блока."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, label, value)
+
+
+def command_family(cmd):
+    """Семейство команды по первому слову: "wmic cpu get ..." -> "wmic"; неизвестные - "other"."""
+    match = re.match(r'\s*"?([^\s"]+)', cmd or "")
+    if not match:
+        return "other"
+    word = os.path.basename(match.group(1)).lower()
+    if word.endswith(".exe"):
+        word = word[:-4]
+    return word if word in COMMAND_FAMILIES else "other"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _series.clear()
+
+
+# ---------- обработчики бота ----------
+
+def instrument_handlers(dispatcher):
+    """Замер handler_seconds{handler=<имя функции>} для каждого обработчика диспетчера."""
+    wrap_handlers(dispatcher, _timed_handler, "_metrics_wrapped")
+
+
+def wrap_handlers(dispatcher, wrapper, marker):
+    """
+    Заменяет callback каждого обработчика (включая вложенные в ConversationHandler) на wrapper(callback).
+    Служебные группы с отрицательным номером не оборачиваются; marker - атрибут, по которому
+    повторная обёртка тем же wrapper пропускается.
+    """
+    from telegram.ext import ConversationHandler
+
+    for group, handlers in dispatcher.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            inner = [handler]
+            if isinstance(handler, ConversationHandler):
+                inner = (list(handler.entry_points) + list(handler.fallbacks) +
+                         [h for state in handler.states.values() for h in state])
+            for h in inner:
+                if not getattr(h.callback, marker, False):
+                    h.callback = wrapper(h.callback)
+                    setattr(h.callback, marker, True)
+
+
+def _timed_handler(callback):
+    name = getattr(callback, "__name__", "handler")
+
+    def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return callback(update, context)
+        except Exception:
+            inc("handler_errors", "handler", name)
+            raise
+        finally:
+            observe("handler_seconds", time.perf_counter() - started, "handler", name)
+
+    timed.__name__ = name
+    return timed
+
+
+# ---------- вывод ----------
+
+def _snapshot():
+    with _lock:
+        histograms = {key: (list(h.buckets), h.count, h.sum, h.max, h.quantile(0.5), h.quantile(0.95))
+                      for key, h in _histograms.items()}
+        counters = dict(_counters)
+    return histograms, counters
+
+
+def _external_counters():
+    """Счётчики других модулей: (имя, {значение метки: число}, метка)."""
+    import command_runner
+    import probe_cache
+    import outbox
+    import bot_logging
+    return [
+        ("commands", dict(command_runner.counters), "kind"),
+        ("probe_cache", dict(probe_cache.counters), "result"),
+        ("outbox", dict(outbox.counters), "event"),
+        ("log_records_dropped", {None: bot_logging.dropped()}, None),
+    ]
+
+
+def render_text():
+    """Сводка для /stats: по каждой гистограмме - число, p50, p95, максимум и суммарное время."""
+    histograms, counters = _snapshot()
+    if not histograms:
+        lines = ["📈 Замеров пока нет."]
+    else:
+        lines = ["📈 Статистика (p50 / p95 / макс, мс; всего, с)"]
+    titles = {"command_seconds": "Команды", "decode_seconds": "Перекодирование вывода",
+              "probe_seconds": "Проверки (probe_cache)", "handler_seconds": "Обработчики",
+              "telegram_api_seconds": "Bot API", "backend_seconds": "Способы выполнения операций"}
+    errors = {"handler_seconds": "handler_errors", "telegram_api_seconds": "telegram_api_errors",
+              "backend_seconds": "backend_errors"}
+    for name, title in titles.items():
+        rows = sorted(((key, h) for key, h in histograms.items() if key[0] == name),
+                      key=lambda item: -item[1][2])  # самые затратные сверху
+        if not rows:
+            continue
+        lines.append(f"\n{title}:")
+        for (_, label, value), (_, count, total, peak, p50, p95) in rows:
+            row = (f"• {value or 'все'}: {count} шт., {_ms(p50)} / {_ms(p95)} / {_ms(peak)} мс, "
+                   f"всего {total:.1f} с")
+            failed = counters.get((errors.get(name), label, value))
+            if failed:
+                row += f", ошибок {failed}"
+            lines.append(row)
+    lines.append("\nСчётчики:")
+    for name, values, _ in _external_counters():
+        lines.append(f"• {name}: " + ", ".join(f"{k}={v}" if k else str(v) for k, v in values.items()))
+    return "\n".join(lines)
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds < 0.01 else f"{seconds * 1000:.0f}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(*pairs):
+    text = ",".join(f'{label}="{_escape(value)}"' for label, value in pairs if label)
+    return f"{{{text}}}" if text else ""
+
+
+def render_openmetrics():
+    """Все метрики в текстовом формате OpenMetrics 1.0."""
+    histograms, counters = _snapshot()
+    out = []
+    for name in sorted({key[0] for key in histograms}):
+        metric = PREFIX + name
+        out.append(f"# TYPE {metric} histogram")
+        out.append(f"# UNIT {metric} seconds")
+        if name in HELP:
+            out.append(f"# HELP {metric} {HELP[name]}")
+        for (_, label, value), (buckets, count, total, _, _, _) in sorted(
+                ((key, h) for key, h in histograms.items() if key[0] == name), key=lambda item: str(item[0][2])):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + (float("inf"),), buckets):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{metric}_bucket{_labels((label, value), ('le', le))} {cumulative}")
+            out.append(f"{metric}_count{_labels((label, value))} {count}")
+            out.append(f"{metric}_sum{_labels((label, value))} {total:.6f}")
+
+    for name in sorted({key[0] for key in counters}):
+        metric = PREFIX + name
+        out.append(f"# TYPE {metric} counter")
+        if name in HELP:
+            out.append(f"# HELP {metric} {HELP[name]}")
+        for (counter, label, value), count in counters.items():
+            if counter == name:
+                out.append(f"{metric}_total{_labels((label, value))} {count}")
+
+    for name, values, label in _external_counters():
+        metric = PREFIX + name
+        out.append(f"# TYPE {metric} counter")
+        for value, count in values.items():
+            out.append(f"{metric}_total{_labels((label, value))} {count}")
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+# ---------- страница для сборщика ----------
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_openmetrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # каждый опрос сборщика в журнал не пишем
+
+
+def start_server(port=None, host=None):
+    """
+    Запускает страницу /metrics (METRICS_PORT, METRICS_HOST - по умолчанию только локально).
+    Без порта ничего не делает. Возвращает сервер или None.
+    """
+    global _server
+    port = port or os.getenv("METRICS_PORT")
+    if not port or _server is not None:
+        return _server
+    host = host or os.getenv("METRICS_HOST", DEFAULT_METRICS_HOST)
+    _server = ThreadingHTTPServer((host, int(port)), _MetricsRequestHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
@@ -1,12 +1,23 @@
-import subprocess
 import re
 import time
-import chardet
-import speedtest
+import logging
+import jobs
+import tracing
+import bot_logging
+import command_runner
+from command_runner import decode_output
+from output_grammar import Grammar, Field, integer
+from jobs import JobCancelled
+from platform_provider import get_provider
+from progressive_report import PENDING, ProgressiveReport, Section
 
-def check_speedtest():
+logger = logging.getLogger(__name__)
+
+def check_speedtest(on_progress=None):
     """
     Выполняет измерение скорости с помощью speedtest.
+    on_progress(текст) вызывается перед каждым этапом (выбор сервера, загрузка, отдача).
+    Внутри задания (jobs.run) отмена срабатывает на границе этапов.
     Возвращает кортеж (успех: bool, сообщение: str).
     Пример сообщения:
       "Результат Speedtest:
@@ -14,10 +25,23 @@ def check_speedtest():
        Download: 50.20 Мбит/с
        Upload: 10.30 Мбит/с"
     """
+    job = jobs.current()
+
+    def stage(text):
+        if job is not None:
+            job.check()
+            job.set_progress(text)
+        if on_progress:
+            on_progress(text)
+
     try:
+        import speedtest  # только при измерении: модуль не нужен для запуска бота
+        stage("Выбор ближайшего сервера...")
         s = speedtest.Speedtest()
         s.get_best_server()
+        stage("Измерение скорости загрузки...")
         s.download()
+        stage("Измерение скорости отдачи...")
         s.upload()
         results = s.results.dict()
 
@@ -30,12 +54,17 @@ def check_speedtest():
                f"Download: {download:.2f} Мбит/с\n"
                f"Upload: {upload:.2f} Мбит/с")
         return True, msg
+    except JobCancelled:
+        raise
     except Exception as e:
         return False, f"Ошибка при выполнении Speedtest: {e}"
 
+GATEWAY_IP = "77.247.243.1"  # замените на реальный IP вашего шлюза
+MAX_PING_MS = 100  # порог задержки
+
 def check_network_status():
     """
-    Последовательно выполняет следующие проверки:
+    Выполняет следующие проверки (параллельно, см. network_status_report):
       1. Пинг до основного шлюза (локальная сеть)
       2. Пинг до ya.ru и vk.com
       3. nslookup для ya.ru (проверка DNS)
@@ -46,137 +75,147 @@ def check_network_status():
       - "Проблема с интернетом" – если внешние узлы или DNS недоступны,
       - "Задержки в соединении" – если пинг превышает порог (например, >100 мс).
     """
-    max_ping_ms = 100  # порог задержки
-    gateway_ip = "77.247.243.1"  # замените на реальный IP вашего шлюза
+    report = network_status_report()
+    text = report.collect()
+    return network_status_ok(report.results), text
+
+def network_status_report():
+    """Отчёт о состоянии сети: строка на каждую проверку и итоговое заключение."""
+    checks = [
+        ("gateway", "Локальная сеть (шлюз)", lambda: _ping_host(GATEWAY_IP, count=5)),
+        ("ya", "ya.ru", lambda: _ping_host("ya.ru", count=5)),
+        ("vk", "vk.com", lambda: _ping_host("vk.com", count=5)),
+        ("dns", "DNS (ya.ru)", lambda: _nslookup("ya.ru")),
+        ("interface", "Сетевой интерфейс", _check_interface_usage),
+    ]
+    # Пинги и nslookup одновременных запросов от разных администраторов выполняются один раз
+    sections = [Section(key, label, probe, render=_render_check, cache_key=f"network.{key}")
+                for key, label, probe in checks]
+    return ProgressiveReport(None, sections, summary=Section("summary", "Итог", _network_summary))
+
+def network_status_ok(results):
+    """Все ли проверки из network_status_report пройдены."""
+    return all(_check_result(results, key)[0] for key in ("gateway", "ya", "vk", "dns", "interface"))
+
+def _check_result(results, key):
+    # Проверка, завершившаяся исключением, считается неуспешной
+    return results.get(key) or (False, "")
+
+def _render_check(result):
+    ok, detail = result
+    status = "OK" if ok else "Ошибка"
+    return f"{status} ({detail})"
 
-    checks = []
-    gw_ok, gw_ping = _ping_host(gateway_ip, count=5)
-    checks.append(("Локальная сеть (шлюз)", gw_ok, gw_ping))
-    
-    ya_ok, ya_ping = _ping_host("ya.ru", count=5)
-    checks.append(("ya.ru", ya_ok, ya_ping))
-    
-    vk_ok, vk_ping = _ping_host("vk.com", count=5)
-    checks.append(("vk.com", vk_ok, vk_ping))
-    
-    dns_ok, dns_result = _nslookup("ya.ru")
-    checks.append(("DNS (ya.ru)", dns_ok, dns_result))
-    
-    net_ok, net_usage_msg = _check_interface_usage()
-    checks.append(("Сетевой интерфейс", net_ok, net_usage_msg))
-    
-    all_ok = all(x[1] for x in checks)
+def _network_summary(results):
+    """Итоговое заключение по результатам всех проверок."""
     have_delays = False
 
     # Анализируем результаты пинга на наличие задержек
-    for name, ok, detail in checks:
+    for key in ("gateway", "ya", "vk", "dns", "interface"):
+        ok, detail = _check_result(results, key)
         # Ищем слово "Average" или "Среднее" и число мс
         match = re.search(r"(?:Average|Среднее)\s*=\s*(\d+)", detail)
         if match:
             avg_ping = int(match.group(1))
-            if avg_ping > max_ping_ms:
+            if avg_ping > MAX_PING_MS:
                 have_delays = True
 
     # Формируем итоговое заключение
-    if not gw_ok:
-        summary = "Проблема с локальной сетью"
-    elif not ya_ok or not vk_ok or not dns_ok:
-        summary = "Проблема с интернетом"
+    if not _check_result(results, "gateway")[0]:
+        return "Проблема с локальной сетью"
+    elif not all(_check_result(results, key)[0] for key in ("ya", "vk", "dns")):
+        return "Проблема с интернетом"
     elif have_delays:
-        summary = "Задержки в соединении"
-    else:
-        summary = "Связь в порядке"
-
-    lines = []
-    for name, ok, detail in checks:
-        status = "OK" if ok else "Ошибка"
-        lines.append(f"{name}: {status} ({detail})")
-    lines.append(f"\nИтог: {summary}")
-    return all_ok, "\n".join(lines)
+        return "Задержки в соединении"
+    return "Связь в порядке"
 
 def check_custom_connection(target):
     """
     Выполняет проверку связи до произвольного узла (IP или домена).
-    Проводит пинг (10 пакетов) и трассировку (tracert).
+    Проводит пинг (10 пакетов) и трассировку (tracert) параллельно.
     Возвращает кортеж (успех: bool, сообщение: str) с кратким отчетом.
     """
     try:
-        ok, ping_msg = _ping_host(target, count=10)
-        tracert_msg = _traceroute(target)
-        result = (f"Проверка связи до узла: {target}\n\n"
-                  f"=== Результаты ping ===\n{ping_msg}\n\n"
-                  f"=== Трассировка ===\n{tracert_msg}\n")
-        return ok, result
+        report = custom_connection_report(target)
+        text = report.collect()
+        ping = report.results.get("ping")
+        return bool(ping and ping[0]), text
+    except JobCancelled:
+        raise
     except Exception as e:
         return False, f"Ошибка при проверке связи до {target}: {e}"
 
+def custom_connection_report(target):
+    """Отчёт о проверке связи до узла: блоки ping и трассировки."""
+    sections = [
+        Section("ping", None, lambda: _ping_host(target, count=10),
+                render=lambda result: f"=== Результаты ping ===\n{result[1]}",
+                placeholder=f"=== Результаты ping ===\n{PENDING}"),
+        Section("tracert", None, lambda: _traceroute(target),
+                render=lambda text: f"=== Трассировка ===\n{text}",
+                placeholder=f"=== Трассировка ===\n{PENDING}"),
+    ]
+    return ProgressiveReport(f"Проверка связи до узла: {target}", sections, separator="\n\n",
+                             filename="connection_check.txt")
+
 # Вспомогательные функции
 
 def _ping_host(host, count=4):
     """
     Выполняет ping -n <count> <host>, получает сырые байты вывода,
     определяет кодировку с помощью chardet и декодирует результат.
-    
-    Ищет в одной строке или нескольких подряд:
-      - (Sent|Отправлено) = <число>
-      - (Received|получено) = <число>
-      - (Lost|Потеряно) = <число>
-      - (Average|Среднее) = <число> (в отдельном регулярном выражении)
-
     Возвращает (ok: bool, details: str).
     Если статистика не найдена, возвращается сообщение об ошибке.
     """
     try:
         cmd = f'ping -n {count} {host}'
-        print(f"DEBUG: Выполняется команда: {cmd}")
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
+        logger.debug("Выполняется команда: %s", cmd)
+        proc = command_runner.run(cmd)
         raw_bytes = proc.stdout
 
-        print("DEBUG: Сырые байты вывода ping:", raw_bytes)
-
-        detected = chardet.detect(raw_bytes)
-        encoding = detected.get("encoding", "cp866")
-        confidence = detected.get("confidence", 0)
-        print(f"DEBUG: Определена кодировка: {encoding} (уверенность: {confidence})")
+        bot_logging.payload(logger, "Сырые байты вывода ping", raw_bytes)
 
-        decoded_output = raw_bytes.decode(encoding, errors="replace")
-        # Показываем «сырой» декодированный текст и его repr,
-        # чтобы точно увидеть невидимые символы, пробелы и т.д.
-        print("DEBUG: repr(decoded_output) =>", repr(decoded_output))
-        print("DEBUG: Декодированный вывод команды ping:\n", decoded_output)
+        decoded_output = decode_output(raw_bytes)
+        bot_logging.payload(logger, "Декодированный вывод ping", decoded_output)
 
-        # Ищем суммарную статистику пакетов. Используем DOTALL (re.DOTALL),
-        # чтобы .* мог захватить перевод строки. IGNORECASE для учёта регистра.
-        stats_match = re.search(
-            r"(?:Sent|Отправлено)\s*=\s*(\d+).*?"
-            r"(?:Received|получено)\s*=\s*(\d+).*?"
-            r"(?:Lost|Потеряно)\s*=\s*(\d+)",
-            decoded_output,
-            flags=re.IGNORECASE | re.DOTALL
-        )
+        return _parse_ping_stats(decoded_output)
 
-        if not stats_match:
-            return False, "Ping: статистика не найдена"
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return False, f"Ошибка пинга: {e}"
 
-        sent_val = int(stats_match.group(1))
-        rec_val = int(stats_match.group(2))
-        lost_val = int(stats_match.group(3))
+# Статистика ping: "отправлено = 4, получено = 4, потеряно = 0", "Среднее = 12 мсек"
+PING_GRAMMAR = Grammar("ping", [
+    Field("sent", {"ru-RU": ("Отправлено",), "en-US": ("Sent",)}, convert=integer),
+    Field("received", {"ru-RU": ("Получено",), "en-US": ("Received",)}, convert=integer),
+    Field("lost", {"ru-RU": ("Потеряно",), "en-US": ("Lost",)}, convert=integer),
+    Field("average", {"ru-RU": ("Среднее",), "en-US": ("Average",)}, convert=integer),
+], inline=True)
 
-        # Ищем средний пинг (Average/Среднее)
-        avg_match = re.search(
-            r"(?:Average|Среднее)\s*=\s*(\d+)",
-            decoded_output,
-            flags=re.IGNORECASE
-        )
-        avg_val = int(avg_match.group(1)) if avg_match else -1
+@tracing.traced("parse ping")
+def _parse_ping_stats(output):
+    """
+    Ищет в выводе ping (один проход, см. PING_GRAMMAR):
+      - (Sent|Отправлено) = <число>
+      - (Received|получено) = <число>
+      - (Lost|Потеряно) = <число>
+      - (Average|Среднее) = <число>
+    Возвращает (ok: bool, details: str).
+    """
+    stats = PING_GRAMMAR.first(output)
+    if not all(key in stats for key in ("sent", "received", "lost")):
+        return False, "Ping: статистика не найдена"
 
-        ok = (rec_val > 0 and lost_val == 0)
-        details = (f"Packets: Sent={sent_val}, Received={rec_val}, Lost={lost_val}, "
-                   f"Avg={avg_val if avg_val >= 0 else '??'} ms")
-        return ok, details
+    sent_val = stats["sent"]
+    rec_val = stats["received"]
+    lost_val = stats["lost"]
+    avg_val = stats.get("average", -1)
 
-    except Exception as e:
-        return False, f"Ошибка пинга: {e}"
+    ok = (rec_val > 0 and lost_val == 0)
+    details = (f"Packets: Sent={sent_val}, Received={rec_val}, Lost={lost_val}, "
+               f"Avg={avg_val if avg_val >= 0 else '??'} ms")
+    return ok, details
 
 def _traceroute(host):
     """
@@ -184,14 +223,10 @@ def _traceroute(host):
     определяет кодировку с помощью chardet и возвращает декодированный результат.
     """
     try:
-        cmd = f'tracert {host}'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        detected = chardet.detect(raw_bytes)
-        encoding = detected.get("encoding", "cp866")
-        decoded_output = raw_bytes.decode(encoding, errors="replace")
+        proc, decoded_output = command_runner.run_decoded(f'tracert {host}')
         return decoded_output
+    except JobCancelled:
+        raise
     except Exception as e:
         return f"Ошибка трассировки: {e}"
 
@@ -201,34 +236,33 @@ def _nslookup(host):
     Если в выводе присутствуют ключевые слова ("Name:" или "Addresses:"), считается, что проверка прошла успешно.
     """
     try:
-        cmd = f'nslookup {host}'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        detected = chardet.detect(raw_bytes)
-        encoding = detected.get("encoding", "cp866")
-        decoded_output = raw_bytes.decode(encoding, errors="replace")
+        proc, decoded_output = command_runner.run_decoded(f'nslookup {host}')
         
         if "Name:" in decoded_output or "Addresses:" in decoded_output:
             return True, "nslookup OK"
         else:
             return False, decoded_output.strip()
+    except JobCancelled:
+        raise
     except Exception as e:
         return False, f"Ошибка nslookup: {e}"
 
 def _check_interface_usage():
     """
     Проводит упрощённую проверку загрузки сетевого интерфейса.
-    Делает два замера BytesTotalPerSec с паузой в 1 секунду и вычисляет разницу.
+    Делает два замера накопительного счётчика байт с паузой в 1 секунду
+    и вычисляет скорость по разнице.
     Возвращает (ok: bool, details: str).
     """
     try:
-        val1 = _get_bytes_total_per_sec()
+        val1 = _get_bytes_total()
+        started = time.monotonic()
         time.sleep(1)
-        val2 = _get_bytes_total_per_sec()
+        val2 = _get_bytes_total()
+        elapsed = time.monotonic() - started
         if val1 < 0 or val2 < 0:
             return False, "Не удалось получить данные о трафике"
-        bytes_per_sec = (val2 - val1)
+        bytes_per_sec = max(val2 - val1, 0) / elapsed
         mbits_per_sec = (bytes_per_sec * 8) / (1024 * 1024)
         # Предположим, пропускная способность равна 1 Gbit/s
         usage_percent = (mbits_per_sec / 1000) * 100
@@ -236,23 +270,13 @@ def _check_interface_usage():
     except Exception as e:
         return False, f"Ошибка при измерении интерфейса: {e}"
 
-def _get_bytes_total_per_sec():
+def _get_bytes_total():
     """
-    Получает суммарное значение BytesTotalPerSec для всех сетевых интерфейсов.
+    Получает суммарный счётчик байт (принято + передано) для всех сетевых интерфейсов.
     Возвращает целое число или -1 при ошибке.
     """
     try:
-        cmd = 'wmic path Win32_PerfFormattedData_Tcpip_NetworkInterface get BytesTotalPerSec'
-        proc = subprocess.run(cmd, capture_output=True, text=True, shell=True)
-        lines = [line.strip() for line in proc.stdout.splitlines() if line.strip()]
-        if len(lines) <= 1:
-            return -1
-        total = 0
-        for line in lines[1:]:
-            try:
-                total += int(line)
-            except:
-                pass
+        total = get_provider().network_bytes()
         return total if total else -1
     except Exception as e:
         return -1
@@ -0,0 +1,274 @@
+# outbox.py
+"""
+Исходящие сообщения бота через общую очередь с ограничением частоты.
+
+OutboxBot подменяет бота в Updater: все отправки и правки сообщений
+(reply_text, edit_message_text, reply_document и т.д.) проходят через _message, где
+  - соблюдаются общий лимит и лимит на чат (токен-бакеты),
+  - правка, не меняющая текст и клавиатуру сообщения, не отправляется,
+  - несколько правок одного сообщения одним методом, ждущих своей очереди, сливаются в последнюю,
+  - при 429 (RetryAfter) запрос повторяется через retry_after секунд.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext.extbot import ExtBot
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GLOBAL_RATE = 25  # сообщений в секунду на бота (лимит Telegram ~30)
+DEFAULT_CHAT_RATE = 1     # сообщений в секунду в один чат
+DEFAULT_CHAT_BURST = 5    # столько сообщений в чат можно отправить подряд без ожидания
+MAX_RETRIES = 3           # повторов после 429
+HASH_CACHE_SIZE = 1000    # сколько последних сообщений помнить для отбрасывания пустых правок
+
+EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageReplyMarkup")
+
+# Статистика (для замеров и /stats):
+#   sent    - запросов отправлено в Telegram,
+#   dropped - правок не отправлено, т.к. содержимое не изменилось,
+#   merged  - правок поглощено более поздней правкой того же сообщения,
+#   retries - повторов после 429
+counters = {"sent": 0, "dropped": 0, "merged": 0, "retries": 0}
+_counters_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _count(name):
+    with _counters_lock:
+        counters[name] += 1
+
+
+def reset_counters():
+    with _counters_lock:
+        for key in counters:
+            counters[key] = 0
+
+
+class _Bucket:
+    """Токен-бакет: rate токенов в секунду, не больше burst накопленных. rate <= 0 - без ограничения."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait(self, now):
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class RateLimiter:
+    """Общий лимит на бота и отдельный лимит на каждый чат; pause() - пауза после 429."""
+
+    def __init__(self, global_rate, chat_rate, chat_burst):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = _Bucket(global_rate, global_rate)
+        self._chats = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id):
+        """Блокирует вызывающий поток, пока в чат chat_id нельзя отправить сообщение."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                chat = self._chats.get(chat_id)
+                if chat is None:
+                    chat = self._chats[chat_id] = _Bucket(self.chat_rate, self.chat_burst)
+                wait = max(self._global.wait(now), chat.wait(now),
+                           self._paused_until.get(chat_id, 0) - now)
+                if wait <= 0:
+                    self._global.take()
+                    chat.take()
+                    return
+            time.sleep(wait)
+
+    def pause(self, chat_id, seconds):
+        with self._lock:
+            self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0),
+                                              time.monotonic() + seconds)
+
+
+class _PendingEdit:
+    """
+    Правка, ожидающая очереди; более поздние правки того же сообщения тем же методом
+    подменяют её данные и параметры запроса (kwargs).
+    """
+
+    def __init__(self, endpoint, data, reply_markup, digest, kwargs):
+        self.endpoint = endpoint
+        self.data = data
+        self.reply_markup = reply_markup
+        self.digest = digest
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OutboxBot(ExtBot):
+    """
+    ExtBot с очередью исходящих сообщений. Лимиты по умолчанию берутся из окружения:
+      OUTBOX_GLOBAL_RATE - сообщений в секунду на бота,
+      OUTBOX_CHAT_RATE   - сообщений в секунду в один чат,
+      OUTBOX_CHAT_BURST  - сколько сообщений в чат можно отправить подряд.
+    Значение 0 отключает соответствующий лимит.
+    """
+
+    def __init__(self, *args, global_rate=None, chat_rate=None, chat_burst=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if global_rate is None:
+            global_rate = _env_float("OUTBOX_GLOBAL_RATE", DEFAULT_GLOBAL_RATE)
+        if chat_rate is None:
+            chat_rate = _env_float("OUTBOX_CHAT_RATE", DEFAULT_CHAT_RATE)
+        if chat_burst is None:
+            chat_burst = _env_float("OUTBOX_CHAT_BURST", DEFAULT_CHAT_BURST)
+        self.limiter = RateLimiter(global_rate, chat_rate, chat_burst)
+        self._sent_digests = OrderedDict()  # (chat_id, message_id) -> хэш текущего содержимого
+        self._pending = {}                  # (chat_id, message_id) -> _PendingEdit
+        self._outbox_lock = threading.Lock()
+
+    def _message(self, endpoint, data, reply_markup=None, **kwargs):
+        chat_id = str(data.get("chat_id", ""))
+        if endpoint in EDIT_ENDPOINTS and data.get("message_id"):
+            return self._edit(endpoint, (chat_id, str(data["message_id"])), data, reply_markup, kwargs)
+
+        result = self._send(endpoint, chat_id, data, reply_markup, kwargs)
+        if endpoint == "sendMessage" and hasattr(result, "message_id"):
+            self._remember((chat_id, str(result.message_id)), _digest(data, reply_markup))
+        return result
+
+    # ---------- правки ----------
+
+    def _edit(self, endpoint, key, data, reply_markup, kwargs):
+        digest = _digest(data, reply_markup)
+        while True:
+            with self._outbox_lock:
+                pending = self._pending.get(key)
+                if pending is not None and pending.endpoint != endpoint:
+                    # Правка другим методом (текст и клавиатура) не заменяет ждущую:
+                    # сначала уходит она, затем эта
+                    earlier = pending
+                elif pending is not None:
+                    # Правка этого сообщения уже ждёт очереди - отправится только последняя
+                    pending.data, pending.reply_markup = data, reply_markup
+                    pending.digest, pending.kwargs = digest, kwargs
+                    _count("merged")
+                    owner = False
+                    break
+                elif self._sent_digests.get(key) == digest:
+                    _count("dropped")
+                    return True
+                else:
+                    pending = self._pending[key] = _PendingEdit(endpoint, data, reply_markup, digest, kwargs)
+                    owner = True
+                    break
+            earlier.done.wait()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            self.limiter.acquire(key[0])
+            with self._outbox_lock:
+                self._pending.pop(key, None)
+                data, reply_markup = pending.data, pending.reply_markup
+                digest, kwargs = pending.digest, pending.kwargs
+                unchanged = self._sent_digests.get(key) == digest
+            if unchanged:
+                _count("dropped")
+                pending.result = True
+            else:
+                try:
+                    pending.result = self._post_with_retry(endpoint, key[0], data, reply_markup, kwargs)
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+                    # Сообщение уже с таким содержимым (например, отправлено до перезапуска бота)
+                    pending.result = True
+                self._remember(key, digest)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._outbox_lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+            pending.done.set()
+        return pending.result
+
+    def _remember(self, key, digest):
+        with self._outbox_lock:
+            self._sent_digests[key] = digest
+            self._sent_digests.move_to_end(key)
+            while len(self._sent_digests) > HASH_CACHE_SIZE:
+                self._sent_digests.popitem(last=False)
+
+    # ---------- отправка ----------
+
+    def _post(self, endpoint, *args, **kwargs):
+        # Все запросы к Bot API проходят здесь; getUpdates - долгий опрос, его длительность не показательна
+        if endpoint == "getUpdates":
+            return super()._post(endpoint, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"api {endpoint}"):
+                return super()._post(endpoint, *args, **kwargs)
+        except Exception:
+            metrics.inc("telegram_api_errors", "method", endpoint)
+            raise
+        finally:
+            metrics.observe("telegram_api_seconds", time.perf_counter() - started, "method", endpoint)
+
+    def _send(self, endpoint, chat_id, data, reply_markup, kwargs):
+        self.limiter.acquire(chat_id)
+        return self._post_with_retry(endpoint, chat_id, data, reply_markup, kwargs)
+
+    def _post_with_retry(self, endpoint, chat_id, data, reply_markup, kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                _count("sent")
+                # родительский _message дополняет data - передаём копию, чтобы повтор начинался с исходных данных
+                return super()._message(endpoint, dict(data), reply_markup=reply_markup, **kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                logger.warning("Telegram просит подождать %s с перед отправкой в чат %s", e.retry_after, chat_id)
+                _count("retries")
+                self.limiter.pause(chat_id, e.retry_after)
+                self.limiter.acquire(chat_id)
+
+
+def _digest(data, reply_markup):
+    """Хэш содержимого сообщения: текст/подпись, разметка и клавиатура."""
+    parts = [repr(data.get(name)) for name in ("text", "caption", "parse_mode", "entities",
+                                               "caption_entities", "disable_web_page_preview")]
+    parts.append(reply_markup.to_json() if hasattr(reply_markup, "to_json") else repr(reply_markup))
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
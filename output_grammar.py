@@ -0,0 +1,171 @@
+# output_grammar.py
+"""
+Разбор локализованного вывода консольных команд по декларативным грамматикам.
+
+Грамматика команды - список полей. У поля есть подписи для каждого языка из LOCALES
+(ru-RU, en-US) и преобразование значения: текст, число, дата по форматам языка, выбор
+из таблицы слов языка. При создании Grammar подписи всех полей и всех языков собираются
+в одно скомпилированное регулярное выражение, и разбор - один проход по тексту: по
+сработавшей группе сразу известны поле и язык. Стоимость разбора растёт линейно с размером
+вывода, а новый язык - это новые подписи в том же выражении, а не ещё один проход.
+
+Виды грамматик:
+  - строчная (по умолчанию): "Подпись: значение" или "Подпись      значение" в начале
+    строки, значение - остаток строки (net user, schtasks /fo LIST, wbadmin, netsh ras);
+  - встроенная (inline=True): "подпись = число" в любом месте текста (статистика ping).
+Поле с start=True начинает новую запись: из вывода с повторяющимися блоками
+(версии архивации, VPN-клиенты) получается список записей.
+"""
+import re
+import itertools
+from datetime import datetime
+
+# Языки вывода и их форматы; подписи полей задаются в грамматиках по этим же ключам
+LOCALES = {
+    "ru-RU": {
+        "datetime": ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S"),
+    },
+    "en-US": {
+        "datetime": ("%m/%d/%Y %I:%M %p", "%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %H:%M", "%Y-%m-%d %H:%M"),
+    },
+}
+
+# Подпись - целые слова: "Время" не совпадает с началом "Временный", "Sent" - с концом "Present"
+_WORD_EDGE = r"\b"
+
+
+# ---------- преобразования значений: (текст, язык) -> значение или None (поле не заполняется) ----------
+
+def text(value, locale):
+    return value or None
+
+
+def integer(value, locale):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def timestamp(value, locale):
+    """Дата и время по форматам языка (LOCALES[язык]["datetime"])."""
+    for fmt in LOCALES[locale]["datetime"]:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def choice(table):
+    """Значение по таблице слов языка: {язык: {слово: результат}}; первое найденное слово."""
+    lowered = {locale: [(word.lower(), result) for word, result in words.items()]
+               for locale, words in table.items()}
+
+    def convert(value, locale):
+        value = value.lower()
+        for word, result in lowered.get(locale, ()):
+            if word in value:
+                return result
+        return None
+
+    return convert
+
+
+def pattern(regex):
+    """Первая группа regex, найденного в значении."""
+    compiled = re.compile(regex)
+
+    def convert(value, locale):
+        match = compiled.search(value)
+        return match.group(1) if match else None
+
+    return convert
+
+
+class Field:
+    """
+    Поле грамматики.
+    labels  - {язык: (подпись, ...)},
+    convert - преобразование значения (text, integer, timestamp, choice(...), pattern(...)),
+    start   - поле начинает новую запись,
+    value   - регулярное выражение значения (по умолчанию остаток строки, во встроенной - число).
+    """
+
+    def __init__(self, name, labels, convert=text, start=False, value=None):
+        self.name = name
+        self.labels = labels
+        self.convert = convert
+        self.start = start
+        self.value = value
+
+
+class Grammar:
+    """Грамматика вывода команды: все подписи всех языков - в одном выражении."""
+
+    def __init__(self, name, fields, inline=False):
+        self.name = name
+        self.fields = list(fields)
+        self.inline = inline
+        self._groups = {}  # имя группы -> (имя поля, преобразование, начало записи, язык)
+        alternatives = []
+        separator = r"[ \t]*=[ \t]*" if inline else r"[ \t]*:?[ \t]*"
+        for i, field in enumerate(self.fields):
+            value = field.value or (r"\d+" if inline else r"[^\r\n]*")
+            for j, locale in enumerate(LOCALES):
+                for k, label in enumerate(field.labels.get(locale, ())):
+                    group = f"v{i}_{j}_{k}"
+                    self._groups[group] = (field.name, field.convert, field.start, locale)
+                    alternatives.append(
+                        (label, rf"{re.escape(label)}{_WORD_EDGE}{separator}(?P<{group}>{value})"))
+        # Длинные подписи раньше коротких с тем же началом ("Время запуска" и "Время")
+        alternatives.sort(key=lambda item: -len(item[0]))
+        body = "|".join(alternative for _, alternative in alternatives)
+        # Проверка первой буквы одним классом символов: без неё каждое слово вывода
+        # сравнивается с каждой подписью по очереди
+        initials = sorted({char for label, _ in alternatives for char in (label[0].lower(), label[0].upper())})
+        guard = "(?=[" + "".join(re.escape(char) for char in initials) + "])"
+        # Строчная грамматика ищет литерал "\n" (быстрый поиск) вместо проверки ^ в каждой позиции;
+        # первая строка вывода проверяется отдельно - без копии вывода с "\n" в начале
+        prefix = _WORD_EDGE if inline else r"\n[ \t]*"
+        self._regex = re.compile(f"{prefix}{guard}(?:{body})", re.IGNORECASE)
+        self._head = re.compile(rf"[ \t]*{guard}(?:{body})", re.IGNORECASE)
+
+    def _matches(self, output):
+        if self.inline:
+            return self._regex.finditer(output)
+        head = self._head.match(output)
+        return itertools.chain((head,) if head else (), self._regex.finditer(output))
+
+    def records(self, output):
+        """Записи (словари поле -> значение) в порядке вывода."""
+        records = []
+        current = {}
+        groups = self._groups
+        for match in self._matches(output):
+            group = match.lastgroup
+            name, convert, start, locale = groups[group]
+            value = convert(match.group(group).strip(), locale)
+            if start and current:
+                records.append(current)
+                current = {}
+            if value is not None:
+                current[name] = value
+        if current:
+            records.append(current)
+        return records
+
+    def first(self, output):
+        """Первое значение каждого поля; разбор заканчивается, как только найдены все поля."""
+        record = {}
+        for match in self._matches(output):
+            group = match.lastgroup
+            name, convert, _, locale = self._groups[group]
+            if name in record:
+                continue
+            value = convert(match.group(group).strip(), locale)
+            if value is not None:
+                record[name] = value
+                if len(record) == len(self.fields):
+                    break
+        return record
@@ -0,0 +1,148 @@
+# paged_output.py
+"""
+Вывод длинных результатов в Telegram.
+Текст до 4096 символов отправляется как есть; длиннее - по страницам с кнопками
+навигации (страницы хранятся на стороне бота, листание не пересчитывает результат);
+больше OUTPUT_DOCUMENT_THRESHOLD символов - одним сжатым файлом (zip с .txt внутри,
+открывается штатными средствами Windows).
+"""
+import io
+import os
+import time
+import zipfile
+import itertools
+import threading
+from collections import OrderedDict
+
+import telegram
+from telegram.constants import MAX_MESSAGE_LENGTH, MAX_CAPTION_LENGTH
+
+DEFAULT_DOCUMENT_THRESHOLD = 20000  # символов (~5 страниц)
+PAGE_CACHE_SIZE = 100               # сколько многостраничных выводов хранить
+PAGE_CACHE_TTL = 3600               # секунд, после которых страницы считаются устаревшими
+PAGE_LIMIT = MAX_MESSAGE_LENGTH - 96  # запас под номер страницы
+PAGE_CALLBACK_PREFIX = "page_"
+
+_pages = OrderedDict()  # id -> (monotonic-время, [страницы], reply_markup)
+_pages_lock = threading.Lock()
+_ids = itertools.count(1)
+# Префикс запуска: кнопки страниц, оставшиеся от прошлого запуска бота, не откроют чужой вывод
+_run_prefix = os.urandom(2).hex()
+
+
+def document_threshold():
+    try:
+        return int(os.getenv("OUTPUT_DOCUMENT_THRESHOLD", DEFAULT_DOCUMENT_THRESHOLD))
+    except ValueError:
+        return DEFAULT_DOCUMENT_THRESHOLD
+
+
+def send_text(text, send, send_document=None, reply_markup=None, filename="output.txt", edit=False):
+    """
+    Показывает text с учётом ограничений Telegram.
+      send          - update.message.reply_text или query.edit_message_text / message.edit_text,
+      send_document - message.reply_document (None - всегда страницами),
+      reply_markup  - кнопки под результатом (на страницах добавляются под навигацией),
+      filename      - имя файла внутри архива,
+      edit=True     - send правит уже показанное сообщение: при отправке файлом в нём
+                      остаётся начало вывода, а файл приходит отдельным сообщением.
+    Возвращает результат последнего вызова send / send_document.
+    """
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        return send(text, reply_markup=reply_markup)
+
+    if send_document is not None and len(text) > document_threshold():
+        name, document = _compress(text, filename)
+        note = f"📎 Полный вывод ({len(text.splitlines())} строк) - в файле {name}"
+        if edit:
+            send(_preview(text, MAX_MESSAGE_LENGTH - len(note) - 2) + "\n\n" + note, reply_markup=reply_markup)
+            return send_document(document=document, filename=name)
+        caption = _preview(text, MAX_CAPTION_LENGTH - len(note) - 2) + "\n\n" + note
+        return send_document(document=document, filename=name, caption=caption, reply_markup=reply_markup)
+
+    pages = split_pages(text)
+    page_id = _store(pages, reply_markup)
+    page_text, page_markup = render_page(page_id, pages, 0, reply_markup)
+    return send(page_text, reply_markup=page_markup)
+
+
+def get_page(page_id, index):
+    """(текст, кнопки) страницы index сохранённого вывода или None, если вывод устарел."""
+    with _pages_lock:
+        entry = _pages.get(page_id)
+        if entry is None or time.monotonic() - entry[0] > PAGE_CACHE_TTL:
+            _pages.pop(page_id, None)
+            return None
+        _pages.move_to_end(page_id)
+        _, pages, reply_markup = entry
+    index = max(0, min(index, len(pages) - 1))
+    return render_page(page_id, pages, index, reply_markup)
+
+
+def parse_callback(data):
+    """"page_<id>_<номер>" -> (id, номер)."""
+    page_id, index = data[len(PAGE_CALLBACK_PREFIX):].rsplit("_", 1)
+    return page_id, int(index)
+
+
+def render_page(page_id, pages, index, reply_markup=None):
+    total = len(pages)
+    text = f"{pages[index]}\n\n📄 Страница {index + 1} из {total}"
+    nav = []
+    if index > 0:
+        nav.append(telegram.InlineKeyboardButton("◀️", callback_data=f"{PAGE_CALLBACK_PREFIX}{page_id}_{index - 1}"))
+    nav.append(telegram.InlineKeyboardButton(f"{index + 1}/{total}",
+                                             callback_data=f"{PAGE_CALLBACK_PREFIX}{page_id}_{index}"))
+    if index < total - 1:
+        nav.append(telegram.InlineKeyboardButton("▶️", callback_data=f"{PAGE_CALLBACK_PREFIX}{page_id}_{index + 1}"))
+    rows = [nav]
+    if reply_markup is not None:
+        rows.extend(list(row) for row in reply_markup.inline_keyboard)
+    return text, telegram.InlineKeyboardMarkup(rows)
+
+
+def split_pages(text, limit=PAGE_LIMIT):
+    """Делит текст на страницы не длиннее limit символов по границам строк."""
+    pages, current = [], ""
+    for line in text.splitlines():
+        # строка длиннее страницы (например, вывод без переводов строк) режется на куски
+        while len(line) > limit:
+            if current:
+                pages.append(current)
+                current = ""
+            pages.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            pages.append(current)
+            current = line
+        else:
+            current = candidate
+    if current or not pages:
+        pages.append(current)
+    return pages
+
+
+def _store(pages, reply_markup):
+    page_id = f"{_run_prefix}{next(_ids):x}"
+    with _pages_lock:
+        _pages[page_id] = (time.monotonic(), pages, reply_markup)
+        while len(_pages) > PAGE_CACHE_SIZE:
+            _pages.popitem(last=False)
+    return page_id
+
+
+def _preview(text, limit):
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit - 1)
+    return text[:cut if cut > 0 else limit - 1] + "\n…"
+
+
+def _compress(text, filename):
+    """zip-архив с одним текстовым файлом (UTF-8 с BOM, чтобы Блокнот правильно показал кириллицу)."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(filename, text.replace("\n", "\r\n").encode("utf-8-sig"))
+    name = os.path.splitext(filename)[0] + ".zip"
+    return name, buffer.getvalue()
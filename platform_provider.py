@@ -0,0 +1,444 @@
+# platform_provider.py
+import os
+import re
+import sys
+import time
+import struct
+import string
+import logging
+import threading
+from datetime import datetime
+
+import tracing
+import wmi_query
+import bot_logging
+import command_runner
+
+logger = logging.getLogger(__name__)
+
+
+class PlatformProvider:
+    """
+    Источник сырых данных о системе. Модули бота (system_info, rdp_sessions,
+    user_management, network_check, disk_inventory) форматируют отчёты,
+    а данные берут только через провайдера.
+
+    Все методы возвращают None (или пустой список), если данные получить не удалось.
+    """
+
+    name = "base"
+
+    def cpu_load(self):
+        """Средняя загрузка CPU в процентах (float)."""
+        raise NotImplementedError
+
+    def memory(self):
+        """{"free_kb": int, "total_kb": int}"""
+        raise NotImplementedError
+
+    def disks(self):
+        """Локальные тома: [{"drive": "C:", "free": байты, "size": байты}, ...]"""
+        raise NotImplementedError
+
+    def disk(self, drive):
+        """
+        Один том по имени, в том числе не входящий в disks() (съёмный диск
+        резервных копий): {"drive", "free", "size"} или None.
+        """
+        return None
+
+    def service_states(self, names, max_age=None):
+        """
+        {имя_службы: "RUNNING" / "STOPPED" / ... или None, если состояние неизвестно}
+        max_age - допустимый возраст закэшированных данных (0 - опросить сейчас).
+        """
+        raise NotImplementedError
+
+    def sessions(self):
+        """Сеансы пользователей: [{"id": str, "user": str, "state": str}, ...]"""
+        raise NotImplementedError
+
+    def users(self):
+        """Локальные учётные записи: [{"name": str, "disabled": bool}, ...]"""
+        raise NotImplementedError
+
+    def boot_time(self):
+        """Время загрузки системы (datetime)."""
+        raise NotImplementedError
+
+    def network_bytes(self):
+        """Суммарный счётчик переданных и принятых байт по всем интерфейсам (растёт монотонно)."""
+        raise NotImplementedError
+
+
+# ============== WINDOWS: существующие консольные команды и WMI ==============
+
+class WindowsProvider(PlatformProvider):
+    name = "windows"
+
+    _DRIVE_FIXED = 3
+    _DISK_BY_ID_PROPERTIES = {"DeviceID": str, "FreeSpace": int, "Size": int}
+
+    def cpu_load(self):
+        # CPU и память всегда нужны вместе (отчёт о состоянии сервера),
+        # поэтому запрашиваются одним пакетом WMI
+        records = wmi_query.query_many([wmi_query.CPU, wmi_query.OS])["cpu"]
+        loads = [r["LoadPercentage"] for r in records if r["LoadPercentage"] is not None]
+        return sum(loads) / len(loads) if loads else None
+
+    def memory(self):
+        records = wmi_query.query_many([wmi_query.CPU, wmi_query.OS])["os"]
+        if not records or records[0]["FreePhysicalMemory"] is None or not records[0]["TotalVisibleMemorySize"]:
+            return None
+        return {"free_kb": records[0]["FreePhysicalMemory"],
+                "total_kb": records[0]["TotalVisibleMemorySize"]}
+
+    def disks(self):
+        """Диски опрашиваются прямо в процессе через WinAPI; запасной путь - один запрос WMI."""
+        try:
+            return self._disks_native()
+        except Exception as e:
+            logger.warning("Ошибка опроса дисков через WinAPI, используется WMI: %s", e)
+        return [{"drive": d["DeviceID"], "free": d["FreeSpace"], "size": d["Size"]}
+                for d in wmi_query.query(wmi_query.DISKS, max_age=0)
+                if d["DeviceID"] and d["FreeSpace"] is not None and d["Size"]]
+
+    def _disks_native(self):
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        mask = kernel32.GetLogicalDrives()
+        volumes = []
+        for index, letter in enumerate(string.ascii_uppercase):
+            if not mask & (1 << index):
+                continue
+            if kernel32.GetDriveTypeW(f"{letter}:\\") != self._DRIVE_FIXED:
+                continue
+            volume = self._disk_native(f"{letter}:")
+            if volume:
+                volumes.append(volume)
+        return volumes
+
+    def _disk_native(self, drive):
+        import ctypes
+
+        free = ctypes.c_ulonglong(0)
+        total = ctypes.c_ulonglong(0)
+        if not ctypes.windll.kernel32.GetDiskFreeSpaceExW(f"{drive}\\", None, ctypes.byref(total),
+                                                          ctypes.byref(free)):
+            return None
+        if not total.value:
+            return None
+        return {"drive": drive, "free": free.value, "size": total.value}
+
+    def disk(self, drive):
+        """Том любого типа (USB, съёмный диск): WinAPI, запасной путь - запрос WMI по DeviceID."""
+        try:
+            return self._disk_native(drive)
+        except Exception as e:
+            logger.warning("Ошибка опроса диска %s через WinAPI, используется WMI: %s", drive, e)
+        query = wmi_query.WmiQuery(f"disk.{drive}", "Win32_LogicalDisk", self._DISK_BY_ID_PROPERTIES,
+                                   where=f"DeviceID='{drive}'")
+        for d in wmi_query.query(query, max_age=0):
+            if d["DeviceID"] and d["FreeSpace"] is not None and d["Size"]:
+                return {"drive": d["DeviceID"], "free": d["FreeSpace"], "size": d["Size"]}
+        return None
+
+    def service_states(self, names, max_age=None):
+        # Одно перечисление Win32_Service на весь список; имя можно задать и отображаемым именем
+        records = wmi_query.query(wmi_query.SERVICES, max_age=max_age)
+        if records:
+            by_name = {}
+            for record in records:
+                for key in ("DisplayName", "Name"):
+                    if record[key]:
+                        by_name[record[key].lower()] = record["State"]
+            return {name: wmi_service_state(by_name.get(name.lower())) for name in names}
+
+        # WMI недоступен - по одной команде sc query на службу
+        states = {}
+        for name in names:
+            cmd = f'sc query "{name}"'
+            logger.debug("Выполняется команда: %s", cmd)
+            proc, decoded = command_runner.run_decoded(cmd)
+            bot_logging.payload(logger, "Вывод sc query", decoded)
+            states[name] = parse_sc_state(decoded)
+        return states
+
+    def sessions(self):
+        result, decoded = command_runner.run_decoded("qwinsta", encoding="cp866")
+        return parse_qwinsta(decoded)
+
+    def users(self):
+        return [{"name": u["Name"], "disabled": bool(u["Disabled"])}
+                for u in wmi_query.query(wmi_query.USERS) if u["Name"]]
+
+    def boot_time(self):
+        records = wmi_query.query_many([wmi_query.CPU, wmi_query.OS])["os"]
+        if records and records[0]["LastBootUpTime"] is not None:
+            return records[0]["LastBootUpTime"]
+
+        # Запасной путь - systeminfo (медленный, несколько секунд)
+        proc, decoded = command_runner.run_decoded("systeminfo")
+        return parse_systeminfo_boot_time(decoded)
+
+    def network_bytes(self):
+        # Счётчик растёт каждую секунду, поэтому кэш не используем
+        records = wmi_query.query(wmi_query.NIC, max_age=0)
+        values = [r["BytesTotalPersec"] for r in records if r["BytesTotalPersec"] is not None]
+        return sum(values) if values else None
+
+
+def wmi_service_state(state):
+    """Состояние Win32_Service ("Running", "Start Pending") в виде sc query ("RUNNING", "START_PENDING")."""
+    return state.strip().upper().replace(" ", "_") if state else None
+
+
+@tracing.traced("parse sc")
+def parse_sc_state(output):
+    """
+    Извлекает состояние службы из вывода sc query.
+    Пример англ. строки: "STATE              : 4  RUNNING"
+    На русской Windows может быть "СОСТОЯНИЕ         : 4  RUNNING"
+    """
+    match = re.search(r"(?:STATE|СОСТОЯНИЕ)\s*:\s*\d+\s+(\w+)", output, re.IGNORECASE)
+    return match.group(1).upper() if match else None
+
+
+_QWINSTA_PATTERN = r'^(.+?)\s+(\d+)\s+([^\s]+)(?:\s+rdpwd)?$'
+_QWINSTA_SYSTEM_USERS = ['services', 'console', 'rdp-tcp']
+_QWINSTA_STATE_MAP = {
+    "Диск": "Отключен",
+    "Подключено": "Подключено",
+    "Активен": "Активен",
+    "Прием": "Прием",
+    "Активно": "Активен"
+}
+
+
+@tracing.traced("parse qwinsta")
+def parse_qwinsta(output):
+    """Разбирает вывод qwinsta в список сеансов (без системных)."""
+    sessions = []
+    for line in output.splitlines()[1:]:
+        line = line.strip()
+        if not line:
+            continue
+
+        match = re.match(_QWINSTA_PATTERN, line)
+        if match:
+            user_full, session_id, state = match.groups()
+            user_full = user_full.replace('>', '')
+
+            user = user_full
+            if user.startswith('rdp-tcp#'):
+                parts = user.split(maxsplit=1)
+                if len(parts) > 1:
+                    user = parts[1].strip()
+
+            if user.lower() in _QWINSTA_SYSTEM_USERS:
+                continue
+
+            state = _QWINSTA_STATE_MAP.get(state, state)
+            sessions.append({"id": session_id, "user": user, "state": state})
+    return sessions
+
+
+@tracing.traced("parse systeminfo")
+def parse_systeminfo_boot_time(output):
+    """Ищет строку "Время загрузки системы:" в выводе systeminfo (русская Windows)."""
+    for line in output.splitlines():
+        line = line.strip()
+        if line.lower().startswith("время загрузки системы:"):
+            value = line.split(":", 1)[1].strip()
+            try:
+                return datetime.strptime(value, "%d.%m.%Y, %H:%M:%S")
+            except ValueError:
+                return None
+    return None
+
+
+# ============== LINUX: чтение /proc и системных файлов без запуска процессов ==============
+
+class LinuxProvider(PlatformProvider):
+    """
+    Реализация без внешних команд: /proc, statvfs, utmp, /etc/passwd.
+    Используется для регрессионных проверок и замеров вне рабочего сервера.
+    """
+
+    name = "linux"
+
+    _CPU_SAMPLE_INTERVAL = 0.1
+    _UTMP_FORMAT = "hi32s4s32s256shhiii16s20s"
+    _UTMP_USER_PROCESS = 7
+    _REAL_FS_PREFIXES = ("/dev/",)
+
+    def __init__(self, proc_root="/proc", utmp_path="/var/run/utmp",
+                 passwd_path="/etc/passwd", shadow_path="/etc/shadow",
+                 systemd_units="/run/systemd/units"):
+        self.proc_root = proc_root
+        self.utmp_path = utmp_path
+        self.passwd_path = passwd_path
+        self.shadow_path = shadow_path
+        self.systemd_units = systemd_units
+        self._cpu_lock = threading.Lock()
+        self._last_cpu_sample = None
+
+    def cpu_load(self):
+        # Загрузка считается по разнице с предыдущим замером; если он слишком
+        # свежий (или его нет), делаем короткий дополнительный замер
+        with self._cpu_lock:
+            previous = self._last_cpu_sample
+            if previous is None or time.monotonic() - previous[0] < self._CPU_SAMPLE_INTERVAL:
+                previous = (time.monotonic(),) + self._read_cpu_times()
+                time.sleep(self._CPU_SAMPLE_INTERVAL)
+            current = (time.monotonic(),) + self._read_cpu_times()
+            self._last_cpu_sample = current
+        total = current[1] - previous[1]
+        idle = current[2] - previous[2]
+        if total <= 0:
+            return 0.0
+        return (1 - idle / total) * 100
+
+    def _read_cpu_times(self):
+        with open(os.path.join(self.proc_root, "stat")) as f:
+            fields = f.readline().split()[1:]
+        values = [int(v) for v in fields]
+        idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+        return sum(values), idle
+
+    def memory(self):
+        info = {}
+        with open(os.path.join(self.proc_root, "meminfo")) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                info[key] = int(value.split()[0])
+        total = info.get("MemTotal")
+        free = info.get("MemAvailable", info.get("MemFree"))
+        if not total or free is None:
+            return None
+        return {"free_kb": free, "total_kb": total}
+
+    def disks(self):
+        volumes = []
+        seen = set()
+        with open(os.path.join(self.proc_root, "mounts")) as f:
+            for line in f:
+                device, mount_point = line.split()[:2]
+                if not device.startswith(self._REAL_FS_PREFIXES) or device in seen:
+                    continue
+                seen.add(device)
+                try:
+                    st = os.statvfs(mount_point)
+                except OSError:
+                    continue
+                size = st.f_blocks * st.f_frsize
+                if size:
+                    volumes.append({"drive": mount_point, "free": st.f_bavail * st.f_frsize, "size": size})
+        return volumes
+
+    def service_states(self, names, max_age=None):
+        # systemd держит символьную ссылку invocation:<unit> только для активных юнитов
+        states = {}
+        for name in names:
+            unit = name if "." in name else f"{name}.service"
+            path = os.path.join(self.systemd_units, f"invocation:{unit}")
+            states[name] = "RUNNING" if os.path.lexists(path) else "STOPPED"
+        return states
+
+    def sessions(self):
+        sessions = []
+        record_size = struct.calcsize(self._UTMP_FORMAT)
+        try:
+            with open(self.utmp_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return sessions
+        for offset in range(0, len(data) - record_size + 1, record_size):
+            fields = struct.unpack_from(self._UTMP_FORMAT, data, offset)
+            ut_type, pid, line, _, user = fields[:5]
+            if ut_type != self._UTMP_USER_PROCESS:
+                continue
+            if not os.path.exists(os.path.join(self.proc_root, str(pid))):
+                continue  # устаревшая запись
+            sessions.append({
+                "id": str(pid),
+                "user": user.split(b"\0", 1)[0].decode("utf-8", "replace"),
+                "state": "Активен",
+            })
+        return sessions
+
+    def users(self):
+        locked = set()
+        try:
+            with open(self.shadow_path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split(":")
+                    if len(parts) > 1 and parts[1].startswith("!"):
+                        locked.add(parts[0])
+        except OSError:
+            pass  # без прав root файл недоступен - считаем все учётные записи активными
+
+        users = []
+        with open(self.passwd_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split(":")
+                if len(parts) < 7:
+                    continue
+                name, uid, shell = parts[0], int(parts[2]), parts[6]
+                if uid < 1000 or shell.endswith(("nologin", "false")):
+                    continue
+                users.append({"name": name, "disabled": name in locked})
+        return users
+
+    def boot_time(self):
+        with open(os.path.join(self.proc_root, "stat")) as f:
+            for line in f:
+                if line.startswith("btime"):
+                    return datetime.fromtimestamp(int(line.split()[1]))
+        return None
+
+    def network_bytes(self):
+        total = 0
+        with open(os.path.join(self.proc_root, "net", "dev")) as f:
+            for line in f.readlines()[2:]:
+                iface, _, data = line.partition(":")
+                if iface.strip() == "lo":
+                    continue
+                fields = data.split()
+                total += int(fields[0]) + int(fields[8])  # принято + передано
+        return total
+
+
+# ============== ВЫБОР ПРОВАЙДЕРА ==============
+
+_PROVIDERS = {
+    "windows": WindowsProvider,
+    "linux": LinuxProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """
+    Возвращает провайдера для текущей платформы.
+    Переменная окружения PLATFORM_PROVIDER (windows / linux) позволяет выбрать его явно.
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            name = os.getenv("PLATFORM_PROVIDER") or ("windows" if sys.platform == "win32" else "linux")
+            provider_class = _PROVIDERS.get(name.lower())
+            if provider_class is None:
+                raise ValueError(f"Неизвестный провайдер платформы: {name}")
+            _provider = provider_class()
+        return _provider
+
+
+def set_provider(provider):
+    """Подменяет провайдера (для замеров и проверок вне рабочего сервера)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
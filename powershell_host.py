@@ -0,0 +1,372 @@
+# powershell_host.py
+import os
+import json
+import time
+import base64
+import queue
+import threading
+import subprocess
+
+from command_runner import kill_process_tree
+
+# Скрипт рабочего процесса. Совместим с PowerShell 2.0 (Windows Server 2008 R2):
+# вместо ConvertFrom-Json используется JavaScriptSerializer из .NET 3.5.
+# Протокол: одна JSON-строка на запрос {"id", "script"} во входном потоке
+# и одна JSON-строка на ответ {"id", "ok", "exit_code", "output", "error"} в выходном.
+# Все не-ASCII символы экранируются (\uXXXX), поэтому кодировка консоли не важна.
+WORKER_SCRIPT = r'''
+Add-Type -AssemblyName System.Web.Extensions
+$serializer = New-Object System.Web.Script.Serialization.JavaScriptSerializer
+$serializer.MaxJsonLength = [int]::MaxValue
+
+# Write-Host пишет мимо конвейера прямо в stdout и ломает протокол,
+# поэтому перенаправляем его в обычный вывод скрипта
+function Write-Host {
+    param([Parameter(ValueFromRemainingArguments = $true)] $Object,
+          $ForegroundColor, $BackgroundColor, [switch] $NoNewline, $Separator = ' ')
+    Write-Output (($Object | ForEach-Object { "$_" }) -join $Separator)
+}
+
+function ConvertTo-AsciiJson($value) {
+    $text = $serializer.Serialize($value)
+    [regex]::Replace($text, '[^\x00-\x7F]', { param($m) '\u{0:x4}' -f [int][char]$m.Value })
+}
+
+$stdin = [Console]::In
+$stdout = [Console]::Out
+while ($true) {
+    $line = $stdin.ReadLine()
+    if ($line -eq $null) { break }
+    if ($line.Trim().Length -eq 0) { continue }
+
+    $response = @{ id = $null; ok = $true; exit_code = 0; output = ''; error = '' }
+    try {
+        $request = $serializer.DeserializeObject($line)
+        $response.id = $request['id']
+        $global:LASTEXITCODE = 0
+        $block = [ScriptBlock]::Create($request['script'])
+        # Необработанная ошибка командлета прерывает скрипт и попадает в catch;
+        # ошибки, перехваченные внутри самого скрипта, на результат не влияют
+        $ErrorActionPreference = 'Stop'
+        $response.output = (& $block | Out-String -Width 4096)
+        if ($LASTEXITCODE) {
+            $response.ok = $false
+            $response.exit_code = $LASTEXITCODE
+        }
+    } catch {
+        $response.ok = $false
+        $response.error = $_.Exception.Message
+    } finally {
+        $ErrorActionPreference = 'Continue'
+    }
+    if (-not $response.ok -and -not $response.exit_code) { $response.exit_code = 1 }
+
+    $stdout.WriteLine((ConvertTo-AsciiJson $response))
+    $stdout.Flush()
+}
+'''
+
+DEFAULT_REQUEST_TIMEOUT = 60   # секунд на один запрос
+DEFAULT_IDLE_TIMEOUT = 300     # простой, после которого рабочий процесс завершается
+DEFAULT_POOL_SIZE = 1
+
+
+class PowerShellError(Exception):
+    """Ошибка взаимодействия с рабочим процессом PowerShell"""
+
+
+def default_worker_command():
+    """
+    Возвращает командную строку для запуска рабочего процесса PowerShell.
+    Скрипт передаётся через -EncodedCommand (UTF-16LE + base64), чтобы не зависеть
+    от экранирования кавычек и не создавать временных файлов.
+    """
+    encoded = base64.b64encode(WORKER_SCRIPT.encode("utf-16-le")).decode("ascii")
+    return ["powershell", "-NoLogo", "-NoProfile", "-NonInteractive",
+            "-ExecutionPolicy", "Bypass", "-EncodedCommand", encoded]
+
+
+def quote(value):
+    """
+    Экранирует строку для подстановки в скрипт PowerShell как литерал в одинарных кавычках.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class PowerShellHost:
+    """
+    Один долгоживущий процесс PowerShell, выполняющий скрипты по запросу.
+
+    - Процесс запускается при первом запросе и переиспользуется.
+    - Если процесс упал, следующий запрос запускает его заново.
+    - При превышении времени ожидания процесс убивается (его состояние неизвестно).
+    - После idle_timeout секунд простоя процесс завершается, чтобы не держать память.
+
+    Параметр command позволяет подставить другой рабочий процесс с тем же протоколом
+    (например, скрипт-заглушку на Python для проверки на Linux).
+    """
+
+    def __init__(self, command=None, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.command = command or default_worker_command()
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._proc = None
+        self._responses = None
+        self._next_id = 0
+        self._idle_timer = None
+        self._users = 0  # запросы, которые выполняются или ждут self._lock
+        self._users_lock = threading.Lock()
+        self.spawns = 0  # сколько раз запускался рабочий процесс (включая перезапуски)
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def run(self, script, timeout=None):
+        """
+        Выполняет скрипт в рабочем процессе.
+        Возвращает кортеж (успех: bool, вывод: str). При ошибке вывод содержит
+        текст ошибки PowerShell или описание сбоя рабочего процесса.
+        """
+        with self._users_lock:
+            self._users += 1
+        try:
+            with self._lock:
+                self._cancel_idle_timer()
+                try:
+                    response = self._request(script, timeout or self.request_timeout)
+                except PowerShellError as e:
+                    return False, str(e)
+                finally:
+                    self._schedule_idle_shutdown()
+        finally:
+            with self._users_lock:
+                self._users -= 1
+
+        output = response.get("output") or ""
+        if response.get("ok"):
+            return True, output
+        error = response.get("error") or ""
+        return False, "\n".join(part for part in (output.strip(), error.strip()) if part)
+
+    def stop(self):
+        """Завершает рабочий процесс (если он запущен)."""
+        with self._lock:
+            self._cancel_idle_timer()
+            self._stop_process()
+
+    # ------------------------------------------------------------------
+    # ВНУТРЕННЯЯ ЛОГИКА (вызывается под self._lock)
+    # ------------------------------------------------------------------
+
+    def _request(self, script, timeout):
+        self._next_id += 1
+        request_id = self._next_id
+        line = json.dumps({"id": request_id, "script": script}, ensure_ascii=True) + "\n"
+
+        # Если процесс умер между запросами, запрос ещё не доставлен -
+        # его можно безопасно отправить повторно в новый процесс
+        for attempt in range(2):
+            self._ensure_started()
+            try:
+                self._proc.stdin.write(line)
+                self._proc.stdin.flush()
+                break
+            except (OSError, ValueError):
+                self._stop_process()
+                if attempt:
+                    raise PowerShellError("Не удалось передать запрос процессу PowerShell")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stop_process(force=True)
+                raise PowerShellError(f"Превышено время ожидания PowerShell ({timeout} с)")
+            try:
+                response = self._responses.get(timeout=remaining)
+            except queue.Empty:
+                continue
+
+            if response is None:
+                # Процесс завершился, не ответив: запрос мог быть частично выполнен,
+                # поэтому повторно его не отправляем
+                self._stop_process()
+                raise PowerShellError("Процесс PowerShell аварийно завершился во время выполнения запроса")
+            if response.get("id") == request_id:
+                return response
+            # Ответ на старый запрос (после таймаута) - пропускаем
+
+    def _ensure_started(self):
+        if self.alive:
+            return
+        if self._proc is not None:
+            self._stop_process()
+
+        creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        try:
+            self._proc = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+                errors="replace",
+                bufsize=1,
+                creationflags=creationflags,
+            )
+        except OSError as e:
+            self._proc = None
+            raise PowerShellError(f"Не удалось запустить PowerShell: {e}")
+        self.spawns += 1
+
+        self._responses = queue.Queue()
+        reader = threading.Thread(target=self._read_responses,
+                                  args=(self._proc, self._responses),
+                                  name="powershell-reader", daemon=True)
+        reader.start()
+
+    @staticmethod
+    def _read_responses(proc, responses):
+        """Читает ответы рабочего процесса; None в очереди означает завершение процесса."""
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    continue  # посторонний вывод, не относящийся к протоколу
+                if isinstance(response, dict):
+                    responses.put(response)
+        except (OSError, ValueError):
+            pass
+        finally:
+            responses.put(None)
+
+    def _stop_process(self, force=False):
+        proc = self._proc
+        self._proc = None
+        if proc is None:
+            return
+        if proc.poll() is None and not force:
+            # Штатное завершение: закрываем stdin, рабочий цикл выходит по EOF
+            try:
+                proc.stdin.close()
+            except (OSError, ValueError):
+                pass
+            try:
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                force = True
+        if proc.poll() is None and force:
+            kill_process_tree(proc)
+        for stream in (proc.stdin, proc.stdout):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+    def _schedule_idle_shutdown(self):
+        if not self.idle_timeout or not self.alive:
+            return
+        self._idle_timer = threading.Timer(self.idle_timeout, self._idle_shutdown)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _idle_shutdown(self):
+        # Если процесс сейчас занят запросом, таймер будет перезапущен после него
+        if self._lock.acquire(blocking=False):
+            try:
+                # Таймер сработал, но процесс уже снова нужен: запрос ждёт блокировку
+                # или после срабатывания успел пройти запрос и запустить новый таймер
+                if self._idle_timer is not threading.current_thread() or self._users:
+                    return
+                self._idle_timer = None
+                self._stop_process()
+            finally:
+                self._lock.release()
+
+
+class PowerShellPool:
+    """
+    Небольшой пул рабочих процессов PowerShell.
+    Процессы запускаются лениво: второй процесс появляется только тогда,
+    когда первый занят параллельным запросом.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, **host_kwargs):
+        self.hosts = [PowerShellHost(**host_kwargs) for _ in range(max(1, size))]
+        # Стек, а не очередь: последовательные запросы берут последний использованный (уже
+        # запущенный) процесс, и второй запускается, только когда первый занят
+        self._idle = queue.LifoQueue()
+        for host in self.hosts:
+            self._idle.put(host)
+
+    def run(self, script, timeout=None):
+        """
+        Выполняет скрипт на первом свободном процессе. Возвращает (успех, вывод).
+        timeout - общее время ожидания: если за это время не освободился ни один
+        процесс, возвращается ошибка, а не бесконечное ожидание.
+        """
+        timeout = timeout or self.hosts[0].request_timeout
+        deadline = time.monotonic() + timeout
+        try:
+            host = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return False, f"Все процессы PowerShell заняты, свободный не появился за {timeout} с"
+        try:
+            return host.run(script, timeout=max(deadline - time.monotonic(), 0.1))
+        finally:
+            self._idle.put(host)
+
+    def stop(self):
+        for host in self.hosts:
+            host.stop()
+
+
+# ============== ОБЩИЙ ПУЛ ДЛЯ ВСЕХ МОДУЛЕЙ ==============
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Возвращает общий пул PowerShell. Параметры читаются из переменных окружения
+    при первом обращении (к этому моменту .env уже загружен в bot_main):
+      POWERSHELL_POOL_SIZE, POWERSHELL_TIMEOUT, POWERSHELL_IDLE_TIMEOUT
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PowerShellPool(
+                size=_int_env("POWERSHELL_POOL_SIZE", DEFAULT_POOL_SIZE),
+                request_timeout=_int_env("POWERSHELL_TIMEOUT", DEFAULT_REQUEST_TIMEOUT),
+                idle_timeout=_int_env("POWERSHELL_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT),
+            )
+        return _pool
+
+
+def run_powershell(script, timeout=None):
+    """
+    Выполняет скрипт PowerShell в общем пуле рабочих процессов.
+    Возвращает кортеж (успех: bool, вывод: str).
+    """
+    return get_pool().run(script, timeout=timeout)
+
+
+def _int_env(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
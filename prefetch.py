@@ -0,0 +1,172 @@
+# prefetch.py
+"""
+Предварительная загрузка частых экранов: список пользователей, сеансы RDP, VPN-клиенты,
+место на дисках, список версий резервных копий.
+
+Экраны берут данные через get(имя) - это probe_cache с ключом "view.<имя>". Пока работает
+фоновая загрузка (start), она обновляет каждый экран раз в его интервал, и экран принимает
+данные не старше полутора интервалов: первое нажатие не ждёт qwinsta, netsh или wbadmin.
+Без фоновой загрузки действует обычная свежесть probe_cache (PROBE_CACHE_TTL).
+
+Перед первым экраном тот же поток загружает chardet (command_runner.warm_up_decoder),
+чтобы первый вывод без явной кодировки не ждал загрузки его моделей.
+
+Фоновая загрузка работает с низким приоритетом: экраны обновляются по одному в отдельном
+потоке, пока идут обработчики или задания - ждёт, а если администраторы не заходили
+PREFETCH_IDLE_MINUTES минут - останавливается до следующего действия (touch).
+После действия, меняющего данные экрана (блокировка пользователя, сброс VPN, завершение
+сеанса), refresh(имя) сбрасывает экран и сразу загружает его заново в фоне.
+"""
+import os
+import time
+import logging
+import importlib
+import threading
+
+import jobs
+import probe_cache
+import command_runner
+import stall_watchdog
+
+logger = logging.getLogger(__name__)
+
+# имя экрана -> (модуль, функция, интервал фонового обновления в секундах)
+VIEWS = {
+    "users": ("user_management", "get_users", 60),
+    "sessions": ("rdp_sessions", "get_sessions", 60),
+    "vpn": ("vpn_connections", "get_vpn_sessions", 60),
+    "disks": ("backup_monitoring", "check_backup_disk_space", 120),
+    "backup_versions": ("backup_monitoring", "get_backup_versions", 600),  # wbadmin - самый дорогой
+}
+DEFAULT_IDLE_MINUTES = 30
+BUSY_WAIT = 1.0       # секунд между проверками, свободен ли бот
+MAX_BUSY_WAIT = 30.0  # дольше фоновая загрузка не уступает обработчикам
+
+_queue = []           # [(имя, срочно)] - экраны в очереди на загрузку
+_due = {}             # имя -> monotonic-время следующего планового обновления
+_changed = threading.Condition()
+_last_activity = time.monotonic()
+_thread = None
+
+
+def _key(name):
+    return f"view.{name}"
+
+
+def enabled():
+    return os.getenv("PREFETCH", "1").strip().lower() in ("1", "true", "yes")
+
+
+def idle_timeout():
+    try:
+        return float(os.getenv("PREFETCH_IDLE_MINUTES", DEFAULT_IDLE_MINUTES)) * 60
+    except ValueError:
+        return DEFAULT_IDLE_MINUTES * 60
+
+
+def _probe(name):
+    module, function, _ = VIEWS[name]
+    return getattr(importlib.import_module(module), function)()
+
+
+def get(name, max_age=None):
+    """Данные экрана name (результат функции из VIEWS); max_age=0 - получить заново."""
+    if max_age is None and _thread is not None:
+        max_age = VIEWS[name][2] * 1.5
+    return probe_cache.get(_key(name), lambda: _probe(name), max_age=max_age)[0]
+
+
+def invalidate(name):
+    """Следующий get(name) получит данные заново (кнопки "Обновить")."""
+    probe_cache.invalidate(_key(name))
+
+
+def refresh(*names):
+    """Данные экранов изменились: сбросить их и загрузить заново в фоне (без фоновой загрузки - только сброс)."""
+    for name in names:
+        invalidate(name)
+    if _thread is not None:
+        _enqueue(names, urgent=True)
+
+
+def touch():
+    """Отметка активности администратора: фоновая загрузка продолжается ещё PREFETCH_IDLE_MINUTES."""
+    global _last_activity
+    with _changed:
+        idle = time.monotonic() - _last_activity > idle_timeout()
+        _last_activity = time.monotonic()
+        if idle:
+            _changed.notify()
+
+
+def _enqueue(names, urgent):
+    with _changed:
+        for name in names:
+            queued = [entry for entry in _queue if entry[0] == name]
+            if not queued:
+                entry = (name, urgent)
+                _queue.insert(0, entry) if urgent else _queue.append(entry)
+            elif urgent and not queued[0][1]:
+                _queue.remove(queued[0])
+                _queue.insert(0, (name, True))
+        _changed.notify()
+
+
+def _next_entry():
+    """Ждёт очередной экран: срочный из очереди или плановый, когда подошёл его срок."""
+    with _changed:
+        while True:
+            now = time.monotonic()
+            active = now - _last_activity <= idle_timeout()
+            if active:
+                _queue.extend((name, False) for name, due in _due.items()
+                              if due <= now and all(entry[0] != name for entry in _queue))
+            if _queue:
+                return _queue.pop(0)
+            wait = min((due - now for due in _due.values()), default=None) if active else None
+            _changed.wait(max(wait, 0.5) if wait is not None else None)
+
+
+def _busy():
+    return bool(stall_watchdog.running() or jobs.running())
+
+
+def _warm(name, urgent):
+    if not urgent:
+        # Плановое обновление уступает обработчикам и заданиям администраторов
+        waited = 0.0
+        while _busy() and waited < MAX_BUSY_WAIT:
+            time.sleep(BUSY_WAIT)
+            waited += BUSY_WAIT
+    started = time.perf_counter()
+    try:
+        probe_cache.get(_key(name), lambda: _probe(name), max_age=0)
+        logger.debug("Экран %s загружен за %.2f с", name, time.perf_counter() - started)
+    except Exception as e:
+        logger.warning("Не удалось загрузить экран %s: %s", name, e)
+    finally:
+        with _changed:
+            _due[name] = time.monotonic() + VIEWS[name][2]
+
+
+def start():
+    """Запускает фоновую загрузку: сначала все экраны, затем каждый по своему интервалу."""
+    global _thread
+    if _thread is not None or not enabled():
+        return
+    with _changed:
+        now = time.monotonic()
+        _due.update({name: now for name in VIEWS})
+
+    def loop():
+        # Первые экраны декодируют вывод через chardet - загрузить его раньше первого запроса
+        try:
+            command_runner.warm_up_decoder()
+        except Exception as e:
+            logger.warning("Не удалось подготовить определение кодировки: %s", e)
+        while True:
+            name, urgent = _next_entry()
+            _warm(name, urgent)
+
+    _thread = threading.Thread(target=loop, name="prefetch", daemon=True)
+    _thread.start()
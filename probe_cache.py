@@ -0,0 +1,109 @@
+# probe_cache.py
+import os
+import time
+import threading
+
+import metrics
+import tracing
+
+DEFAULT_FRESHNESS = 15  # секунд, в течение которых результат проверки отдаётся повторно
+
+# Статистика обращений (для замеров и /stats):
+#   hits   - результат взят из кэша,
+#   joins  - запрос дождался уже выполняющейся проверки,
+#   misses - проверка выполнена заново
+counters = {"hits": 0, "joins": 0, "misses": 0}
+
+_cache = {}     # key -> (monotonic-время получения, результат)
+_inflight = {}  # key -> _Flight
+_lock = threading.Lock()
+
+
+class _Flight:
+    """Выполняющаяся проверка: остальные запросы ждут её результата."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def freshness():
+    try:
+        return float(os.getenv("PROBE_CACHE_TTL", DEFAULT_FRESHNESS))
+    except ValueError:
+        return DEFAULT_FRESHNESS
+
+
+def get(key, probe, max_age=None):
+    """
+    Выполняет probe() не более одного раза одновременно для одного key.
+    - если проверка с тем же key уже выполняется - ждёт её и возвращает её результат,
+    - если результат не старше max_age секунд (по умолчанию PROBE_CACHE_TTL) - отдаёт его,
+    - иначе выполняет probe() и запоминает результат.
+    max_age=0 - не брать из кэша (но присоединиться к выполняющейся проверке).
+    Возвращает кортеж (результат, возраст в секундах); исключение probe()
+    передаётся всем ожидающим и в кэш не попадает.
+    """
+    if max_age is None:
+        max_age = freshness()
+    with _lock:
+        cached = _cache.get(key)
+        if cached and max_age > 0:
+            age = time.monotonic() - cached[0]
+            if age <= max_age:
+                counters["hits"] += 1
+                return cached[1], age
+        flight = _inflight.get(key)
+        if flight is not None:
+            counters["joins"] += 1
+            owner = False
+        else:
+            counters["misses"] += 1
+            flight = _inflight[key] = _Flight()
+            owner = True
+
+    if not owner:
+        with tracing.span(f"probe {key} (ожидание)"):
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, 0.0
+
+    try:
+        with tracing.span(f"probe {key}"), metrics.timer("probe_seconds", "key", key):
+            flight.value = probe()
+    except Exception as e:
+        flight.error = e
+        raise
+    else:
+        with _lock:
+            _cache[key] = (time.monotonic(), flight.value)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+    return flight.value, 0.0
+
+
+def format_age(age):
+    """Подпись возраста результата: "12 с назад", "3 мин назад"."""
+    age = int(age)
+    if age < 60:
+        return f"{age} с назад"
+    return f"{age // 60} мин назад"
+
+
+def invalidate(key=None):
+    """Сбрасывает результат одной проверки или все."""
+    with _lock:
+        if key is None:
+            _cache.clear()
+        else:
+            _cache.pop(key, None)
+
+
+def reset_counters():
+    with _lock:
+        for key in counters:
+            counters[key] = 0
@@ -0,0 +1,155 @@
+# profiler.py
+"""
+Выборочный профилировщик по запросу (/profile <секунд>).
+Пока профилирование не запущено, ничего не работает и ничего не стоит. Во время замера
+отдельный поток каждые PROFILE_INTERVAL_MS миллисекунд снимает стеки всех потоков
+(sys._current_frames) и считает одинаковые стеки.
+
+Результат:
+  collapsed() - стеки в свёрнутом формате ("поток;модуль:функция;... число") для
+                flamegraph.pl, speedscope, inferno и т.п.,
+  summary()   - самые частые функции бота: сколько выборок функция была
+                последней функцией бота в стеке (собственное время вместе с вызванными
+                ею библиотеками и командами) и сколько - самой верхней функцией стека.
+Выборки простаивающих потоков (ожидание в queue, threading, selectors) в сводку не входят.
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+import jobs
+
+DEFAULT_INTERVAL_MS = 10
+MAX_DURATION = 300   # секунд
+MAX_DEPTH = 100      # кадров стека в одной выборке
+TOP = 15
+
+# Файлы бота - модули в каталоге этого файла
+_BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Верхний кадр в этих модулях стандартной библиотеки - поток ждёт работы
+IDLE_MODULES = ("threading", "queue", "selectors", "socket", "ssl", "socketserver")
+
+_running = threading.Lock()
+_code_info = {}  # code -> (метка, модуль, код бота?); один раз на функцию, а не на каждую выборку
+
+
+class ProfilerBusy(Exception):
+    """Профилирование уже идёт (одновременно выполняется только один замер)."""
+
+
+def interval():
+    try:
+        return max(1, int(os.getenv("PROFILE_INTERVAL_MS", DEFAULT_INTERVAL_MS))) / 1000
+    except ValueError:
+        return DEFAULT_INTERVAL_MS / 1000
+
+
+def _info(code):
+    info = _code_info.get(code)
+    if info is None:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        label = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+        is_bot = os.path.dirname(os.path.abspath(code.co_filename)) == _BOT_DIR
+        info = _code_info[code] = (label, module, is_bot)
+    return info
+
+
+class Profile:
+    """Результат замера: счётчики свёрнутых стеков и функций бота."""
+
+    def __init__(self):
+        self.samples = 0
+        self.duration = 0.0
+        self.interval = interval()
+        self.stacks = Counter()     # "поток;кадр;кадр" -> число выборок
+        self.own = Counter()        # функция бота -> выборок, где она последняя из функций бота
+        self.leaf = Counter()       # функция бота -> выборок, где она самая верхняя в стеке
+        self.idle = 0
+
+    def add(self, thread_name, frame):
+        codes = []
+        while frame is not None and len(codes) < MAX_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        if not codes:
+            return
+        codes.reverse()
+        infos = [_info(code) for code in codes]
+        self.stacks[";".join([thread_name.replace(";", "_")] + [label for label, _, _ in infos])] += 1
+
+        top_label, top_module, top_is_bot = infos[-1]
+        if not top_is_bot and top_module in IDLE_MODULES:
+            self.idle += 1
+            return
+        for label, _, is_bot in reversed(infos):
+            if is_bot:
+                self.own[label] += 1
+                break
+        if top_is_bot:
+            self.leaf[top_label] += 1
+
+    def collapsed(self):
+        """Свёрнутые стеки, по строке на стек, самые частые сверху."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=TOP):
+        """Текстовая сводка для сообщения."""
+        lines = [f"🔥 Профиль: {self.duration:.0f} с, {self.samples} выборок "
+                 f"(шаг {self.interval * 1000:.0f} мс), простоя потоков: {self.idle}"]
+        if not self.own:
+            lines.append("Функции бота в выборках не встретились - бот простаивал.")
+            return "\n".join(lines)
+        lines.append("\nФункции бота (выборок / ~секунд; в скобках - сама функция наверху стека):")
+        for label, count in self.own.most_common(top):
+            lines.append(f"• {label}: {count} / ~{count * self.interval:.1f} с ({self.leaf.get(label, 0)})")
+        return "\n".join(lines)
+
+
+def sample(duration, on_progress=None):
+    """
+    Снимает стеки всех потоков в течение duration секунд (не больше MAX_DURATION).
+    Внутри задания (jobs.run) замер прерывается отменой. Возвращает Profile.
+    Если замер уже идёт - ProfilerBusy.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("Профилирование уже выполняется")
+    try:
+        duration = max(1, min(duration, MAX_DURATION))
+        job = jobs.current()
+        profile = Profile()
+        own_id = threading.get_ident()
+        names = {}
+        started = time.perf_counter()
+        next_sample = started
+        next_progress = started + 5
+        while True:
+            now = time.perf_counter()
+            if now - started >= duration:
+                break
+            if job is not None:
+                job.check()
+            if on_progress and now >= next_progress:
+                on_progress(now - started, duration)
+                next_progress = now + 5
+
+            frames = sys._current_frames()
+            if not frames.keys() <= names.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != own_id:
+                    profile.add(names.get(ident, f"thread-{ident}"), frame)
+            profile.samples += 1
+            del frames
+
+            next_sample += profile.interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.perf_counter()  # не успеваем - без попыток нагнать
+        profile.duration = time.perf_counter() - started
+        return profile
+    finally:
+        _running.release()
@@ -0,0 +1,303 @@
+# progressive_report.py
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+import jobs
+import tracing
+import probe_cache
+import paged_output
+
+logger = logging.getLogger(__name__)
+
+PENDING = "⏳"
+DEFAULT_EDIT_INTERVAL = 1.0  # секунд между правками одного сообщения (лимит Telegram ~1 в секунду)
+FIRST_SEND_DELAY = 0.3  # секунд ожидания перед первым сообщением
+MAX_WORKERS = 8
+
+
+def default_edit_interval():
+    try:
+        return float(os.getenv("REPORT_EDIT_INTERVAL", DEFAULT_EDIT_INTERVAL))
+    except ValueError:
+        return DEFAULT_EDIT_INTERVAL
+
+
+class Section:
+    """
+    Одна строка (или блок) отчёта.
+      key         - имя результата в report.results,
+      label       - подпись; строка выводится как "<label>: <текст>" (None - только текст),
+      probe       - функция без аргументов, собирающая данные (для итоговой секции - функция от results),
+      render      - преобразует результат probe в текст (по умолчанию результат и есть текст);
+                    None вместо текста скрывает секцию,
+      group       - секции одной группы выполняются последовательно в одном потоке
+                    (например, CPU и память из одного запроса WMI - второй берёт данные из кэша),
+      placeholder - текст до получения результата (по умолчанию "<label>: ⏳"),
+      cache_key   - ключ в probe_cache: одновременные отчёты выполняют проверку один раз,
+                    а свежий результат отдаётся повторно (None - без кэша).
+    """
+
+    def __init__(self, key, label, probe, render=None, group=None, placeholder=None, cache_key=None):
+        self.key = key
+        self.label = label
+        self.probe = probe
+        self.render = render
+        self.group = group or key
+        self.placeholder = placeholder or (f"{label}: {PENDING}" if label else PENDING)
+        self.cache_key = cache_key
+
+    def format(self, value):
+        text = self.render(value) if self.render else value
+        if text is None:
+            return None
+        return f"{self.label}: {text}" if self.label else text
+
+    def format_error(self, error):
+        text = f"❌ Ошибка: {error}"
+        return f"{self.label}: {text}" if self.label else text
+
+
+class ProgressiveReport:
+    """
+    Отчёт из нескольких секций, которые собираются параллельно.
+    run() отправляет одно сообщение с заглушками для всех секций и правит его
+    по мере готовности данных; правки объединяются, чтобы не чаще одного раза
+    в edit_interval секунд. collect() собирает тот же отчёт без Telegram.
+    summary - необязательная итоговая секция, probe которой получает словарь results
+    и выполняется после всех остальных.
+    max_age - допустимый возраст результатов секций с cache_key (None - PROBE_CACHE_TTL,
+    0 - только свежие данные); если часть данных взята из кэша, внизу указывается их возраст.
+    Итоговый текст длиннее одного сообщения выводится через paged_output (страницами или
+    файлом filename), промежуточные правки показывают его начало.
+    Внутри задания (jobs.run) проверки выполняются в рамках этого задания, а после его
+    отмены сообщение больше не правится (итог показывает обработчик через show_cancelled).
+    """
+
+    def __init__(self, title, sections, summary=None, separator="\n", summary_separator="\n\n",
+                 edit_interval=None, max_age=None, filename="report.txt"):
+        self.title = title
+        self.sections = list(sections)
+        self.summary = summary
+        self.separator = separator
+        self.summary_separator = summary_separator
+        self.edit_interval = default_edit_interval() if edit_interval is None else edit_interval
+        self.first_send_delay = FIRST_SEND_DELAY
+        self.max_age = max_age
+        self.filename = filename
+        self.results = {}
+        self._texts = {}
+        self._ages = {}
+        self._lock = threading.Lock()
+        self._edit_lock = threading.Lock()
+        self._message = None
+        self._progress_markup = None
+        self._job = None
+        self._timer = None
+        self._last_edit = 0.0
+        self._last_text = None
+        self.edits = 0
+
+    # ---------- текст ----------
+
+    def render(self):
+        with self._lock:
+            parts = [self.title] if self.title else []
+            for section in self.sections:
+                text = self._texts.get(section.key, section.placeholder)
+                if text is not None:
+                    parts.append(text)
+            text = self.separator.join(parts)
+            if self.summary is not None:
+                summary = self._texts.get(self.summary.key, self.summary.placeholder)
+                if summary is not None:
+                    text += self.summary_separator + summary
+            oldest = max(self._ages.values(), default=0)
+        if oldest >= 1:
+            text += f"\n\n🕒 Часть данных получена {probe_cache.format_age(oldest)}"
+        return text
+
+    # ---------- сбор данных ----------
+
+    def collect(self):
+        """Собирает все секции (параллельно) и возвращает готовый текст."""
+        self._run_probes()
+        return self.render()
+
+    def run(self, send, reply_markup=None, send_document=None, progress_markup=None):
+        """
+        send(text, **kwargs) - отправка сообщения (update.message.reply_text или
+        query.edit_message_text), должна вернуть telegram.Message.
+        reply_markup добавляется к итоговому тексту, progress_markup - к промежуточным
+        (например, кнопка отмены задания). send_document (message.reply_document) -
+        для отправки слишком длинного итога файлом. Возвращает итоговый текст.
+        """
+        done = threading.Event()
+        self._job = jobs.current()
+        self._progress_markup = progress_markup
+
+        def collect():
+            try:
+                self._run_probes(on_change=self._schedule_edit)
+            finally:
+                done.set()
+
+        worker = threading.Thread(target=jobs.bind(collect), name="report", daemon=True)
+        worker.start()
+
+        # Короткая пауза перед отправкой: быстрые секции попадают уже в первое сообщение,
+        # а если отчёт собрался целиком - обходимся совсем без правок
+        done.wait(self.first_send_delay)
+        if self._cancelled():
+            return self.render()
+        with self._edit_lock:
+            finished = done.is_set()
+            self._last_text = self.render()
+            if finished:
+                self._message = paged_output.send_text(self._last_text, send, send_document,
+                                                       reply_markup=reply_markup, filename=self.filename)
+            else:
+                self._message = send(_clip(self._last_text), reply_markup=progress_markup)
+            self._last_edit = time.monotonic()
+        if finished and self.render() == self._last_text:
+            return self._last_text
+
+        worker.join()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        # последняя правка тоже соблюдает интервал
+        delay = self._last_edit + self.edit_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        text = self.render()
+        if self._cancelled():
+            return text
+        if len(text) > paged_output.MAX_MESSAGE_LENGTH:
+            paged_output.send_text(text, self._message.edit_text, send_document,
+                                   reply_markup=reply_markup, filename=self.filename, edit=True)
+            self._last_text = text
+            return text
+        self._flush(reply_markup=reply_markup, force=reply_markup is not None or progress_markup is not None,
+                    final=True)
+        return self._last_text
+
+    def show_cancelled(self, reason):
+        """
+        Показывает в сообщении отчёта собранные данные и причину отмены задания.
+        Возвращает False, если сообщение ещё не было отправлено.
+        """
+        with self._edit_lock:
+            if self._message is None:
+                return False
+            text = _clip(f"{self.render()}\n\n⛔ Отменено: {reason}")
+            try:
+                self._message.edit_text(text)
+                self._last_text = text
+            except TelegramError as e:
+                logger.warning("Ошибка обновления отчёта: %s", e)
+            return True
+
+    def _run_probes(self, on_change=None):
+        groups = {}
+        for section in self.sections:
+            groups.setdefault(section.group, []).append(section)
+
+        def run_group(sections):
+            for section in sections:
+                self._complete(section, section.probe)
+                if on_change:
+                    on_change()
+
+        workers = max(1, min(MAX_WORKERS, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report") as pool:
+            for future in [pool.submit(jobs.bind(run_group), sections) for sections in groups.values()]:
+                future.result()
+
+        if self.summary is not None:
+            self._complete(self.summary, lambda: self.summary.probe(dict(self.results)))
+            if on_change:
+                on_change()
+
+    def _complete(self, section, probe):
+        age = 0.0
+        with tracing.span(f"section {section.key}"):
+            try:
+                if section.cache_key:
+                    value, age = probe_cache.get(section.cache_key, probe, max_age=self.max_age)
+                else:
+                    value = probe()
+                text = section.format(value)
+            except Exception as e:
+                value = None
+                text = section.format_error(e)
+        with self._lock:
+            self.results[section.key] = value
+            self._texts[section.key] = text
+            self._ages[section.key] = age
+            done = len(self._texts)
+        if self._job is not None:
+            total = len(self.sections) + (self.summary is not None)
+            self._job.set_progress(f"готово {done} из {total}")
+
+    # ---------- правки сообщения ----------
+
+    def _schedule_edit(self):
+        with self._lock:
+            if self._message is None:
+                return  # сообщение ещё не отправлено - оно сразу будет с актуальным текстом
+            if self._timer is not None:
+                return  # правка уже запланирована - она покажет и эти данные
+            delay = self._last_edit + self.edit_interval - time.monotonic()
+            if delay > 0:
+                self._timer = threading.Timer(delay, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self._flush()
+
+    def _cancelled(self):
+        return self._job is not None and self._job.cancelled
+
+    def _flush(self, reply_markup=None, force=False, final=False):
+        if not final:
+            reply_markup = self._progress_markup
+        with self._edit_lock:
+            with self._lock:
+                self._timer = None
+            if self._cancelled():
+                return
+            text = self.render()
+            if text == self._last_text and not force:
+                return
+            try:
+                self._message.edit_text(_clip(text), reply_markup=reply_markup)
+                self._last_text = text
+                self.edits += 1
+            except RetryAfter as e:
+                # Telegram просит подождать - откладываем правку, следующая покажет актуальный текст
+                time.sleep(e.retry_after)
+                self._last_edit = time.monotonic()
+                if force:
+                    self._message.edit_text(_clip(text), reply_markup=reply_markup)
+                    self._last_text = text
+                    self.edits += 1
+                return
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    logger.warning("Ошибка обновления отчёта: %s", e)
+            except TelegramError as e:
+                logger.warning("Ошибка обновления отчёта: %s", e)
+            self._last_edit = time.monotonic()
+
+
+def _clip(text):
+    """Начало текста, помещающееся в одно сообщение (для промежуточных правок)."""
+    if len(text) <= paged_output.MAX_MESSAGE_LENGTH:
+        return text
+    return text[:paged_output.MAX_MESSAGE_LENGTH - 2] + "\n…"
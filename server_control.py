@@ -1,4 +1,22 @@
-import subprocess
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+import command_runner
+import service_watcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESTART_TIMEOUT = 120  # секунд на каждую фазу (остановка / запуск)
+DEFAULT_RESTART_LOG = "service_restarts.jsonl"
+POLL_MIN_DELAY = 0.25  # первая пауза между опросами состояния, дальше удваивается
+POLL_MAX_DELAY = 2.0
+
+# Коды sc, означающие, что служба уже в нужном состоянии
+SC_ALREADY_STOPPED = 1062
+SC_ALREADY_RUNNING = 1056
 
 def reboot_server():
     """
@@ -6,7 +24,7 @@ def reboot_server():
     """
     try:
         cmd = "shutdown /r /f /t 0"
-        result = subprocess.run(cmd, shell=True)
+        result = command_runner.run(cmd)
         if result.returncode == 0:
             return True, "Сервер уходит в перезагрузку..."
         else:
@@ -14,23 +32,135 @@ def reboot_server():
     except Exception as e:
         return False, f"Исключение при перезагрузке сервера: {str(e)}"
 
-def restart_vpn_service():
+def restart_vpn_service(on_progress=None):
     """
-    Останавливает и запускает службу «Маршрутизация и удаленный доступ» (RemoteAccess).
+    Перезапускает службу «Маршрутизация и удаленный доступ» (RemoteAccess).
+    Возвращает кортеж (успех: bool, сообщение: str), см. restart_service.
     """
+    return restart_service("RemoteAccess", on_progress=on_progress)
+
+def restart_timeout():
     try:
-        # Останавливаем службу
-        cmd_stop = "net stop RemoteAccess"
-        result_stop = subprocess.run(cmd_stop, shell=True)
-        if result_stop.returncode != 0:
-            return False, f"Ошибка при остановке службы (код {result_stop.returncode})."
-
-        # Запускаем службу
-        cmd_start = "net start RemoteAccess"
-        result_start = subprocess.run(cmd_start, shell=True)
-        if result_start.returncode == 0:
-            return True, "Служба маршрутизации и удаленного доступа перезапущена."
-        else:
-            return False, f"Ошибка при запуске службы (код {result_start.returncode})."
+        return float(os.getenv("SERVICE_RESTART_TIMEOUT", DEFAULT_RESTART_TIMEOUT))
+    except ValueError:
+        return DEFAULT_RESTART_TIMEOUT
+
+def restart_log_path():
+    return os.getenv("SERVICE_RESTART_LOG", DEFAULT_RESTART_LOG)
+
+def restart_service(name, on_progress=None, timeout=None):
+    """
+    Перезапускает службу: sc stop, ожидание STOPPED, sc start, ожидание RUNNING.
+    Состояние опрашивается через service_watcher с нарастающей паузой (0.25 с ... 2 с),
+    на каждую фазу отводится timeout секунд (SERVICE_RESTART_TIMEOUT).
+    on_progress(text) вызывается с текстом текущего хода перезапуска (для правки сообщения).
+    Длительность фаз записывается в журнал SERVICE_RESTART_LOG.
+    Возвращает кортеж (успех: bool, сообщение: str).
+    """
+    timeout = timeout or restart_timeout()
+    label = service_watcher.label(name)
+    phases = []  # [(название, длительность, завершена)]
+    record = {"service": name, "started": datetime.now().isoformat(timespec="seconds")}
+
+    def report(current=None):
+        if on_progress:
+            try:
+                on_progress(_render_restart(label, phases, current))
+            except Exception as e:
+                logger.warning("Ошибка отображения хода перезапуска: %s", e)
+
+    try:
+        state = service_watcher.get_state(name, max_age=0)
+        if state is None:
+            return False, f"Служба «{label}» не найдена."
+        report()
+
+        if state != "STOPPED":
+            ok, detail = _run_phase(name, "stop", "STOPPED", "Остановка", timeout, phases, report)
+            record["stop_s"] = phases[-1][1] if phases else None
+            if not ok:
+                return _finish(record, False, f"❌ Служба «{label}»: {detail}")
+
+        ok, detail = _run_phase(name, "start", "RUNNING", "Запуск", timeout, phases, report)
+        record["start_s"] = phases[-1][1]
+        if not ok:
+            return _finish(record, False, f"❌ Служба «{label}»: {detail}")
+
+        total = sum(duration for _, duration, _ in phases)
+        durations = ", ".join(f"{title.lower()} {duration:.1f} с" for title, duration, _ in phases)
+        message = f"✅ Служба «{label}» перезапущена за {total:.1f} с ({durations})."
+        average = average_restart_time(name)
+        if average is not None:
+            message += f"\nСреднее время перезапуска (последние {average[1]}): {average[0]:.1f} с"
+        record["total_s"] = total
+        return _finish(record, True, message)
     except Exception as e:
-        return False, f"Исключение при перезапуске VPN: {str(e)}"
+        return _finish(record, False, f"Исключение при перезапуске службы {label}: {str(e)}")
+
+def _run_phase(name, action, target, title, timeout, phases, report):
+    """Выполняет sc stop/start и ждёт состояния target. Возвращает (успех, описание ошибки)."""
+    began = time.monotonic()
+    result, decoded = command_runner.run_decoded(f'sc {action} "{name}"')
+    if result.returncode not in (0, SC_ALREADY_STOPPED, SC_ALREADY_RUNNING):
+        phases.append((title, time.monotonic() - began, False))
+        output = " ".join(decoded.split())
+        return False, f"{title.lower()} не выполнена (код {result.returncode}). {output}".strip()
+
+    delay = POLL_MIN_DELAY
+    while True:
+        state = service_watcher.get_state(name, max_age=0)
+        elapsed = time.monotonic() - began
+        if state == target:
+            phases.append((title, elapsed, True))
+            report()
+            return True, None
+        if elapsed >= timeout:
+            phases.append((title, elapsed, False))
+            report()
+            return False, f"не перешла в состояние {target} за {timeout:.0f} с (сейчас {state})"
+        report((title, state, elapsed))
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+def _render_restart(label, phases, current=None):
+    lines = [f"🔄 Перезапуск службы «{label}»"]
+    for title, duration, done in phases:
+        lines.append(f"{'✅' if done else '❌'} {title}: {duration:.1f} с")
+    if current:
+        title, state, elapsed = current
+        lines.append(f"⏳ {title}: {state or '?'}, {elapsed:.0f} с")
+    return "\n".join(lines)
+
+def _finish(record, success, message):
+    record["result"] = "ok" if success else "error"
+    record.update({k: round(v, 2) for k, v in record.items() if isinstance(v, float)})
+    try:
+        with open(restart_log_path(), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.error("Не удалось записать журнал перезапусков: %s", e)
+    return success, message
+
+def restart_history(name=None, limit=20):
+    """Последние записи журнала перезапусков (для службы name или всех)."""
+    records = []
+    try:
+        with open(restart_log_path(), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if name is None or record.get("service") == name:
+                    records.append(record)
+    except OSError:
+        return []
+    return records[-limit:]
+
+def average_restart_time(name, last=10):
+    """(среднее время успешного перезапуска, число записей) по последним last перезапускам или None."""
+    totals = [r["total_s"] for r in restart_history(name, limit=last)
+              if r.get("result") == "ok" and r.get("total_s") is not None]
+    if not totals:
+        return None
+    return sum(totals) / len(totals), len(totals)
@@ -0,0 +1,150 @@
+# service_watcher.py
+"""
+Наблюдение за службами Windows.
+Состояния всех служб из списка наблюдения получаются одним перечислением
+(на Windows - один запрос Win32_Service через постоянный PowerShell) и хранятся в памяти;
+экраны бота читают их отсюда. При изменении состояния вызываются подписчики (subscribe).
+"""
+import os
+import logging
+import threading
+
+import probe_cache
+from platform_provider import get_provider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_LIST = [
+    "1C:Enterprise 8.2 Server Agent",
+    "1C:Enterprise 8.3 Server Agent",
+    "RemoteAccess",   # Маршрутизация и удаленный доступ (VPN)
+    "wbengine",       # Block Level Backup Engine Service
+]
+DEFAULT_POLL_INTERVAL = 30  # секунд
+
+SERVICE_LABELS = {
+    "1C:Enterprise 8.2 Server Agent": "Служба 1С 8.2",
+    "1C:Enterprise 8.3 Server Agent": "Служба 1С 8.3",
+    "RemoteAccess": "Маршрутизация и удаленный доступ",
+    "wbengine": "Служба архивации на уровне блоков",
+}
+
+_CACHE_KEY = "services"
+
+_states = {}     # имя службы -> "RUNNING" / "STOPPED" / ... или None (ещё ни разу не получено)
+_extra = []      # службы, добавленные через watch()
+_listeners = []  # функции (имя, старое состояние, новое состояние)
+_lock = threading.Lock()
+
+
+def poll_interval():
+    try:
+        return float(os.getenv("SERVICE_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+    except ValueError:
+        return DEFAULT_POLL_INTERVAL
+
+
+def watch_list():
+    """Список наблюдения: SERVICE_WATCH_LIST (имена через запятую) или список по умолчанию, плюс watch()."""
+    configured = os.getenv("SERVICE_WATCH_LIST")
+    names = [n.strip() for n in configured.split(",") if n.strip()] if configured else list(DEFAULT_WATCH_LIST)
+    with _lock:
+        names.extend(n for n in _extra if n not in names)
+    return names
+
+
+def watch(name):
+    """Добавляет службу в список наблюдения (следующий опрос получит и её состояние)."""
+    with _lock:
+        if name in _extra:
+            return
+        _extra.append(name)
+    probe_cache.invalidate(_CACHE_KEY)
+
+
+def label(name):
+    return SERVICE_LABELS.get(name, name)
+
+
+def subscribe(listener):
+    """listener(имя, старое, новое) вызывается при каждом изменении состояния наблюдаемой службы."""
+    with _lock:
+        _listeners.append(listener)
+
+
+def refresh(max_age=None):
+    """
+    Обновляет состояния всех наблюдаемых служб, если они старше max_age секунд
+    (по умолчанию SERVICE_POLL_INTERVAL; 0 - опросить сейчас).
+    Одновременные вызовы выполняют одно перечисление. Возвращает {имя: состояние}.
+    """
+    if max_age is None:
+        max_age = poll_interval()
+    probe_cache.get(_CACHE_KEY, _poll, max_age=max_age)
+    return states()
+
+
+def states():
+    """Последние известные состояния (без опроса)."""
+    with _lock:
+        return dict(_states)
+
+
+def get_state(name, max_age=None):
+    """Состояние одной службы ("RUNNING", "STOPPED", ...) или None, если служба не найдена."""
+    if name not in watch_list():
+        watch(name)
+    return refresh(max_age).get(name)
+
+
+def get_service_status(service_name):
+    """
+    Статус службы для экранов бота:
+      - "RUNNING", "STOPPED" (или иной статус),
+      - "Не удалось определить статус" - если служба не найдена,
+      - "Ошибка ..." - если опрос не удался.
+    """
+    try:
+        state = get_state(service_name)
+        if state:
+            return state  # RUNNING / STOPPED / PAUSED и т.д.
+        return "Не удалось определить статус"
+    except Exception as e:
+        return f"Ошибка при проверке службы {service_name}: {e}"
+
+
+def start_polling(job_queue, interval=None):
+    """Периодический опрос в JobQueue, чтобы состояния в памяти были свежими и события приходили сами."""
+    interval = interval or poll_interval()
+    return job_queue.run_repeating(lambda context: _poll_safely(), interval=interval, first=0,
+                                   name="service_watcher")
+
+
+def _poll_safely():
+    try:
+        refresh(max_age=0)
+    except Exception as e:
+        logger.error("Ошибка опроса служб: %s", e)
+
+
+def _poll():
+    names = watch_list()
+    # Свежесть задаёт probe_cache в refresh(), поэтому кэш WMI здесь не используется
+    polled = get_provider().service_states(names, max_age=0)
+    with _lock:
+        # Неизвестное состояние (сбой перечисления WMI, sc query не ответил) - не изменение:
+        # остаётся последнее известное, иначе каждый сбой давал бы два ложных оповещения
+        known = {name: polled.get(name) for name in names
+                 if polled.get(name) is not None or _states.get(name) is None}
+        changes = [(name, _states[name], state) for name, state in known.items()
+                   if _states.get(name) is not None and _states[name] != state]
+        _states.update(known)
+        listeners = list(_listeners)
+
+    for change in changes:
+        for listener in listeners:
+            try:
+                listener(*change)
+            except Exception:
+                logger.exception("Ошибка обработчика изменения службы %s", change[0])
+    return polled
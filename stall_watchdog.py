@@ -0,0 +1,207 @@
+# stall_watchdog.py
+"""
+Сторож обработчиков: замечает вызовы, которые выполняются слишком долго (зависли).
+
+instrument_handlers(dp) отмечает начало и конец каждого вызова обработчика; фоновый поток
+(start) раз в WATCHDOG_INTERVAL секунд просматривает идущие вызовы. Вызов дольше
+WATCHDOG_THRESHOLD секунд считается зависшим:
+  - снимается стек его потока,
+  - определяется внешний процесс, завершения которого поток ждёт (command_runner.active_process),
+  - при WATCHDOG_KILL=1 этот процесс завершается вместе с дочерними,
+  - если поток ждёт задание (jobs.execute), то же делается для потоков задания:
+    сама команда выполняется там, а не в потоке обработчика,
+  - подписчики on_stall получают Stall (бот рассылает его администраторам).
+Об одном вызове сообщается один раз. Если поток обработчика ждёт задание (jobs.execute),
+порог отсчитывается от срока задания - за самим заданием следит jobs.
+"""
+import os
+import sys
+import time
+import logging
+import itertools
+import threading
+import traceback
+
+import jobs
+import metrics
+import tracing
+import command_runner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 120  # секунд
+DEFAULT_INTERVAL = 5     # секунд между проверками
+
+_calls = {}  # номер -> _Call
+_calls_lock = threading.Lock()
+_ids = itertools.count(1)
+_stall_hooks = []
+_thread = None
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def threshold():
+    return _env_float("WATCHDOG_THRESHOLD", DEFAULT_THRESHOLD)
+
+
+def kill_enabled():
+    return os.getenv("WATCHDOG_KILL", "").strip().lower() in ("1", "true", "yes")
+
+
+class _Call:
+    """Идущий вызов обработчика."""
+
+    def __init__(self, name, update):
+        self.id = next(_ids)
+        self.name = name
+        self.description = tracing.describe_update(update)
+        chat = getattr(update, "effective_chat", None)
+        self.chat_id = chat.id if chat else None
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.started = time.monotonic()
+        self.reported = False
+
+
+class Stall:
+    """Сведения о зависшем вызове."""
+
+    def __init__(self, call, elapsed, stack, processes=(), killed=False):
+        self.name = call.name
+        self.description = call.description
+        self.chat_id = call.chat_id
+        self.thread_name = call.thread_name
+        self.elapsed = elapsed
+        self.stack = stack                # стеки потока и потоков его задания (пусто, если завершились)
+        self.processes = list(processes)  # внешние команды, которых ждут эти потоки: [(команда, PID)]
+        self.killed = killed
+
+    def summary(self):
+        title = f"{self.name} {self.description}" if self.description else self.name
+        text = f"⚠️ Обработчик {title} выполняется {self.elapsed:.0f} с (поток {self.thread_name})"
+        for command, pid in self.processes:
+            text += f"\nЖдёт процесс PID {pid}: {command}"
+        if self.processes and self.killed:
+            text += "\n🛑 Процесс завершён (WATCHDOG_KILL)"
+        return text
+
+    def report(self):
+        """Сводка и стек потока одним текстом."""
+        return f"{self.summary()}\n\nСтек потока:\n{self.stack or '(поток уже завершился)'}"
+
+
+# ---------- обработчики бота ----------
+
+def instrument_handlers(dispatcher):
+    """Каждый вызов обработчика диспетчера виден сторожу."""
+    metrics.wrap_handlers(dispatcher, _watched_handler, "_watchdog_wrapped")
+
+
+def _watched_handler(callback):
+    name = getattr(callback, "__name__", "handler")
+
+    def watched(update, context):
+        call = _Call(name, update)
+        with _calls_lock:
+            _calls[call.id] = call
+        try:
+            return callback(update, context)
+        finally:
+            with _calls_lock:
+                _calls.pop(call.id, None)
+
+    watched.__name__ = name
+    return watched
+
+
+def on_stall(hook):
+    """hook(stall) вызывается для каждого зависшего вызова (один раз на вызов)."""
+    _stall_hooks.append(hook)
+
+
+def running():
+    """Идущие вызовы: (имя, что нажато, секунд)."""
+    now = time.monotonic()
+    with _calls_lock:
+        return [(call.name, call.description, now - call.started) for call in _calls.values()]
+
+
+# ---------- проверка ----------
+
+def _limit(call, waited_jobs):
+    """Момент (monotonic), после которого вызов считается зависшим."""
+    job = waited_jobs.get(call.thread_id)
+    start = max(call.started, job.deadline) if job is not None else call.started
+    return start + threshold()
+
+
+def check():
+    """Одна проверка идущих вызовов; возвращает список новых Stall."""
+    now = time.monotonic()
+    waited_jobs = {job.waiter: job for job in jobs.running() if job.waiter is not None}
+    with _calls_lock:
+        stalled = [call for call in _calls.values() if not call.reported and now >= _limit(call, waited_jobs)]
+        for call in stalled:
+            call.reported = True
+    if not stalled:
+        return []
+
+    frames = sys._current_frames()
+    stalls = []
+    for call in stalled:
+        # Обработчик, ждущий задание, сам ничего не запускает - команды выполняются в потоках задания
+        job = waited_jobs.get(call.thread_id)
+        threads = [(call.thread_id, None)] + (job.threads() if job is not None else [])
+        stacks = []
+        active = []
+        for thread_id, thread_name in threads:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stack = "".join(traceback.format_stack(frame))
+                stacks.append(stack if thread_name is None else f"Поток задания {thread_name}:\n{stack}")
+            found = command_runner.active_process(thread_id)
+            if found is not None and all(found[1] is not proc for _, proc in active):
+                active.append(found)
+        killed = False
+        if active and kill_enabled():
+            for _, proc in active:
+                command_runner.kill_process_tree(proc)
+            killed = True
+        stall = Stall(call, now - call.started, "\n".join(stacks),
+                      processes=[(command, proc.pid) for command, proc in active], killed=killed)
+        logger.error("%s", stall.report())
+        stalls.append(stall)
+    del frames
+
+    for stall in stalls:
+        for hook in list(_stall_hooks):
+            try:
+                hook(stall)
+            except Exception as e:
+                logger.warning("Ошибка обработчика зависания: %s", e)
+    return stalls
+
+
+def start(interval=None):
+    """Запускает фоновую проверку (повторный вызов ничего не делает)."""
+    global _thread
+    if _thread is not None:
+        return
+    interval = interval or _env_float("WATCHDOG_INTERVAL", DEFAULT_INTERVAL)
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                check()
+            except Exception as e:
+                logger.error("Ошибка проверки зависших обработчиков: %s", e)
+
+    _thread = threading.Thread(target=loop, name="watchdog", daemon=True)
+    _thread.start()
@@ -0,0 +1,207 @@
+# synthetic_outputs.py
+"""
+Синтетические выводы консольных команд русской Windows Server 2008 R2.
+Нужны для замеров парсеров на больших объёмах (тысячи сеансов, версий, хопов):
+каждая функция возвращает сырые байты в консольной кодировке cp866 - так,
+как их отдаёт subprocess без перекодирования.
+"""
+import random
+from datetime import datetime, timedelta
+
+CONSOLE_ENCODING = "cp866"
+
+_USER_NAMES = ["ivanov", "petrov", "sidorova", "buh01", "kassa", "admin.local", "Иванова Мария"]
+
+
+def _encode(lines):
+    return ("\r\n".join(lines) + "\r\n").encode(CONSOLE_ENCODING, errors="replace")
+
+
+def _user(rnd, index):
+    return f"{rnd.choice(_USER_NAMES)}{index}"
+
+
+def qwinsta(count, seed=0):
+    """qwinsta: count RDP-сеансов плюс служебные строки services/console/listener."""
+    rnd = random.Random(seed)
+    lines = [
+        " СЕАНС             ПОЛЬЗОВАТЕЛЬ             ID  СТАТУС  ТИП         УСТРОЙСТВО",
+        " services                                    0  Диск",
+        " console                                     1  Подкл.",
+    ]
+    for i in range(count):
+        state = rnd.choice(["Активно", "Активно", "Диск", "Подкл."])
+        session = f"rdp-tcp#{i}" if state != "Диск" else ""
+        marker = ">" if i == 0 else " "
+        lines.append(f"{marker}{session:<18}{_user(rnd, i):<25}{i + 2:>3}  {state:<8}rdpwd")
+    lines.append(" rdp-tcp                                 65536  Прием")
+    return _encode(lines)
+
+
+def netsh_ras_clients(count, seed=0):
+    """netsh ras show client: count подключённых VPN-клиентов."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        hours, minutes, seconds = rnd.randrange(48), rnd.randrange(60), rnd.randrange(60)
+        lines += [
+            f"Пользователь:        SRV\\{_user(rnd, i)}",
+            f"Длительность:        {hours // 24} дн., {hours % 24:02}:{minutes:02}:{seconds:02}",
+            f"IP-адрес:            10.8.{i // 250}.{i % 250 + 2}",
+            "",
+        ]
+    lines.append("Команда выполнена успешно.")
+    return _encode(lines)
+
+
+def ping(count, host="ya.ru", address="87.250.250.242", seed=0):
+    """ping -n count: count ответов и блок статистики."""
+    rnd = random.Random(seed)
+    times = [rnd.randrange(5, 60) for _ in range(count)]
+    lines = [f"Обмен пакетами с {host} [{address}] с 32 байтами данных:"]
+    lines += [f"Ответ от {address}: число байт=32 время={t}мс TTL=55" for t in times]
+    lines += [
+        "",
+        f"Статистика Ping для {address}:",
+        f"    Пакетов: отправлено = {count}, получено = {count}, потеряно = 0",
+        "    (0% потерь)",
+        "Приблизительное время приема-передачи в мс:",
+        f"    Минимальное = {min(times)}мсек, Максимальное = {max(times)} мсек, "
+        f"Среднее = {sum(times) // count} мсек",
+    ]
+    return _encode(lines)
+
+
+def tracert(hops, host="ya.ru", address="87.250.250.242", seed=0):
+    """tracert -h hops: hops строк маршрута, часть узлов не отвечает."""
+    rnd = random.Random(seed)
+    lines = [
+        f"Трассировка маршрута к {host} [{address}]",
+        f"с максимальным числом прыжков {hops}:",
+        "",
+    ]
+    for hop in range(1, hops + 1):
+        if rnd.random() < 0.1:
+            lines.append(f"{hop:>3}     *        *        *     Превышен интервал ожидания для запроса.")
+            continue
+        t = [rnd.randrange(1, 80) for _ in range(3)]
+        lines.append(f"{hop:>3}  {t[0]:>3} ms  {t[1]:>3} ms  {t[2]:>3} ms  10.{hop // 250}.{hop % 250}.1")
+    lines += ["", "Трассировка завершена."]
+    return _encode(lines)
+
+
+def wbadmin_versions(count, seed=0):
+    """wbadmin get versions: count версий архивации, по одной в сутки."""
+    rnd = random.Random(seed)
+    lines = [
+        "wbadmin 1.0 - Программа архивации для командной строки",
+        "(C) Корпорация Майкрософт (Microsoft Corporation), 2004.",
+        "",
+    ]
+    start = datetime(2024, 1, 1, 23, 0)
+    for i in range(count):
+        moment = start + timedelta(days=i, minutes=rnd.randrange(30))
+        lines += [
+            f"Время архивации: {moment:%d.%m.%Y %H:%M}",
+            "Конечный объект архивации: Несъемный диск с именем E:",
+            f"Идентификатор версии: {moment:%m/%d/%Y-%H:%M}",
+            "Возможно восстановление: Тома, Файлы, Приложения, Исходное состояние системы",
+            "Каталог моментальных снимков: Нет",
+            "",
+        ]
+    return _encode(lines)
+
+
+def schtasks_list(count, task_name="\\Microsoft\\Windows\\Backup\\Microsoft-Windows-WindowsBackup", seed=0):
+    """schtasks /query /fo LIST /v: count задач, искомая задача - последняя."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        name = task_name if i == count - 1 else f"\\Задача{i}"
+        lines += [
+            "",
+            "Имя узла:                             SRV",
+            f"Имя задачи:                           {name}",
+            f"Время следующего запуска:             01.01.2025 {rnd.randrange(24):02}:00:00",
+            "Состояние:                            Готово",
+            "Режим входа в систему:                Только интерактивный",
+            f"Тип расписания:                       {rnd.choice(['Ежедневно', 'Еженедельно'])}",
+            f"Время запуска:                        {rnd.randrange(24):02}:00:00",
+            "Дни:                                  Каждый день",
+        ]
+    return _encode(lines)
+
+
+def net_user(username="ivanov", groups=1, seed=0):
+    """net user <имя>: карточка пользователя с groups локальными группами."""
+    rnd = random.Random(seed)
+    lines = [
+        f"Имя пользователя                  {username}",
+        "Полное имя                        Иванов Иван",
+        "Комментарий",
+        "Учетная запись активна            Yes",
+        "Срок действия учетной записи      Никогда",
+        "",
+        "Последний пароль задан            01.09.2024 9:12:45",
+        "Последний вход                    09.09.2025 10:15:00",
+        "",
+        "Разрешенные часы входа            Все",
+        "",
+    ]
+    names = [f"*Группа{i}" for i in range(groups)]
+    rnd.shuffle(names)
+    first = True
+    for i in range(0, len(names), 2):
+        prefix = "Членство в локальных группах      " if first else " " * 34
+        lines.append(prefix + "".join(f"{n:<25}" for n in names[i:i + 2]))
+        first = False
+    lines += ["Членство в глобальных группах     *Отсутствует", "Команда выполнена успешно."]
+    return _encode(lines)
+
+
+def sc_query(service_name, state="RUNNING"):
+    """sc query <служба>: состояние службы (ключевые слова sc не локализуются)."""
+    codes = {"RUNNING": 4, "STOPPED": 1, "START_PENDING": 2, "STOP_PENDING": 3}
+    lines = [
+        "",
+        f"Имя_службы: {service_name}",
+        "        Тип                : 10  WIN32_OWN_PROCESS",
+        f"        Состояние          : {codes.get(state, 4)}  {state}",
+        "                                (STOPPABLE, NOT_PAUSABLE, IGNORES_SHUTDOWN)",
+        "        Код_выхода_win32   : 0  (0x0)",
+        "        Код_выхода_службы  : 0  (0x0)",
+        "        Контрольная_точка  : 0x0",
+        "        Ожидание           : 0x0",
+    ]
+    return _encode(lines)
+
+
+def schtasks_csv(task_names):
+    """schtasks /query /fo CSV: задачи в состоянии Ready."""
+    lines = ['"Имя задачи","Время следующего запуска","Состояние"']
+    lines += [f'"{name}","01.01.2025 23:00:00","Ready"' for name in task_names]
+    return _encode(lines)
+
+
+def wbadmin_status(running=False):
+    """wbadmin get status."""
+    lines = [
+        "wbadmin 1.0 - Программа архивации для командной строки",
+        "(C) Корпорация Майкрософт (Microsoft Corporation), 2004.",
+        "",
+        "Операция архивации выполняется." if running else "В данный момент операция архивации не выполняется.",
+    ]
+    return _encode(lines)
+
+
+def nslookup(host="ya.ru", address="87.250.250.242"):
+    """nslookup <узел>: ответ DNS-сервера (заголовки полей не локализуются)."""
+    lines = [
+        "Server:  dns.local",
+        "Address:  10.0.0.1",
+        "",
+        "Non-authoritative answer:",
+        f"Name:    {host}",
+        f"Address:  {address}",
+    ]
+    return _encode(lines)
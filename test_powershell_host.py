@@ -0,0 +1,100 @@
+# test_powershell_host.py
+"""
+Проверка PowerShellHost и PowerShellPool без Windows: вместо PowerShell запускается
+подставной рабочий процесс на Python с тем же протоколом (bench_fakes.fake_powershell_command).
+Запуск: python -m pytest test_powershell_host.py (или python -m unittest test_powershell_host).
+"""
+import time
+import threading
+import unittest
+
+from bench_fakes import fake_powershell_command
+from powershell_host import PowerShellHost, PowerShellPool
+
+
+class PowerShellHostTest(unittest.TestCase):
+    def setUp(self):
+        self.host = PowerShellHost(command=fake_powershell_command(), request_timeout=5, idle_timeout=0)
+        self.addCleanup(self.host.stop)
+
+    def test_process_is_reused(self):
+        self.assertEqual(self.host.run("hello"), (True, "hello"))
+        first = self.host.run("pid")
+        second = self.host.run("pid")
+        self.assertEqual(first, second)
+        self.assertEqual(self.host.spawns, 1)
+
+    def test_error_response(self):
+        self.assertEqual(self.host.run("fail access denied"), (False, "access denied"))
+        self.assertTrue(self.host.alive)
+
+    def test_timeout_kills_and_restarts(self):
+        ok, output = self.host.run("sleep 5", timeout=0.3)
+        self.assertFalse(ok)
+        self.assertIn("время ожидания", output)
+        self.assertFalse(self.host.alive)
+        self.assertEqual(self.host.run("after"), (True, "after"))
+        self.assertEqual(self.host.spawns, 2)
+
+    def test_crash_restarts(self):
+        ok, output = self.host.run("crash")
+        self.assertFalse(ok)
+        self.assertIn("аварийно", output)
+        self.assertEqual(self.host.run("after"), (True, "after"))
+        self.assertEqual(self.host.spawns, 2)
+
+    def test_idle_shutdown(self):
+        host = PowerShellHost(command=fake_powershell_command(), request_timeout=5, idle_timeout=0.2)
+        self.addCleanup(host.stop)
+        host.run("hello")
+        timer = host._idle_timer
+        timer.join(2)
+        self.assertFalse(host.alive)
+
+    def test_stale_idle_timer_keeps_process(self):
+        host = PowerShellHost(command=fake_powershell_command(), request_timeout=5, idle_timeout=60)
+        self.addCleanup(host.stop)
+        host.run("hello")
+        # Таймер, сработавший после того, как следующий запрос запустил новый таймер, процесс не трогает
+        stale = threading.Thread(target=host._idle_shutdown)
+        stale.start()
+        stale.join()
+        self.assertTrue(host.alive)
+
+
+class PowerShellPoolTest(unittest.TestCase):
+    def test_busy_pool_times_out(self):
+        pool = PowerShellPool(size=1, command=fake_powershell_command(), request_timeout=5, idle_timeout=0)
+        self.addCleanup(pool.stop)
+        busy = threading.Thread(target=pool.run, args=("sleep 1",))
+        busy.start()
+        self.addCleanup(busy.join)
+        while pool._idle.qsize():
+            time.sleep(0.01)
+        ok, output = pool.run("hello", timeout=0.2)
+        self.assertFalse(ok)
+        self.assertIn("заняты", output)
+
+    def test_sequential_requests_reuse_one_process(self):
+        pool = PowerShellPool(size=2, command=fake_powershell_command(), request_timeout=5, idle_timeout=0)
+        self.addCleanup(pool.stop)
+        self.assertEqual(pool.run("first"), (True, "first"))
+        self.assertEqual(pool.run("second"), (True, "second"))
+        self.assertEqual(sum(host.spawns for host in pool.hosts), 1)
+
+    def test_parallel_requests_use_second_process(self):
+        pool = PowerShellPool(size=2, command=fake_powershell_command(), request_timeout=5, idle_timeout=0)
+        self.addCleanup(pool.stop)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.run("sleep 0.3")))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([ok for ok, _ in results], [True, True])
+        self.assertEqual(sum(host.spawns for host in pool.hosts), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
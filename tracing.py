@@ -0,0 +1,267 @@
+# tracing.py
+"""
+Трассировка нажатий: на каждое обновление - трасса, внутри неё вложенные участки (span):
+обработчик -> секция отчёта / проверка probe_cache -> команда -> перекодирование -> разбор -> запрос к Bot API.
+Текущий участок хранится в потоке; потоки отчётов и заданий получают его через bind()
+(jobs.bind делает это сам). Вне трассы span() ничего не стоит.
+
+Трасса завершается, когда закрыты все её участки, включая работу в других потоках.
+Самые медленные TRACE_KEEP трасс хранятся в памяти (/traces), а подписчики on_finish
+получают каждую завершённую трассу (например, чтобы отправить её администратору).
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEEP = 20
+MAX_SPANS = 300   # участков в одной трассе; остальные только считаются
+BAR_WIDTH = 16
+
+_local = threading.local()
+_ids = itertools.count(1)
+_slowest = []     # куча (длительность, id, Trace)
+_finish_hooks = []
+_lock = threading.Lock()
+
+
+def keep():
+    try:
+        return int(os.getenv("TRACE_KEEP", DEFAULT_KEEP))
+    except ValueError:
+        return DEFAULT_KEEP
+
+
+class Span:
+    def __init__(self, trace, name, parent):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    def __init__(self, name, chat_id=None):
+        self.id = next(_ids)
+        self.name = name
+        self.chat_id = chat_id
+        self.created = datetime.now()
+        self.spans = []
+        self.dropped = 0
+        self.duration = None
+        self._open = 0
+        self._lock = threading.Lock()
+        self.root = self._open_span(name, None)
+
+    @property
+    def finished(self):
+        return self.duration is not None
+
+    def _open_span(self, name, parent):
+        span = Span(self, name, parent)
+        with self._lock:
+            self._open += 1
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def _hold(self):
+        with self._lock:
+            self._open += 1
+
+    def _release(self):
+        with self._lock:
+            self._open -= 1
+            if self._open or self.finished:
+                return
+            self.duration = max(span.end or span.start for span in self.spans) - self.root.start
+        _store(self)
+
+
+def _store(trace):
+    with _lock:
+        entry = (trace.duration, trace.id, trace)
+        if len(_slowest) < keep():
+            heapq.heappush(_slowest, entry)
+        elif _slowest and entry > _slowest[0]:
+            heapq.heapreplace(_slowest, entry)
+        hooks = list(_finish_hooks)
+    for hook in hooks:
+        try:
+            hook(trace)
+        except Exception as e:
+            logger.warning("Ошибка обработчика трассы: %s", e)
+
+
+def current_span():
+    return getattr(_local, "span", None)
+
+
+@contextmanager
+def trace(name, chat_id=None):
+    """Новая трасса с корневым участком name (внутри уже идущей трассы - просто вложенный участок)."""
+    if current_span() is not None:
+        with span(name) as inner:
+            yield inner
+        return
+    new = Trace(name, chat_id=chat_id)
+    _local.span = new.root
+    try:
+        yield new.root
+    finally:
+        new.root.end = time.perf_counter()
+        _local.span = None
+        new._release()
+
+
+@contextmanager
+def span(name):
+    """Вложенный участок текущей трассы; вне трассы ничего не делает."""
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace._open_span(name, parent)
+    _local.span = child
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _local.span = parent
+        parent.trace._release()
+
+
+def traced(name):
+    """Декоратор: вызов функции - участок name текущей трассы."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_span() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """
+    Оборачивает func так, чтобы в другом потоке она продолжала текущую трассу.
+    Трасса не завершается, пока обёрнутая функция не выполнится.
+    """
+    parent = current_span()
+    if parent is None:
+        return func
+    parent.trace._hold()
+
+    def bound(*args, **kwargs):
+        previous = current_span()
+        _local.span = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.span = previous
+            parent.trace._release()
+    return bound
+
+
+# ---------- обработчики бота ----------
+
+def instrument_handlers(dispatcher):
+    """Каждый вызов обработчика диспетчера открывает трассу "<обработчик> <что нажато>"."""
+    metrics.wrap_handlers(dispatcher, _traced_handler, "_trace_wrapped")
+
+
+def _traced_handler(callback):
+    name = getattr(callback, "__name__", "handler")
+
+    def handler(update, context):
+        chat = getattr(update, "effective_chat", None)
+        with trace(f"{name} {describe_update(update)}".strip(), chat_id=chat.id if chat else None):
+            return callback(update, context)
+
+    handler.__name__ = name
+    return handler
+
+
+def describe_update(update):
+    """Что нажато: текст сообщения или callback_data (коротко)."""
+    if getattr(update, "callback_query", None) is not None:
+        text = update.callback_query.data or ""
+    elif getattr(update, "message", None) is not None:
+        text = update.message.text or ""
+    else:
+        return ""
+    return f"«{text[:40]}»" if text else ""
+
+
+def on_finish(hook):
+    """hook(trace) вызывается для каждой завершённой трассы."""
+    with _lock:
+        _finish_hooks.append(hook)
+
+
+def slowest():
+    """Самые медленные трассы, начиная с самой долгой."""
+    with _lock:
+        return [trace for _, _, trace in sorted(_slowest, reverse=True)]
+
+
+def get(trace_id):
+    with _lock:
+        for _, _, trace in _slowest:
+            if trace.id == trace_id:
+                return trace
+    return None
+
+
+def reset():
+    with _lock:
+        _slowest.clear()
+
+
+# ---------- вывод ----------
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds < 0.01 else f"{seconds * 1000:.0f}"
+
+
+def render_waterfall(trace):
+    """Водопад трассы: участки по времени начала, отступ - вложенность, полоса - положение на шкале."""
+    total = trace.duration if trace.finished else trace.root.duration
+    lines = [f"🔎 Трасса #{trace.id}: {trace.name} - {_ms(total)} мс "
+             f"({trace.created.strftime('%H:%M:%S')})"]
+    scale = total or 1e-9
+    with trace._lock:
+        spans = sorted(trace.spans, key=lambda s: s.start)
+    for span in spans:
+        offset = span.start - trace.root.start
+        begin = min(BAR_WIDTH - 1, int(offset / scale * BAR_WIDTH))
+        width = max(1, min(BAR_WIDTH - begin, round(span.duration / scale * BAR_WIDTH)))
+        bar = "·" * begin + "█" * width + "·" * (BAR_WIDTH - begin - width)
+        lines.append(f"{bar} {'  ' * span.depth}{span.name} +{_ms(offset)} / {_ms(span.duration)} мс")
+    if trace.dropped:
+        lines.append(f"… и ещё {trace.dropped} участков")
+    return "\n".join(lines)
+
+
+def describe(trace):
+    """Одна строка для списка трасс."""
+    return f"#{trace.id} {trace.created.strftime('%H:%M:%S')} {trace.name} - {_ms(trace.duration or 0)} мс"
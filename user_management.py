@@ -1,10 +1,50 @@
 # user_management.py
-import subprocess
-import re
-import chardet
 import random
 import string
+import logging
+import tracing
+import wmi_query
+import command_runner
+import backend_strategy
+from output_grammar import Grammar, Field
+from command_runner import decode_output
+from platform_provider import get_provider
 from rdp_sessions import get_sessions, logoff_session
+from powershell_host import quote
+
+logger = logging.getLogger(__name__)
+
+def _net_user(username, argument):
+    """net user <имя> <аргумент>; возвращает (успех, вывод команды)"""
+    # Имена с пробелами - в кавычках (тот же подход, что в VPN модуле)
+    name = f'"{username}"' if " " in username else username
+    result = command_runner.run(f"net user {name} {argument}")
+    return result.returncode == 0, decode_output(result.stdout or result.stderr)
+
+def _powershell(script):
+    # Скрипт выполняется в постоянном процессе PowerShell, значения экранируются quote()
+    return command_runner.run_powershell(script)
+
+# net user или PowerShell: какой способ работает на этом сервере и какой быстрее,
+# запоминает backend_strategy (заведомо неработающий способ не запускается каждый раз)
+_set_password = backend_strategy.Strategy("user.password", [
+    ("net user", lambda username, password: _net_user(username, f'"{password}"')),
+    ("PowerShell", lambda username, password: _powershell(
+        f"Set-LocalUser -Name {quote(username)} "
+        f"-Password (ConvertTo-SecureString {quote(password)} -AsPlainText -Force)")),
+])
+_disable_account = backend_strategy.Strategy("user.block", [
+    ("net user", lambda username: _net_user(username, "/active:no")),
+    ("PowerShell", lambda username: _powershell(f"Disable-LocalUser -Name {quote(username)}")),
+])
+_enable_account = backend_strategy.Strategy("user.unblock", [
+    ("net user", lambda username: _net_user(username, "/active:yes")),
+    ("PowerShell", lambda username: _powershell(f"Enable-LocalUser -Name {quote(username)}")),
+])
+
+def _via(backend):
+    """Пометка способа в сообщении: основной способ (net user) не указывается"""
+    return "" if backend == "net user" else f" ({backend})"
 
 def generate_password():
     """
@@ -44,42 +84,11 @@ def change_user_password(username):
         # Генерируем новый пароль
         new_password = generate_password()
         
-        # Применяем тот же подход к именам что и в других функциях
-        if " " in username:
-            cmd = f'net user "{username}" "{new_password}"'
-        else:
-            cmd = f'net user {username} "{new_password}"'
-            
-        result = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = result.stdout or result.stderr
-        
-        # Применяем тот же подход декодирования что в других функциях
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        if result.returncode == 0:
-            message = f"Пароль пользователя {username} успешно изменен"
+        success, output, backend = _set_password.run(username, new_password)
+        if success:
+            message = f"Пароль пользователя {username} успешно изменен{_via(backend)}"
             return True, message, new_password
-        else:
-            # Если основная команда не сработала, попробуем PowerShell как backup
-            try:
-                # Экранируем спецсимволы для PowerShell - упрощенная версия
-                safe_password = new_password.replace('"', "'")  # заменяем двойные кавычки на одинарные
-                ps_cmd = f'powershell -Command "Set-LocalUser -Name \\"{username}\\" -Password (ConvertTo-SecureString \\"{safe_password}\\" -AsPlainText -Force)"'
-                ps_result = subprocess.run(ps_cmd, capture_output=True, shell=True)
-                if ps_result.returncode == 0:
-                    message = f"Пароль пользователя {username} успешно изменен (PowerShell)"
-                    return True, message, new_password
-                else:
-                    return False, f"Ошибка смены пароля: {decoded_output}", ""
-            except Exception:
-                return False, f"Ошибка смены пароля: {decoded_output}", ""
+        return False, f"Ошибка смены пароля: {output}", ""
             
     except Exception as e:
         return False, f"Исключение при смене пароля пользователя {username}: {str(e)}", ""
@@ -90,45 +99,24 @@ def get_users():
     Возвращает список словарей с информацией о пользователях.
     """
     try:
-        # Получаем список пользователей через wmic
-        cmd = 'wmic useraccount where "LocalAccount=True" get Name,Disabled'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Используем тот же подход что и в VPN модуле
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        # Если chardet уверенно определил кодировку, используем её;
-        # иначе пробуем cp866 как самую распространённую для старых русских Windows.
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        lines = [line.strip() for line in decoded_output.splitlines() if line.strip()]
+        # Получаем список пользователей через провайдера платформы
+        # (на Windows - общий пакетный слой WMI, имена с пробелами приходят целиком)
         users = []
-        
-        if len(lines) > 1:
-            # Пропускаем заголовок
-            for line in lines[1:]:
-                parts = line.split(None, 1)  # Разделяем только на 2 части: статус и полное имя
-                if len(parts) >= 2:
-                    disabled = parts[0].upper() == "TRUE"
-                    full_name = parts[1].strip()  # Полное имя пользователя со всеми пробелами
-                    
-                    # Исключаем системные учетки
-                    if full_name.lower() not in ['administrator', 'guest', 'defaultaccount', 'администратор', 'гость']:
-                        users.append({
-                            "name": full_name,  # Сохраняем полное имя!
-                            "disabled": disabled,
-                            "status": "Заблокирован" if disabled else "Активен"
-                        })
+        for account in get_provider().users():
+            full_name = account["name"]
+            disabled = account["disabled"]
+
+            # Исключаем системные учетки
+            if full_name.lower() not in ['administrator', 'guest', 'defaultaccount', 'администратор', 'гость']:
+                users.append({
+                    "name": full_name,
+                    "disabled": disabled,
+                    "status": "Заблокирован" if disabled else "Активен"
+                })
         
         return users
     except Exception as e:
-        print(f"Ошибка получения списка пользователей: {e}")
+        logger.error("Ошибка получения списка пользователей: %s", e)
         return []
 
 def block_user(username):
@@ -159,45 +147,19 @@ def block_user(username):
         else:
             messages.append(f"Активных RDP сессий пользователя {username} не найдено")
         
-        # 2. Блокируем учетную запись (используем подход как в VPN модуле)
-        if " " in username:
-            cmd = f'net user "{username}" /active:no'
+        # 2. Блокируем учетную запись
+        success, output, backend = _disable_account.run(username)
+        if success:
+            messages.append(f"Учетная запись {username} заблокирована{_via(backend)}")
         else:
-            cmd = f"net user {username} /active:no"
-            
-        result = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = result.stdout or result.stderr
-        
-        # Применяем тот же подход декодирования что в VPN модуле
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        if result.returncode == 0:
-            messages.append(f"Учетная запись {username} заблокирована")
-            return True, "\n".join(messages)
-        else:
-            # Если основная команда не сработала, попробуем PowerShell как backup
-            try:
-                ps_cmd = f'powershell -Command "Disable-LocalUser -Name \\"{username}\\""'
-                ps_result = subprocess.run(ps_cmd, capture_output=True, shell=True)
-                if ps_result.returncode == 0:
-                    messages.append(f"Учетная запись {username} заблокирована (PowerShell)")
-                    return True, "\n".join(messages)
-                else:
-                    messages.append(f"Ошибка блокировки учетной записи: {decoded_output}")
-                    return False, "\n".join(messages)
-            except Exception:
-                messages.append(f"Ошибка блокировки учетной записи: {decoded_output}")
-                return False, "\n".join(messages)
+            messages.append(f"Ошибка блокировки учетной записи: {output}")
+        return success, "\n".join(messages)
             
     except Exception as e:
         return False, f"Исключение при блокировке пользователя {username}: {str(e)}"
+    finally:
+        # Состояние учетной записи изменилось - список пользователей нужно перечитать
+        wmi_query.invalidate(wmi_query.USERS.key)
 
 def unblock_user(username):
     """
@@ -205,41 +167,16 @@ def unblock_user(username):
     Возвращает кортеж (успех: bool, сообщение: str)
     """
     try:
-        # Используем тот же подход что в VPN модуле
-        if " " in username:
-            cmd = f'net user "{username}" /active:yes'
-        else:
-            cmd = f"net user {username} /active:yes"
-            
-        result = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = result.stdout or result.stderr
-        
-        # Применяем тот же подход декодирования что в VPN модуле
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
-        
-        if result.returncode == 0:
-            return True, f"Учетная запись {username} разблокирована"
-        else:
-            # Если основная команда не сработала, попробуем PowerShell как backup
-            try:
-                ps_cmd = f'powershell -Command "Enable-LocalUser -Name \\"{username}\\""'
-                ps_result = subprocess.run(ps_cmd, capture_output=True, shell=True)
-                if ps_result.returncode == 0:
-                    return True, f"Учетная запись {username} разблокирована (PowerShell)"
-                else:
-                    return False, f"Ошибка разблокировки учетной записи: {decoded_output}"
-            except Exception:
-                return False, f"Ошибка разблокировки учетной записи: {decoded_output}"
+        success, output, backend = _enable_account.run(username)
+        if success:
+            return True, f"Учетная запись {username} разблокирована{_via(backend)}"
+        return False, f"Ошибка разблокировки учетной записи: {output}"
             
     except Exception as e:
         return False, f"Исключение при разблокировке пользователя {username}: {str(e)}"
+    finally:
+        # Состояние учетной записи изменилось - список пользователей нужно перечитать
+        wmi_query.invalidate(wmi_query.USERS.key)
 
 def get_user_info(username):
     """
@@ -248,39 +185,31 @@ def get_user_info(username):
     """
     try:
         cmd = f'net user "{username}"'
-        proc = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = proc.stdout
-        
-        # Применяем тот же подход декодирования что в VPN модуле
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-        
-        # Если chardet уверенно определил кодировку, используем её;
-        # иначе пробуем cp866 как самую распространённую для старых русских Windows.
-        if detected_encoding and confidence > 0.5:
-            decoded_output = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_output = raw_bytes.decode("cp866", errors="replace")
+        proc = command_runner.run(cmd)
+        decoded_output = decode_output(proc.stdout)
         
         if proc.returncode != 0:
             return None
             
-        # Ищем статус учетной записи
-        active_match = re.search(r"Учетная запись активна\s+(.+)", decoded_output, re.IGNORECASE)
-        if not active_match:
-            active_match = re.search(r"Account active\s+(.+)", decoded_output, re.IGNORECASE)
-            
-        last_logon_match = re.search(r"Последний вход\s+(.+)", decoded_output, re.IGNORECASE)
-        if not last_logon_match:
-            last_logon_match = re.search(r"Last logon\s+(.+)", decoded_output, re.IGNORECASE)
-        
-        return {
-            "name": username,
-            "active": active_match.group(1).strip() if active_match else "Неизвестно",
-            "last_logon": last_logon_match.group(1).strip() if last_logon_match else "Неизвестно"
-        }
+        return _parse_user_info(username, decoded_output)
         
     except Exception as e:
-        print(f"Ошибка получения информации о пользователе {username}: {e}")
-        return None
\ No newline at end of file
+        logger.error("Ошибка получения информации о пользователе %s: %s", username, e)
+        return None
+
+# Карточка net user <имя>: статус учетной записи и последний вход
+NET_USER_GRAMMAR = Grammar("net user", [
+    Field("active", {"ru-RU": ("Учетная запись активна",), "en-US": ("Account active",)}),
+    Field("last_logon", {"ru-RU": ("Последний вход",), "en-US": ("Last logon",)}),
+])
+
+@tracing.traced("parse net user")
+def _parse_user_info(username, output):
+    """Извлекает статус учетной записи и последний вход из вывода net user"""
+    # Разбор останавливается, как только найдены оба поля
+    info = NET_USER_GRAMMAR.first(output)
+    return {
+        "name": username,
+        "active": info.get("active", "Неизвестно"),
+        "last_logon": info.get("last_logon", "Неизвестно")
+    }
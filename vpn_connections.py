@@ -1,6 +1,12 @@
-import subprocess
-import re
-import chardet
+import logging
+
+import tracing
+import bot_logging
+import command_runner
+from command_runner import decode_output
+from output_grammar import Grammar, Field
+
+logger = logging.getLogger(__name__)
 
 def get_vpn_sessions():
     """
@@ -8,59 +14,12 @@ def get_vpn_sessions():
     Сохраняем результат в vpn_sessions.txt.
     """
     try:
-        # 1. Вызываем netsh без text=True и без encoding=..., чтобы получить сырые байты
-        result = subprocess.run(
-            "netsh ras show client",
-            capture_output=True,
-            shell=True
-        )
-        raw_bytes = result.stdout
-
-        # 2. Определяем кодировку с помощью chardet
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
-
-        print(f"Определена кодировка: {detected_encoding}, уверенность: {confidence}")
-
-        # 3. Если chardet уверенно определил кодировку, используем её;
-        #    иначе пробуем cp866 как самую распространённую для старых русских Windows.
-        if detected_encoding and confidence > 0.5:
-            decoded_text = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_text = raw_bytes.decode("cp866", errors="replace")
-
-        # 4. Разбиваем результат на строки
-        lines = [line.strip() for line in decoded_text.splitlines() if line.strip()]
-
-        print("Вывод netsh ras show client (raw -> декодированный):")
-        for line in lines:
-            print(f"Строка: {line}")
-
-        vpn_sessions = []
-        current_user = None
-        current_duration = None
-
-        # Пример: ищем "Пользователь:" и "Длительность:"
-        # Если у вас в выводе другие ключевые слова (например, "Время:"), подставьте их.
-        for line in lines:
-            if line.startswith("Пользователь:"):
-                if current_user is not None:
-                    vpn_sessions.append({
-                        "name": current_user,
-                        "connect_time": current_duration or "Неизвестно"
-                    })
-                current_user = line.replace("Пользователь:", "").strip()
-                current_duration = None
-            elif line.startswith("Длительность:"):
-                current_duration = line.replace("Длительность:", "").strip()
-
-        # Добавляем последнего пользователя, если он есть
-        if current_user is not None:
-            vpn_sessions.append({
-                "name": current_user,
-                "connect_time": current_duration or "Неизвестно"
-            })
+        # Вызываем netsh и декодируем сырые байты (chardet, запасной вариант - cp866)
+        result, decoded_text = command_runner.run_decoded("netsh ras show client")
+
+        bot_logging.payload(logger, "Вывод netsh ras show client", decoded_text)
+
+        vpn_sessions = _parse_ras_clients(decoded_text)
 
         # Сохраняем в файл
         with open("vpn_sessions.txt", "w", encoding="utf-8") as f:
@@ -71,17 +30,30 @@ def get_vpn_sessions():
         return vpn_sessions
 
     except Exception as e:
-        print(f"Ошибка при получении VPN-соединений: {e}")
+        logger.error("Ошибка при получении VPN-соединений: %s", e)
         return []
 
+# netsh ras show client: блок на каждого клиента, начинается с имени пользователя
+RAS_CLIENTS_GRAMMAR = Grammar("netsh ras show client", [
+    Field("name", {"ru-RU": ("Пользователь",), "en-US": ("User name",)}, start=True),
+    Field("connect_time", {"ru-RU": ("Длительность",), "en-US": ("Duration",)}),
+])
+
+@tracing.traced("parse ras")
+def _parse_ras_clients(output):
+    """
+    Разбирает вывод netsh ras show client в список [{"name", "connect_time"}, ...].
+    """
+    return [{"name": client["name"], "connect_time": client.get("connect_time", "Неизвестно")}
+            for client in RAS_CLIENTS_GRAMMAR.records(output) if "name" in client]
+
 def reset_vpn_session(user_name):
     """
     Читает vpn_sessions.txt, ищет user_name, выполняет команду netsh ras set client <user> disconnect
     с автоматическим определением кодировки для проверки результата.
     """
     try:
-        print("### НАЧАЛО СБРОСА VPN-СЕССИИ ###")
-        print(f"Попытка отключения пользователя: {user_name}")
+        logger.info("Сброс VPN-сессии пользователя %s", user_name)
 
         # Читаем файл vpn_sessions.txt
         try:
@@ -113,41 +85,19 @@ def reset_vpn_session(user_name):
         else:
             cmd = f"netsh ras set client {matched_user} disconnect"
 
-        print(f"Команда для выполнения: {cmd}")
-        result = subprocess.run(cmd, capture_output=True, shell=True)
-        raw_bytes = result.stdout
-
-        # Аналогично определяем кодировку для результата
-        detected = chardet.detect(raw_bytes)
-        detected_encoding = detected.get("encoding", None)
-        confidence = detected.get("confidence", 0)
+        logger.debug("Выполняется команда: %s", cmd)
+        result = command_runner.run(cmd)
+        decoded_stdout = decode_output(result.stdout)
 
-        if detected_encoding and confidence > 0.5:
-            decoded_stdout = raw_bytes.decode(detected_encoding, errors="replace")
-        else:
-            decoded_stdout = raw_bytes.decode("cp866", errors="replace")
-
-        print("Вывод netsh ras set client disconnect (декодированный):")
-        print(decoded_stdout)
-        print(f"STDERR: {result.stderr}")
-        print(f"Код возврата: {result.returncode}")
+        logger.info("netsh ras set client disconnect: код возврата %s", result.returncode)
+        bot_logging.payload(logger, "Вывод netsh ras set client disconnect", decoded_stdout)
+        bot_logging.payload(logger, "STDERR netsh ras set client disconnect", result.stderr)
 
         # Теперь проверяем, отключён ли пользователь
-        verification = subprocess.run(
-            "netsh ras show client", capture_output=True, shell=True
-        )
-        ver_raw = verification.stdout
-        ver_detected = chardet.detect(ver_raw)
-        ver_enc = ver_detected.get("encoding", None)
-        ver_conf = ver_detected.get("confidence", 0)
-
-        if ver_enc and ver_conf > 0.5:
-            ver_decoded = ver_raw.decode(ver_enc, errors="replace")
-        else:
-            ver_decoded = ver_raw.decode("cp866", errors="replace")
+        verification = command_runner.run("netsh ras show client")
+        ver_decoded = decode_output(verification.stdout)
 
-        print("Проверка после сброса (netsh ras show client):")
-        print(ver_decoded)
+        bot_logging.payload(logger, "Проверка после сброса (netsh ras show client)", ver_decoded)
 
         if result.returncode == 0:
             # Проверяем, исчезла ли строка "Пользователь: matched_user"
@@ -161,6 +111,5 @@ def reset_vpn_session(user_name):
                 f"Код ошибки: {result.returncode}, Вывод: {decoded_stdout or result.stderr}"
             )
     except Exception as e:
+        logger.exception("Исключение при сбросе VPN-сессии %s", user_name)
         return False, f"Исключение при сбросе VPN-сессии {user_name}: {str(e)}"
-    finally:
-        print("### КОНЕЦ СБРОСА VPN-СЕССИИ ###")
@@ -0,0 +1,266 @@
+# wmi_query.py
+import os
+import csv
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+import tracing
+import command_runner
+from powershell_host import quote
+
+DEFAULT_CACHE_TTL = 5  # секунд, в течение которых результат запроса считается свежим
+
+_QUERY_MARKER = "@@QUERY "
+_ERROR_MARKER = "@@ERROR "
+
+
+def wmi_bool(value):
+    return value.strip().upper() == "TRUE"
+
+
+def wmi_datetime(value):
+    """
+    Разбирает дату WMI (CIM_DATETIME) вида "20250301121530.500000+180"
+    в datetime с часовым поясом (смещение указано в минутах).
+    """
+    value = value.strip()
+    stamp = datetime.strptime(value[:14], "%Y%m%d%H%M%S")
+    offset = value[21:]
+    if offset and offset[0] in "+-":
+        try:
+            minutes = int(offset)
+            stamp = stamp.replace(tzinfo=timezone(timedelta(minutes=minutes)))
+        except ValueError:
+            pass
+    return stamp
+
+
+class WmiQuery:
+    """
+    Описание запроса к одному классу WMI.
+      key        - имя результата в кэше (общее для всех модулей),
+      wmi_class  - класс WMI (Win32_LogicalDisk и т.п.),
+      properties - словарь {свойство: функция преобразования} (int, float, str, wmi_bool...),
+      where      - необязательное условие WQL (DriveType=3).
+    """
+
+    def __init__(self, key, wmi_class, properties, where=None):
+        self.key = key
+        self.wmi_class = wmi_class
+        self.properties = properties
+        self.where = where
+
+    def powershell(self):
+        """Фрагмент скрипта PowerShell, выводящий результат запроса в CSV."""
+        props = ",".join(self.properties)
+        cmd = f"Get-WmiObject -Class {self.wmi_class} -Property {props}"
+        if self.where:
+            cmd += f" -Filter {quote(self.where)}"
+        return (f"Write-Output {quote(_QUERY_MARKER + self.key)}\n"
+                f"try {{ {cmd} | Select-Object {props} | ConvertTo-Csv -NoTypeInformation }}\n"
+                f"catch {{ Write-Output ({quote(_ERROR_MARKER)} + $_.Exception.Message) }}\n")
+
+    def wmic(self):
+        """Эквивалентная команда wmic (запасной путь, если PowerShell недоступен)."""
+        cmd = f"wmic path {self.wmi_class}"
+        if self.where:
+            cmd += f' where "{self.where}"'
+        return cmd + f" get {','.join(self.properties)} /value"
+
+    def convert(self, raw):
+        """Преобразует словарь строковых значений в типизированную запись."""
+        # wmic и PowerShell могут вернуть имена свойств в разном регистре
+        raw = {key.lower(): value for key, value in raw.items()}
+        record = {}
+        for name, converter in self.properties.items():
+            value = raw.get(name.lower())
+            if value is None or value.strip() == "":
+                record[name] = None
+                continue
+            try:
+                record[name] = converter(value)
+            except (TypeError, ValueError):
+                record[name] = None
+        return record
+
+
+# ============== СТАНДАРТНЫЕ ЗАПРОСЫ ==============
+
+CPU = WmiQuery("cpu", "Win32_Processor", {"LoadPercentage": int})
+OS = WmiQuery("os", "Win32_OperatingSystem", {
+    "FreePhysicalMemory": int,
+    "TotalVisibleMemorySize": int,
+    "LastBootUpTime": wmi_datetime,
+})
+DISKS = WmiQuery("disks", "Win32_LogicalDisk", {"DeviceID": str, "FreeSpace": int, "Size": int},
+                 where="DriveType=3")
+USERS = WmiQuery("users", "Win32_UserAccount", {"Name": str, "Disabled": wmi_bool},
+                 where="LocalAccount=True")
+# Все службы одним перечислением: наблюдаемые ищутся по имени или отображаемому имени
+SERVICES = WmiQuery("services", "Win32_Service", {"Name": str, "DisplayName": str, "State": str})
+# Сырой (накопительный) счётчик байт: скорость считается по разнице двух замеров
+NIC = WmiQuery("nic", "Win32_PerfRawData_Tcpip_NetworkInterface",
+               {"Name": str, "BytesTotalPersec": int})
+
+
+# ============== КЭШ РЕЗУЛЬТАТОВ ==============
+
+_cache = {}  # key -> (monotonic-время получения, [записи])
+_cache_lock = threading.Lock()
+
+
+def cache_ttl():
+    try:
+        return float(os.getenv("WMI_CACHE_TTL", DEFAULT_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_CACHE_TTL
+
+
+def query(wmi_query, max_age=None):
+    """
+    Возвращает список типизированных записей для одного запроса.
+    max_age - допустимый возраст результата в кэше (0 - всегда свежий запрос).
+    """
+    return query_many([wmi_query], max_age=max_age)[wmi_query.key]
+
+
+def query_many(queries, max_age=None):
+    """
+    Выполняет несколько запросов WMI за один вызов PowerShell.
+    Запросы, результат которых есть в кэше и не старше max_age секунд,
+    повторно не выполняются. Возвращает словарь {key: [записи]}.
+    """
+    if max_age is None:
+        max_age = cache_ttl()
+    now = time.monotonic()
+    results = {}
+    missing = []
+    with _cache_lock:
+        for q in queries:
+            cached = _cache.get(q.key)
+            if cached and max_age > 0 and now - cached[0] <= max_age:
+                results[q.key] = cached[1]
+            else:
+                missing.append(q)
+
+    if missing:
+        fetched = _fetch(missing)
+        fetched_at = time.monotonic()
+        with _cache_lock:
+            for q in missing:
+                records = fetched.get(q.key)
+                if records is None:
+                    records = []
+                else:
+                    _cache[q.key] = (fetched_at, records)
+                results[q.key] = records
+    return results
+
+
+def prefetch(*queries):
+    """Заранее выполняет группу запросов одним вызовом, чтобы последующие query() брали данные из кэша."""
+    query_many(queries)
+
+
+def invalidate(key=None):
+    """Сбрасывает кэш для одного запроса или целиком."""
+    with _cache_lock:
+        if key is None:
+            _cache.clear()
+        else:
+            _cache.pop(key, None)
+
+
+# ============== ВЫПОЛНЕНИЕ И РАЗБОР ==============
+
+def _fetch(queries):
+    """
+    Выполняет запросы пакетом через постоянный процесс PowerShell.
+    Если PowerShell недоступен, выполняет каждый запрос через wmic по отдельности.
+    Возвращает {key: [записи]}; для запросов с ошибкой ключ отсутствует.
+    """
+    script = "".join(q.powershell() for q in queries)
+    ok, output = command_runner.run_powershell(script)
+    if ok and _QUERY_MARKER in output:
+        return parse_batch_output(output, queries)
+
+    results = {}
+    for q in queries:
+        records = _fetch_wmic(q)
+        if records is not None:
+            results[q.key] = records
+    return results
+
+
+@tracing.traced("parse wmi")
+def parse_batch_output(output, queries):
+    """
+    Разбирает вывод пакетного скрипта за один проход по строкам.
+    Секции начинаются с маркера "@@QUERY <key>", внутри - CSV с заголовком.
+    """
+    by_key = {q.key: q for q in queries}
+    results = {}
+    current = None
+    header = None
+
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(_QUERY_MARKER):
+            current = by_key.get(line[len(_QUERY_MARKER):].strip())
+            header = None
+            if current is not None:
+                results[current.key] = []
+            continue
+        if current is None:
+            continue
+        if line.startswith(_ERROR_MARKER):
+            results.pop(current.key, None)
+            current = None
+            continue
+        row = next(csv.reader([line]))
+        if header is None:
+            header = row
+            continue
+        results[current.key].append(current.convert(dict(zip(header, row))))
+    return results
+
+
+def _fetch_wmic(wmi_query):
+    """Запасной путь: один запрос через wmic в формате /value (Имя=Значение)."""
+    try:
+        proc, decoded = command_runner.run_decoded(wmi_query.wmic())
+        if proc.returncode != 0:
+            return None
+        return parse_value_output(decoded, wmi_query)
+    except Exception:
+        return None
+
+
+@tracing.traced("parse wmi")
+def parse_value_output(output, wmi_query):
+    """
+    Разбирает вывод wmic /value. Записи разделены пустыми строками,
+    повтор уже встреченного свойства тоже начинает новую запись.
+    """
+    records = []
+    current = {}
+    # wmic завершает строки последовательностью \r\r\n, из-за чего splitlines()
+    # видит лишние пустые строки между свойствами одной записи
+    for line in output.replace("\r\r\n", "\n").splitlines():
+        line = line.strip()
+        if not line or "=" not in line:
+            if current:
+                records.append(wmi_query.convert(current))
+                current = {}
+            continue
+        name, value = line.split("=", 1)
+        if name in current:
+            records.append(wmi_query.convert(current))
+            current = {}
+        current[name] = value
+    if current:
+        records.append(wmi_query.convert(current))
+    return records